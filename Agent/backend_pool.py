@@ -0,0 +1,315 @@
+# backend_pool.py
+# 多个 Ollama 实例之间的负载均衡：OllamaChatModel / SimpleVectorStore 传入 backends=BackendPool([...])
+# 后，每个请求都从池子里挑一个 base_url。
+#
+# - 路由：在健康的后端里选“在飞请求数”最少的（相同时轮转），请求结束后归还；
+# - 会话亲和：带 affinity_key（ChatSession 每个会话一个）的请求尽量落到上次的后端，复用它的 KV cache；
+#   只有当该后端比最空闲的后端多出 affinity_slack 个以上在飞请求时才迁移；
+# - 熔断：每个后端一个 CircuitBreaker。连续 eject_after 次失败（连接失败 / 超时 / 5xx / 对冲请求判定的卡死）
+#   后熔断（open），eject_s 秒内不再分配请求；之后进入半开（half_open），放行一个试探请求或由后台探测线程
+#   GET /api/tags，成功则恢复（closed），失败则重新熔断。全部后端都熔断时退化为在所有后端里选（fail open）。
+#
+# 用法：
+#   pool = BackendPool(["http://10.0.0.11:11434", "http://10.0.0.12:11434"]).start()
+#   model = OllamaChatModel("gpt-oss:20b", backends=pool)
+#   vs = SimpleVectorStore(embed_model="nomic-embed-text", backends=pool)
+#   print(pool.snapshot())
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Union
+import threading
+import time
+
+import requests
+
+from llm_metrics import Histogram
+
+
+class RequestCancelled(Exception):
+    """
+    调用方主动放弃的请求（对冲请求的输家）：在 lease 块内抛出时既不算成功也不算失败。
+    """
+
+
+class CircuitBreaker:
+    """
+    closed（正常）-> 连续 failure_threshold 次失败 -> open（拒绝）-> reset_s 后 half_open（只放行一个试探请求）
+    -> 试探成功回到 closed，失败回到 open。非线程安全，由 BackendPool 的锁保护。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_s: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_s = reset_s
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def allows(self, now: float) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return now - self.opened_at >= self.reset_s
+        return not self.trial_in_flight
+
+    def on_acquire(self, now: float) -> None:
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_s:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self.trial_in_flight = True
+
+    def on_success(self) -> bool:
+        """
+        返回 True 表示熔断恢复（open / half_open -> closed）。
+        """
+        self.consecutive_failures = 0
+        self.trial_in_flight = False
+        if self.state != self.CLOSED:
+            self.state = self.CLOSED
+            return True
+        return False
+
+    def on_failure(self, now: float) -> bool:
+        """
+        返回 True 表示本次失败触发了熔断（closed / half_open -> open）。
+        """
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold
+        ):
+            self.state = self.OPEN
+            self.opened_at = now
+            return True
+        if self.state == self.OPEN:
+            self.opened_at = now   # 仍然不可用：重新计时
+        return False
+
+
+class Backend:
+    def __init__(self, url: str, breaker: CircuitBreaker):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.breaker = breaker
+        self.latency = Histogram()
+        self.stats = {"requests": 0, "errors": 0, "ejections": 0, "readmissions": 0, "probe_failures": 0, "stalls": 0}
+
+    @property
+    def healthy(self) -> bool:
+        return self.breaker.state == CircuitBreaker.CLOSED
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """
+    只有连接失败 / 超时 / 5xx 算后端故障；4xx（请求本身有问题）和调用方的解析错误不算。
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError):
+        resp = error.response
+        return resp is None or resp.status_code >= 500
+    return False
+
+
+class BackendPool:
+    def __init__(
+        self,
+        urls: Union[str, List[str]],
+        eject_after: int = 3,
+        eject_s: float = 30.0,
+        probe_interval_s: float = 5.0,
+        probe_timeout_s: float = 2.0,
+        affinity_slack: int = 2,
+        max_affinity_keys: int = 10000,
+    ):
+        if isinstance(urls, str):
+            urls = [u.strip() for u in urls.split(",") if u.strip()]
+        if not urls:
+            raise ValueError("BackendPool 至少需要一个 base_url")
+        self.backends: List[Backend] = [Backend(u, CircuitBreaker(eject_after, eject_s)) for u in urls]
+        self.eject_after = max(1, eject_after)
+        self.eject_s = eject_s
+        self.probe_interval_s = probe_interval_s
+        self.probe_timeout_s = probe_timeout_s
+        self.affinity_slack = affinity_slack
+        self.max_affinity_keys = max_affinity_keys
+
+        self._lock = threading.Lock()
+        self._rr = 0
+        self._affinity: "OrderedDict[str, Backend]" = OrderedDict()
+        self.stats = {"affinity_hits": 0, "affinity_moves": 0, "fail_open": 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ==== 选择 / 归还 ====
+
+    def acquire(self, affinity_key: Optional[str] = None, exclude: Optional[Backend] = None) -> Backend:
+        """
+        exclude：重试时排除刚失败的后端（只剩它一个时仍然会选它）。
+        """
+        with self._lock:
+            now = time.time()
+            pool = [b for b in self.backends if b is not exclude] or self.backends
+            candidates = [b for b in pool if b.breaker.allows(now)]
+            if not candidates:
+                self.stats["fail_open"] += 1
+                candidates = pool
+            least = min(b.outstanding for b in candidates)
+
+            chosen = None
+            if affinity_key is not None:
+                sticky = self._affinity.get(affinity_key)
+                if sticky is not None and sticky in candidates and sticky.outstanding <= least + self.affinity_slack:
+                    chosen = sticky
+                    self.stats["affinity_hits"] += 1
+                    self._affinity.move_to_end(affinity_key)
+                elif sticky is not None:
+                    self.stats["affinity_moves"] += 1
+            if chosen is None:
+                # 在飞请求最少的后端里轮转，避免总是打到列表里的第一个
+                n = len(candidates)
+                for i in range(n):
+                    b = candidates[(self._rr + i) % n]
+                    if b.outstanding == least:
+                        chosen = b
+                        self._rr = (self._rr + i + 1) % n
+                        break
+                if affinity_key is not None:
+                    self._affinity[affinity_key] = chosen
+                    self._affinity.move_to_end(affinity_key)
+                    while len(self._affinity) > self.max_affinity_keys:
+                        self._affinity.popitem(last=False)
+
+            chosen.breaker.on_acquire(now)
+            chosen.outstanding += 1
+            chosen.stats["requests"] += 1
+            return chosen
+
+    def release(self, backend: Backend, latency_s: float, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+            if isinstance(error, RequestCancelled):
+                backend.breaker.trial_in_flight = False
+                return
+            if error is None:
+                backend.latency.observe(latency_s)
+                self._record_success(backend)
+                return
+            backend.stats["errors"] += 1
+            if is_backend_failure(error):
+                self._record_failure(backend)
+            else:
+                backend.breaker.trial_in_flight = False   # 请求本身的问题，不影响熔断判断
+
+    def _record_success(self, backend: Backend) -> None:
+        # 调用方持有 _lock
+        if backend.breaker.on_success():
+            backend.stats["readmissions"] += 1
+            print(f"[BackendPool] 恢复 {backend.url}")
+
+    def _record_failure(self, backend: Backend) -> None:
+        # 调用方持有 _lock
+        if backend.breaker.on_failure(time.time()):
+            backend.stats["ejections"] += 1
+            print(f"[BackendPool] 熔断 {backend.url}（连续 {backend.breaker.consecutive_failures} 次失败）")
+
+    def find(self, url: Optional[str]) -> Optional[Backend]:
+        return next((b for b in self.backends if b.url == url), None)
+
+    def report_stall(self, url: Optional[str]) -> None:
+        """
+        对冲请求判定某个后端上的请求卡死（超过截止时间仍无首 token，且被另一个后端抢先）：计一次失败。
+        """
+        backend = self.find(url)
+        if backend is None:
+            return
+        with self._lock:
+            backend.stats["stalls"] += 1
+            self._record_failure(backend)
+
+    @contextmanager
+    def lease(self, affinity_key: Optional[str] = None, exclude: Optional[Backend] = None) -> Iterator[Backend]:
+        """
+        with pool.lease(key) as backend: requests.post(backend.url + ...)
+        块内抛出的异常会计入该后端的失败次数（仅连接失败 / 超时 / 5xx）。
+        """
+        backend = self.acquire(affinity_key, exclude)
+        t0 = time.time()
+        try:
+            yield backend
+        except BaseException as e:
+            self.release(backend, time.time() - t0, e)
+            raise
+        self.release(backend, time.time() - t0)
+
+    # ==== 健康探测 ====
+
+    def probe(self, backend: Backend) -> bool:
+        try:
+            resp = requests.get(f"{backend.url}/api/tags", timeout=self.probe_timeout_s)
+            resp.raise_for_status()
+            return True
+        except Exception:
+            return False
+
+    def probe_once(self) -> None:
+        """
+        探测一遍：熔断满 eject_s 的后端探测成功则恢复；正常后端探测失败计一次失败。
+        """
+        now = time.time()
+        for b in self.backends:
+            with self._lock:
+                if b.breaker.state != CircuitBreaker.CLOSED and not b.breaker.allows(now):
+                    continue
+            ok = self.probe(b)
+            with self._lock:
+                if ok:
+                    if b.breaker.state != CircuitBreaker.CLOSED:
+                        self._record_success(b)
+                else:
+                    b.stats["probe_failures"] += 1
+                    self._record_failure(b)
+
+    def _probe_loop(self) -> None:
+        while not self._stop.wait(self.probe_interval_s):
+            try:
+                self.probe_once()
+            except Exception as e:
+                print(f"[BackendPool] 健康探测异常：{e}")
+
+    def start(self) -> "BackendPool":
+        if self._thread is None and self.probe_interval_s > 0:
+            self._thread = threading.Thread(target=self._probe_loop, name="backend_probe", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    # ==== 统计 ====
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backends": [
+                    {
+                        "url": b.url,
+                        "healthy": b.healthy,
+                        "breaker": b.breaker.state,
+                        "outstanding": b.outstanding,
+                        **b.stats,
+                        "latency_s": {k: v for k, v in b.latency.snapshot().items() if k != "buckets"},
+                    }
+                    for b in self.backends
+                ],
+                "affinity_keys": len(self._affinity),
+                **self.stats,
+            }
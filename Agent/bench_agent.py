@@ -0,0 +1,511 @@
+# bench_agent.py
+# Agent 包热点路径的微基准：
+#   - split_text_into_chunks / load_knowledge_from_folder（合成语料，规模递增）
+#   - 近重复 chunk 去重：每篇笔记带两个修订版的语料上，索引大小与 top-k 上下文里的重复片段（去重开 / 关）
+#   - SimpleVectorStore.add_documents / similarity_search（Ollama embedding 与本地 local-tfidf；全库与按标签过滤）
+#   - RAGChatSession.ask 的 RAG prompt 拼装（走本地假 Ollama，延迟可配）
+#   - tool_get_policy_history（大 experiments.jsonl）
+#   - ExperimentStore 批量追加（各 fsync 策略）vs 每条记录 open/append/close
+#   - BackendPool：多个单槽位假 Ollama 实例上的并发会话吞吐（实例数 1 / 2 / 4）
+#   - 对冲请求：15% 请求偶发卡顿的两个假实例上，单次调用延迟的 p95（对冲开 / 关）
+#   - JSON 提取 / 校验 / 流式扫描
+#
+# 所有合成数据用固定随机种子生成，结果保存为 JSON，便于不同提交之间对比：
+#   python bench_agent.py --out bench_results/after.json
+#   python bench_agent.py --quick --compare bench_results/before.json
+
+from typing import Any, Callable, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+import local_tools
+from backend_pool import BackendPool
+from experiment_store import ExperimentStore
+from chat_session import ChatSession, RAGChatSession
+from fake_ollama import FakeOllamaServer, DEFAULT_REPLY
+from hedging import HedgePolicy
+from kb_loader import split_text_into_chunks, load_knowledge_from_folder
+from llm_metrics import estimate_tokens
+from near_dedup import dedup_near_duplicates
+from ollama_client import OllamaChatModel, Message
+from policy_agent import build_policy_decision_schema, DEFAULT_POLICY_LIBRARY
+from structured_output import extract_json_block, parse_and_validate, JsonStreamScanner
+from vectorstore import SimpleVectorStore, Document
+
+
+BENCH_SEED = 20240501
+
+_WORDS = (
+    "O-RAN near-RT RIC non-RT rApp xApp macro small cell UE throughput latency energy "
+    "sleep beam handover load threshold policy KPI 5p 95p URLLC video gaming voice "
+    "调度 小区 休眠 能耗 吞吐 时延 波束 切换 负载 门限 策略 意图"
+).split()
+
+
+# ==== 计时 ====
+
+def _timeit(fn: Callable[[], Any], repeat: int, min_time_s: float = 0.0) -> Dict[str, Any]:
+    """
+    调用 fn 至少 repeat 次（总时长不足 min_time_s 时继续调用），返回每次耗时的统计（秒）。
+    """
+    fn()  # 预热
+    times: List[float] = []
+    t_begin = time.perf_counter()
+    while len(times) < repeat or (time.perf_counter() - t_begin) < min_time_s:
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return {
+        "n": len(times),
+        "min_s": times[0],
+        "median_s": statistics.median(times),
+        "mean_s": statistics.fmean(times),
+        "p95_s": times[min(len(times) - 1, int(round(0.95 * (len(times) - 1))))],
+    }
+
+
+# ==== 合成数据 ====
+
+def synth_text(rng: random.Random, n_chars: int) -> str:
+    paras = []
+    total = 0
+    while total < n_chars:
+        sent_count = rng.randint(2, 8)
+        para = "。".join(
+            " ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 20))) for _ in range(sent_count)
+        )
+        paras.append(para)
+        total += len(para) + 2
+    return "\n\n".join(paras)[:n_chars]
+
+
+def synth_corpus(folder: str, rng: random.Random, n_files: int, chars_per_file: int) -> None:
+    os.makedirs(folder, exist_ok=True)
+    for i in range(n_files):
+        ext = ".md" if i % 3 == 0 else ".txt"
+        with open(os.path.join(folder, f"doc_{i:05d}{ext}"), "w", encoding="utf-8") as f:
+            f.write(synth_text(rng, chars_per_file))
+
+
+def synth_experiments(path: str, rng: random.Random, n_records: int) -> None:
+    intents = ["保证视频业务体验", "夜间节能", "提升 5% UE 吞吐", "URLLC 低时延", "热点区域扩容"]
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n_records):
+            rec = {
+                "exp_id": f"exp_{i:06d}",
+                "intent_desc": rng.choice(intents),
+                "policy": {
+                    "nonRT_params": {"macro_load_low_thresh": 0.3, "max_small_cells_on": rng.randint(2, 8)},
+                    "nearRT_params": {"video_to_small_threshold": rng.random()},
+                    "beam_params": {"numBeamsPerCell": rng.choice([4, 8, 16]), "scheme": "default"},
+                },
+                "kpi": {
+                    "sum_tput_Mbps": round(rng.uniform(50, 150), 2),
+                    "ue_tput_5p": round(rng.uniform(0.5, 5), 2),
+                    "estimated_energy_W": round(rng.uniform(300, 700), 1),
+                    "sleep_ratio_small_cells": round(rng.random(), 2),
+                },
+            }
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        # 末尾放一条独特意图，测“扫到文件尾才命中”的最坏情况
+        f.write(json.dumps({"exp_id": "exp_last", "intent_desc": "罕见意图_tail", "kpi": {}}, ensure_ascii=False) + "\n")
+
+
+# ==== 各项基准 ====
+
+def bench_chunking(rng: random.Random, sizes: List[int], repeat: int) -> List[Dict[str, Any]]:
+    out = []
+    for n in sizes:
+        text = synth_text(rng, n)
+        stats = _timeit(lambda: split_text_into_chunks(text, max_chars=500, overlap=100), repeat)
+        out.append({"name": "split_text_into_chunks", "params": {"chars": n}, **stats})
+    return out
+
+
+def bench_load_folder(rng: random.Random, workdir: str, file_counts: List[int], repeat: int) -> List[Dict[str, Any]]:
+    out = []
+    for n in file_counts:
+        folder = os.path.join(workdir, f"kb_{n}")
+        synth_corpus(folder, rng, n, chars_per_file=4000)
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = _timeit(lambda: load_knowledge_from_folder(folder), repeat)
+        out.append({"name": "load_knowledge_from_folder", "params": {"files": n, "chars_per_file": 4000}, **stats})
+    return out
+
+
+def synth_revision(rng: random.Random, text: str, n_edits: int = 3) -> str:
+    words = text.split(" ")
+    for _ in range(n_edits):
+        words[rng.randrange(len(words))] = rng.choice(_WORDS)
+    return " ".join(words)
+
+
+def bench_kb_dedup(rng: random.Random, workdir: str, file_counts: List[int], repeat: int) -> List[Dict[str, Any]]:
+    """
+    每篇笔记另存两个修订版（各改几个词）。对比去重开 / 关时：加载耗时、索引 chunk 数 / token 数，
+    以及 16 个查询的 top-4 上下文中“与同一结果里其它片段近重复”的冗余片段数和上下文 token 数（平均每个查询）。
+    """
+    out = []
+    for n in file_counts:
+        folder = os.path.join(workdir, f"kb_rev_{n}")
+        os.makedirs(folder, exist_ok=True)
+        for i in range(n):
+            text = synth_text(rng, 4000)
+            for rev, body in enumerate((text, synth_revision(rng, text), synth_revision(rng, text))):
+                with open(os.path.join(folder, f"note_{i:05d}_v{rev}.md"), "w", encoding="utf-8") as f:
+                    f.write(body)
+        queries = [synth_text(rng, 80) for _ in range(16)]
+
+        for threshold in (None, 0.85):
+            with contextlib.redirect_stdout(io.StringIO()):
+                stats = _timeit(lambda: load_knowledge_from_folder(folder, dedup_threshold=threshold), repeat)
+                docs = load_knowledge_from_folder(folder, dedup_threshold=threshold)
+                vs = SimpleVectorStore(embed_model="local-tfidf")
+                vs.add_documents(docs)
+                redundant, context_tokens = 0, 0
+                for q in queries:
+                    hits = [Document(id=d.id, text=d.text) for d in vs.similarity_search(q, k=4)]
+                    redundant += len(hits) - len(dedup_near_duplicates(hits)[0])
+                    context_tokens += sum(estimate_tokens(d.text) for d in hits)
+            stats.update(
+                chunks=len(docs),
+                index_tokens=sum(estimate_tokens(d.text) for d in docs),
+                redundant_slots_per_query=redundant / len(queries),
+                context_tokens_per_query=context_tokens / len(queries),
+            )
+            params = {"files": n * 3, "revisions_per_note": 3, "dedup_threshold": threshold}
+            out.append({"name": "load_knowledge_from_folder.dedup", "params": params, **stats})
+    return out
+
+
+def bench_vectorstore(
+    rng: random.Random, srv: FakeOllamaServer, doc_counts: List[int], repeat: int
+) -> List[Dict[str, Any]]:
+    out = []
+    for n in doc_counts:
+        # 10% 的文档带 policy 标签，用于过滤检索
+        docs = [
+            Document(id=f"d{i}", text=synth_text(rng, 400), metadata={"source": f"s{i}", "tags": ["policy" if i % 10 == 0 else "misc"]})
+            for i in range(n)
+        ]
+
+        # query 缓存关掉：测的是每次真正打分的开销
+        def _add():
+            vs = SimpleVectorStore(embed_model="fake", base_url=srv.base_url, query_cache_size=0)
+            vs.add_documents(docs)
+            return vs
+
+        stats = _timeit(_add, max(1, repeat // 5))
+        out.append({"name": "vectorstore.add_documents", "params": {"docs": n, "embed_latency_s": srv.embed_latency_s}, **stats})
+
+        vs = _add()
+        queries = [synth_text(rng, 80) for _ in range(16)]
+        it = iter(range(10 ** 9))
+        stats = _timeit(lambda: vs.similarity_search(queries[next(it) % len(queries)], k=4), repeat)
+        out.append({"name": "vectorstore.similarity_search", "params": {"docs": n, "k": 4}, **stats})
+        stats = _timeit(lambda: vs.similarity_search(queries[next(it) % len(queries)], k=4, filter="policy"), repeat)
+        out.append({"name": "vectorstore.similarity_search", "params": {"docs": n, "k": 4, "filter": "policy"}, **stats})
+
+        for model in ("local-tfidf", "local-tfidf:0"):
+            def _add_local():
+                vs = SimpleVectorStore(embed_model=model, query_cache_size=0)
+                vs.add_documents(docs)
+                vs.similarity_search(queries[0], k=4)   # 含首次检索时的索引构建
+                return vs
+
+            stats = _timeit(_add_local, max(1, repeat // 5))
+            out.append({"name": "vectorstore.add_documents", "params": {"docs": n, "embed_model": model}, **stats})
+            vs = _add_local()
+            stats = _timeit(lambda: vs.similarity_search(queries[next(it) % len(queries)], k=4), repeat)
+            out.append({"name": "vectorstore.similarity_search", "params": {"docs": n, "k": 4, "embed_model": model}, **stats})
+            stats = _timeit(lambda: vs.similarity_search(queries[next(it) % len(queries)], k=4, filter="policy"), repeat)
+            out.append({"name": "vectorstore.similarity_search", "params": {"docs": n, "k": 4, "embed_model": model, "filter": "policy"}, **stats})
+    return out
+
+
+def bench_rag_ask(
+    rng: random.Random, srv: FakeOllamaServer, doc_counts: List[int], repeat: int
+) -> List[Dict[str, Any]]:
+    """
+    RAGChatSession.ask：检索 + 拼装 system 上下文 + 一次 /api/chat（假服务，chat_latency 可配）。
+    每次都新建会话，避免 history 越积越长干扰计时。
+    """
+    out = []
+    model = OllamaChatModel("fake", base_url=srv.base_url)
+    for n in doc_counts:
+        vs = SimpleVectorStore(embed_model="fake", base_url=srv.base_url)
+        vs.docs = [Document(id=f"d{i}", text=synth_text(rng, 500), metadata={"source": f"s{i}.txt"}) for i in range(n)]
+        question = synth_text(rng, 120)
+
+        def _ask():
+            sess = RAGChatSession(model=model, retriever=vs, k=4, label="bench")
+            sess.history.append(Message(role="system", content="bench"))
+            return sess.ask(question)
+
+        stats = _timeit(_ask, repeat)
+        out.append({"name": "rag_session.ask", "params": {"docs": n, "k": 4, "chat_latency_s": srv.chat_latency_s}, **stats})
+    return out
+
+
+def bench_policy_history(
+    rng: random.Random, workdir: str, record_counts: List[int], repeat: int
+) -> List[Dict[str, Any]]:
+    out = []
+    saved_path = local_tools.EXPERIMENT_LOG_PATH
+    try:
+        for n in record_counts:
+            path = os.path.join(workdir, f"experiments_{n}.jsonl")
+            synth_experiments(path, rng, n)
+            local_tools.EXPERIMENT_LOG_PATH = path
+            for pattern, case in (("夜间节能", "common"), ("罕见意图_tail", "tail"), ("不存在的意图", "miss")):
+                stats = _timeit(lambda: local_tools.tool_get_policy_history(pattern, max_records=20), repeat)
+                out.append({"name": "tool_get_policy_history", "params": {"records": n, "case": case}, **stats})
+    finally:
+        local_tools.EXPERIMENT_LOG_PATH = saved_path
+    return out
+
+
+def bench_experiment_store(workdir: str, n_records: int, repeat: int) -> List[Dict[str, Any]]:
+    out = []
+    recs = [{"exp_id": f"exp_{i:06d}", "intent_desc": "夜间节能", "kpi": {"ue_tput_5p": i * 0.01}} for i in range(n_records)]
+    counter = [0]
+
+    def _naive():
+        counter[0] += 1
+        path = os.path.join(workdir, f"naive_{counter[0]}.jsonl")
+        for rec in recs:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    out.append({"name": "experiments.append_open_close_fsync", "params": {"records": n_records}, **_timeit(_naive, repeat)})
+    for fsync in ("always", "batch", "never"):
+        def _store():
+            counter[0] += 1
+            store = ExperimentStore(os.path.join(workdir, f"store_{counter[0]}.jsonl"), fsync=fsync)
+            if fsync == "always":
+                # 多个写者并发时共享 fsync；这里用 8 个线程模拟并发 campaign
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    list(pool.map(store.append, recs))
+            else:
+                for rec in recs:
+                    store.append(rec)
+            store.close()
+
+        out.append({"name": "ExperimentStore.append", "params": {"records": n_records, "fsync": fsync}, **_timeit(_store, repeat)})
+    return out
+
+
+def bench_backend_pool(chat_latency_s: float, repeat: int) -> List[Dict[str, Any]]:
+    """
+    每个假实例只有 1 个并行槽位（OLLAMA_NUM_PARALLEL=1），8 个会话各问 4 轮；
+    吞吐应随实例数近似线性增长。
+    """
+    out = []
+    latency = chat_latency_s or 0.02
+    servers = [FakeOllamaServer(chat_latency_s=latency, max_parallel=1).start() for _ in range(4)]
+    try:
+        for n in (1, 2, 4):
+            pool = BackendPool([s.base_url for s in servers[:n]], probe_interval_s=0)
+            # 8 个会话发的是同一句话：关掉相同请求合并，否则 32 个请求只有几个真正到达后端
+            model = OllamaChatModel("fake", backends=pool, coalesce=False)
+
+            def _user():
+                sess = ChatSession(model=model)
+                for _ in range(4):
+                    sess.ask("你好")
+
+            def _run():
+                with ThreadPoolExecutor(max_workers=8) as ex:
+                    list(ex.map(lambda _: _user(), range(8)))
+
+            out.append({"name": "BackendPool.chat_32_calls", "params": {"backends": n, "chat_latency_s": latency},
+                        **_timeit(_run, repeat)})
+    finally:
+        for s in servers:
+            s.stop()
+    return out
+
+
+def bench_hedging(chat_latency_s: float, repeat: int) -> List[Dict[str, Any]]:
+    """
+    两个实例，每个 /api/chat 有 15% 的概率卡 1 秒才出首 token；统计单次调用耗时的分布。
+    对冲开启时 p95 应接近正常延迟，代价是 hedge_rate（约 15%~25%）的额外请求。
+    """
+    out = []
+    latency = chat_latency_s or 0.02
+    for hedge in (False, True):
+        servers = [FakeOllamaServer(chat_latency_s=latency, stall_rate=0.15, stall_s=1.0).start() for _ in range(2)]
+        try:
+            pool = BackendPool([s.base_url for s in servers], probe_interval_s=0)
+            policy = HedgePolicy(min_samples=10, default_delay_s=latency * 4, budget_ratio=0.3) if hedge else None
+            model = OllamaChatModel("fake", backends=pool, hedge=policy)
+            stats = _timeit(lambda: model.chat([Message(role="user", content="你好")]), repeat)
+            params = {"hedge": hedge, "chat_latency_s": latency, "stall_rate": 0.15}
+            if hedge:
+                stats["hedge_rate"] = model.hedge_stats.snapshot()["hedge_rate"]
+            out.append({"name": "OllamaChatModel.chat_with_stalls", "params": params, **stats})
+        finally:
+            for s in servers:
+                s.stop()
+    return out
+
+
+def bench_json(rng: random.Random, repeat: int) -> List[Dict[str, Any]]:
+    out = []
+    schema = build_policy_decision_schema(DEFAULT_POLICY_LIBRARY)
+    for prefix_chars in (0, 2000, 20000):
+        reply = synth_text(rng, prefix_chars) + "\n" + DEFAULT_REPLY + "\n" + synth_text(rng, prefix_chars)
+        params = {"chatter_chars": prefix_chars}
+        out.append({"name": "extract_json_block", "params": params, **_timeit(lambda: extract_json_block(reply), repeat)})
+        out.append({"name": "parse_and_validate", "params": params, **_timeit(lambda: parse_and_validate(reply, schema), repeat)})
+
+        pieces = [reply[i:i + 4] for i in range(0, len(reply), 4)]
+
+        def _scan():
+            sc = JsonStreamScanner()
+            for p in pieces:
+                if sc.feed(p):
+                    break
+            return sc
+
+        out.append({"name": "JsonStreamScanner.feed", "params": params, **_timeit(_scan, repeat)})
+    return out
+
+
+# ==== 运行 / 对比 ====
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=10,
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def run_benchmarks(
+    quick: bool = False,
+    chat_latency_s: float = 0.0,
+    embed_latency_s: float = 0.0,
+    only: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    rng = random.Random(BENCH_SEED)
+    if quick:
+        sizes = dict(chars=[10_000, 100_000], files=[10, 50], docs=[50, 200], records=[1_000, 10_000], repeat=5)
+    else:
+        sizes = dict(chars=[10_000, 100_000, 1_000_000], files=[10, 100, 500], docs=[100, 1_000, 5_000],
+                     records=[1_000, 10_000, 100_000], repeat=20)
+    repeat = sizes["repeat"]
+
+    def _enabled(name: str) -> bool:
+        return not only or name in only
+
+    results: List[Dict[str, Any]] = []
+    workdir = tempfile.mkdtemp(prefix="bench_agent_")
+    try:
+        with FakeOllamaServer(chat_latency_s=chat_latency_s, embed_latency_s=embed_latency_s) as srv:
+            if _enabled("chunking"):
+                results += bench_chunking(rng, sizes["chars"], repeat)
+            if _enabled("load_folder"):
+                results += bench_load_folder(rng, workdir, sizes["files"], max(3, repeat // 4))
+            if _enabled("kb_dedup"):
+                results += bench_kb_dedup(rng, workdir, sizes["files"], max(3, repeat // 4))
+            if _enabled("vectorstore"):
+                results += bench_vectorstore(rng, srv, sizes["docs"], repeat)
+            if _enabled("rag_ask"):
+                results += bench_rag_ask(rng, srv, sizes["docs"], repeat)
+            if _enabled("policy_history"):
+                results += bench_policy_history(rng, workdir, sizes["records"], max(3, repeat // 4))
+            if _enabled("experiment_store"):
+                results += bench_experiment_store(workdir, sizes["records"][0], 3)
+            if _enabled("backend_pool"):
+                results += bench_backend_pool(chat_latency_s, 3)
+            if _enabled("hedging"):
+                results += bench_hedging(chat_latency_s, 200)
+            if _enabled("json"):
+                results += bench_json(rng, repeat * 5)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": BENCH_SEED,
+            "quick": quick,
+            "chat_latency_s": chat_latency_s,
+            "embed_latency_s": embed_latency_s,
+        },
+        "results": results,
+    }
+
+
+def _result_key(r: Dict[str, Any]) -> str:
+    return r["name"] + " " + json.dumps(r["params"], sort_keys=True, ensure_ascii=False)
+
+
+def format_results(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    base = {_result_key(r): r for r in (baseline or {}).get("results", [])}
+    lines = [f"{'benchmark':<70} {'median':>10} {'p95':>10} {'vs base':>9}"]
+    for r in report["results"]:
+        key = _result_key(r)
+        ratio = ""
+        if key in base and base[key]["median_s"] > 0:
+            ratio = f"{r['median_s'] / base[key]['median_s']:.2f}x"
+        lines.append(f"{key:<70} {r['median_s'] * 1e3:>8.3f}ms {r['p95_s'] * 1e3:>8.3f}ms {ratio:>9}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Agent 包热点路径微基准")
+    parser.add_argument("--quick", action="store_true", help="小规模快速跑一遍")
+    parser.add_argument("--out", default="", help="结果 JSON 输出路径，例如 bench_results/<commit>.json")
+    parser.add_argument("--compare", default="", help="与之前保存的结果 JSON 对比（显示中位数比值）")
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="假 /api/chat 的固定延迟（秒）")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="假 /api/embed 的固定延迟（秒）")
+    parser.add_argument(
+        "--only", nargs="*", default=None,
+        help="只跑指定的基准：chunking load_folder vectorstore rag_ask policy_history experiment_store backend_pool hedging json",
+    )
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        quick=args.quick,
+        chat_latency_s=args.chat_latency,
+        embed_latency_s=args.embed_latency,
+        only=args.only,
+    )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(format_results(report, baseline))
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[Bench] 结果已保存 -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# campaign_runner.py
+# 多意图 campaign：从文件读入一批运营意图，每个意图跑一个独立的闭环（run_closed_loop），
+# 多个闭环并发执行，共享同一个 LLM 客户端（限制并发槽位）和同一个常驻仿真池（限制 worker 数）。
+# 每个意图跑完立即追加一行 JSONL（含每轮 trace），中途退出后用 --skip-done 跳过已完成的意图，
+# 用 --resume 让未完成的意图从各自检查点里第一个未完成的阶段继续。
+#
+# 意图文件格式（二选一，按行）：
+#   - JSONL：{"intent_id": "reg_001", "text": "在保证 5% UE 吞吐不低于 2 Mbps 的前提下……"}
+#   - 纯文本：每行一个意图，intent_id 自动编号（intent_0001 ...），# 开头的行忽略
+#
+# 用法：
+#   python campaign_runner.py intents.jsonl --out campaign.jsonl --concurrency 8 --llm-slots 4 --sim-workers 4
+#   python campaign_runner.py intents.txt --backend stub --max-rounds 3      # 不开 Matlab，快速验证流程
+
+from typing import Any, Dict, List, Set
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import json
+import os
+import threading
+import time
+import traceback
+
+import main_oran_agents_matlab_nometa as loop
+from ollama_client import OllamaChatModel, CHAT_SINGLE_FLIGHT
+from sim_worker_pool import SimWorkerPool
+from vectorstore import EMBED_SINGLE_FLIGHT
+
+
+# 每个意图的仿真 round_idx 加上 CAMPAIGN_ROUND_OFFSET + 序号 * CAMPAIGN_ROUND_STRIDE，
+# 避免与单次运行 / sweep（SWEEP_ROUND_OFFSET=1000000 起）以及彼此之间的结果目录冲突
+CAMPAIGN_ROUND_OFFSET = 20000
+CAMPAIGN_ROUND_STRIDE = 1000
+
+
+def load_intents(path: str) -> List[Dict[str, str]]:
+    intents = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                rec = json.loads(line)
+                text = rec.get("text") or rec.get("operator_text") or ""
+                intent_id = rec.get("intent_id") or f"intent_{len(intents) + 1:04d}"
+            else:
+                text, intent_id = line, f"intent_{len(intents) + 1:04d}"
+            intents.append({"intent_id": intent_id, "text": text})
+    ids = [it["intent_id"] for it in intents]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"意图文件中有重复的 intent_id：{path}")
+    return intents
+
+
+def load_done_ids(out_path: str) -> Set[str]:
+    done: Set[str] = set()
+    if not os.path.isfile(out_path):
+        return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue   # 上次被杀掉时可能写了半行
+            if rec.get("status") == "ok":
+                done.add(rec["intent_id"])
+    return done
+
+
+class CampaignWriter:
+    """
+    线程安全的 JSONL 追加写：每个意图完成后写一行并 flush。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, rec: Dict[str, Any]) -> None:
+        line = json.dumps(rec, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+
+
+def run_one_intent(
+    model: OllamaChatModel,
+    vs,
+    sim_pool: SimWorkerPool,
+    intent: Dict[str, str],
+    index: int,
+    max_rounds: int,
+    resume: bool = False,
+) -> Dict[str, Any]:
+    t0 = time.time()
+    try:
+        result = loop.run_closed_loop(
+            model,
+            vs,
+            sim_pool,
+            operator_text=intent["text"],
+            intent_id=intent["intent_id"],
+            max_rounds=max_rounds,
+            sim_round_base=CAMPAIGN_ROUND_OFFSET + index * CAMPAIGN_ROUND_STRIDE,
+            checkpoint=loop.open_checkpoint(intent["intent_id"], resume=resume),
+        )
+        result["status"] = "ok"
+    except Exception as e:
+        result = {
+            "intent_id": intent["intent_id"],
+            "operator_text": intent["text"],
+            "status": "error",
+            "error": f"{type(e).__name__}: {e}",
+            "traceback": traceback.format_exc(),
+            "wall_s": round(time.time() - t0, 3),
+        }
+    return result
+
+
+def run_campaign(
+    intents: List[Dict[str, str]],
+    out_path: str,
+    concurrency: int = 4,
+    llm_slots: int = 2,
+    sim_workers: int = 4,
+    backend: str = "matlab",
+    max_rounds: int = loop.MAX_ROUNDS,
+    resume: bool = False,
+) -> Dict[str, Any]:
+    if loop.MODEL_ROUTING_ENABLED:
+        # 各 agent 的槽位由 MODEL_ROUTES 决定，llm_slots 不生效
+        model = loop.build_model_router()
+    else:
+        model = OllamaChatModel(
+            base_url=loop.OLLAMA_BASE_URL,
+            model_name=loop.OLLAMA_MODEL_NAME,
+            max_concurrency=llm_slots,
+            backends=loop.get_backend_pool(),
+        )
+    vs = loop.build_vector_store()
+    sim_pool = SimWorkerPool(
+        num_workers=sim_workers,
+        backend=backend,
+        pool_dir=loop.SIM_POOL_DIR,
+        matlab_exe_path=loop.MATLAB_EXE_PATH,
+        matlab_work_dir=loop.MATLAB_WORK_DIR,
+        cache=loop.get_sim_cache() if loop.SIM_CACHE_ENABLED else None,
+    ).start()
+    writer = CampaignWriter(out_path)
+
+    t0 = time.time()
+    counts = {"ok": 0, "error": 0}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="campaign") as pool:
+            futures = {
+                pool.submit(run_one_intent, model, vs, sim_pool, it, idx, max_rounds, resume): it
+                for idx, it in enumerate(intents)
+            }
+            for fut in as_completed(futures):
+                rec = fut.result()
+                writer.write(rec)
+                counts[rec["status"]] += 1
+                print(
+                    f"[Campaign] {rec['intent_id']} -> {rec['status']} "
+                    f"({rec.get('stop_reason', rec.get('error', ''))}, {rec.get('wall_s', 0):.1f}s) "
+                    f"[{counts['ok'] + counts['error']}/{len(intents)}]"
+                )
+    finally:
+        sim_metrics = sim_pool.metrics()
+        sim_pool.shutdown()
+
+    summary = {
+        "intents": len(intents),
+        **counts,
+        "wall_s": round(time.time() - t0, 3),
+        "concurrency": concurrency,
+        "llm_slots": llm_slots,
+        "sim_workers": sim_workers,
+        "sim_pool": sim_metrics,
+    }
+    print(model.metrics.format_summary())
+    if loop.MODEL_ROUTING_ENABLED:
+        print(model.format_summary())
+        summary["routes"] = model.snapshot()
+    if loop.get_backend_pool() is not None:
+        summary["backends"] = loop.get_backend_pool().snapshot()
+    summary["single_flight"] = {"chat": CHAT_SINGLE_FLIGHT.snapshot(), "embed": EMBED_SINGLE_FLIGHT.snapshot()}
+    print("[Campaign] 汇总：", json.dumps(summary, ensure_ascii=False))
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="多意图闭环 campaign（无交互，并发执行）")
+    parser.add_argument("intents", help="意图文件（JSONL 或每行一个意图的纯文本）")
+    parser.add_argument("--out", default=r"D:/oran_logs/campaign_results.jsonl", help="结果 JSONL 路径（追加写）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时运行的闭环数")
+    parser.add_argument("--llm-slots", type=int, default=2, help="同时在飞的 LLM 请求数上限（未启用 MODEL_ROUTING_ENABLED 时）")
+    parser.add_argument("--sim-workers", type=int, default=4, help="常驻仿真 worker 数")
+    parser.add_argument("--backend", choices=sorted(["stub", "matlab"]), default="matlab")
+    parser.add_argument("--max-rounds", type=int, default=loop.MAX_ROUNDS)
+    parser.add_argument("--skip-done", action="store_true", help="跳过结果文件中已成功完成的 intent_id")
+    parser.add_argument("--resume", action="store_true", help="未完成的意图从检查点继续（需要 CHECKPOINT_ENABLED）")
+    args = parser.parse_args()
+
+    intents = load_intents(args.intents)
+    if args.skip_done:
+        done = load_done_ids(args.out)
+        intents = [it for it in intents if it["intent_id"] not in done]
+        print(f"[Campaign] 跳过 {len(done)} 个已完成的意图")
+    print(f"[Campaign] 共 {len(intents)} 个意图，并发 {args.concurrency}，LLM 槽位 {args.llm_slots}，"
+          f"仿真 worker {args.sim_workers}（{args.backend}）")
+
+    run_campaign(
+        intents,
+        args.out,
+        concurrency=args.concurrency,
+        llm_slots=args.llm_slots,
+        sim_workers=args.sim_workers,
+        backend=args.backend,
+        max_rounds=args.max_rounds,
+        resume=args.resume,
+    )
+
+
+if __name__ == "__main__":
+    main()
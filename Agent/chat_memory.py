@@ -0,0 +1,203 @@
+# chat_memory.py
+# ChatSession 的记忆管理：让长期存在的会话（web chat、多轮闭环）每轮发送的上下文保持在固定预算内。
+#
+# 规则：
+# - 挂载记忆时 history 里已有的消息（system prompt / 策略库等）永久保留（pinned）；
+# - 最近 keep_turns 轮对话原样保留；
+# - 更早的轮次从 history 中移出，交给后台线程折叠进一段“早期对话摘要”（一条 system 消息，
+#   紧跟在 pinned 消息之后）。摘要在后台生成，不占用当前轮的延迟；
+#   新摘要生成完成前沿用旧摘要（刚移出的那一两轮在摘要里会晚一轮出现）。
+# - 即便轮数没超，总 token 估算超过 token_budget 时，也会继续移出最早的轮次（至少保留当前轮）。
+#
+# 一“轮”从 user 消息开始，包含它之前紧挨着的 RAG system 消息，以及之后的 assistant / tool 消息。
+
+from typing import List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+
+from llm_metrics import estimate_messages_tokens
+from ollama_client import OllamaChatModel, Message
+
+
+SUMMARY_PREFIX = "【早期对话摘要】以下是本会话更早轮次的要点（原文已省略）：\n"
+
+SUMMARIZE_PROMPT = """
+你负责压缩一段多轮对话的历史。给你“已有摘要”和“新移出的若干轮对话”，
+请输出更新后的摘要：保留用户的目标、约束、已经确认的结论 / 参数 / 决策和尚未解决的问题，
+删掉寒暄和重复内容。只输出摘要正文，不超过 {max_chars} 字。
+"""
+
+# 所有会话共用的后台摘要线程池（避免每个会话一个线程）
+_SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat_memory")
+
+# 折叠进摘要时，单条 tool 输出 / 回复最多保留的字符数
+_FOLD_MAX_CHARS_PER_MESSAGE = 1000
+
+
+def _split_turns(messages: List[Message]) -> List[List[Message]]:
+    """
+    把 pinned 之后的消息切成轮次：每轮以 user 消息（连同它之前紧挨着的 system 消息）开始。
+    """
+    turns: List[List[Message]] = []
+    pending_system: List[Message] = []
+    for m in messages:
+        if m.role == "system":
+            pending_system.append(m)
+        elif m.role == "user" or not turns:
+            turns.append(pending_system + [m])
+            pending_system = []
+        else:
+            turns[-1].extend(pending_system)
+            pending_system = []
+            turns[-1].append(m)
+    if pending_system:
+        if turns:
+            turns[-1].extend(pending_system)
+        else:
+            turns.append(pending_system)
+    return turns
+
+
+class ConversationMemory:
+    """
+    用法：attach_memory(session, ConversationMemory(model, token_budget=6000, keep_turns=4))
+    （在 session 注入 system prompt 之后调用，此时 history 里的 system 消息就是要 pin 的部分）。
+    ChatSession.ask 在发送前调用 apply(history)，原地裁剪 history。
+
+    summarize=False 时移出的轮次直接丢弃，不生成摘要（适合每轮相互独立的 agent）。
+    """
+
+    def __init__(
+        self,
+        model: Optional[OllamaChatModel] = None,
+        token_budget: int = 6000,
+        keep_turns: int = 4,
+        summarize: bool = True,
+        max_summary_chars: int = 600,
+        label: str = "memory",
+    ):
+        self.model = model
+        self.token_budget = token_budget
+        self.keep_turns = max(1, keep_turns)
+        self.summarize = summarize and model is not None
+        self.max_summary_chars = max_summary_chars
+        self.label = label
+        self.n_pinned: Optional[int] = None   # attach_memory 时确定
+
+        self.summary = ""
+        self._summary_msg: Optional[Message] = None
+        self._lock = threading.Lock()
+        self._future: Optional[Future] = None
+        self._queued: List[Message] = []   # 已移出、等待折叠进摘要的消息
+        self.stats = {"folded_turns": 0, "summaries": 0, "summary_errors": 0}
+
+    # ==== 摘要（后台） ====
+
+    def _schedule_summary(self) -> None:
+        # 调用方持有 self._lock；同一会话同时只跑一个摘要任务，其间移出的轮次排队等下一次
+        if not self.summarize or not self._queued:
+            return
+        if self._future is not None and not self._future.done():
+            return
+        batch, self._queued = self._queued, []
+        self._future = _SUMMARY_EXECUTOR.submit(self._summarize_batch, self.summary, batch)
+
+    def _summarize_batch(self, old_summary: str, batch: List[Message]) -> None:
+        lines = []
+        for m in batch:
+            if m.role == "system":
+                continue   # RAG 检索片段不进摘要
+            lines.append(f"{m.role}: {(m.content or '')[:_FOLD_MAX_CHARS_PER_MESSAGE]}")
+        prompt = [
+            Message(role="system", content=SUMMARIZE_PROMPT.format(max_chars=self.max_summary_chars)),
+            Message(
+                role="user",
+                content=f"已有摘要：\n{old_summary or '（无）'}\n\n新移出的对话：\n" + "\n".join(lines),
+            ),
+        ]
+        try:
+            new_summary = self.model.chat(prompt, label=self.label).content.strip()
+        except Exception as e:
+            with self._lock:
+                self.stats["summary_errors"] += 1
+                # 摘要失败：把这批消息放回队列，下次再试
+                self._queued = batch + self._queued
+            print(f"[Memory] 生成对话摘要失败：{e}")
+            return
+        with self._lock:
+            self.summary = new_summary[: self.max_summary_chars * 2]
+            self.stats["summaries"] += 1
+            self._schedule_summary()
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """
+        等待正在进行的摘要任务完成（测试 / 退出前用）。
+        """
+        while True:
+            with self._lock:
+                fut = self._future
+                if fut is None or (fut.done() and not self._queued):
+                    return
+                if fut.done():
+                    self._schedule_summary()
+                    fut = self._future
+            fut.result(timeout=timeout)
+
+    def restore(self, summary: str, history: List[Message]) -> None:
+        """
+        从检查点恢复：history 已按快照还原，这里把摘要和 history 中的摘要消息重新关联起来。
+        """
+        with self._lock:
+            self.summary = summary
+            n = self.n_pinned or 0
+            if len(history) > n and history[n].role == "system" and history[n].content.startswith(SUMMARY_PREFIX):
+                self._summary_msg = history[n]
+
+    # ==== 裁剪 ====
+
+    def apply(self, history: List[Message]) -> None:
+        """
+        原地裁剪 history：pinned system + 摘要消息 + 最近若干轮。
+        """
+        n_pinned = self.n_pinned
+        if n_pinned is None:
+            n_pinned = 0
+            while n_pinned < len(history) and history[n_pinned].role == "system":
+                n_pinned += 1
+            self.n_pinned = n_pinned
+        pinned = history[:n_pinned]
+        rest = history[n_pinned:]
+        if rest and rest[0] is self._summary_msg:
+            rest = rest[1:]
+        turns = _split_turns(rest)
+
+        with self._lock:
+            folded: List[Message] = []
+            while len(turns) > self.keep_turns:
+                folded.extend(turns.pop(0))
+                self.stats["folded_turns"] += 1
+            while len(turns) > 1 and self._estimate(pinned, turns) > self.token_budget:
+                folded.extend(turns.pop(0))
+                self.stats["folded_turns"] += 1
+            if folded and self.summarize:
+                self._queued.extend(folded)
+                self._schedule_summary()
+
+            if self.summary and (self._summary_msg is None or self._summary_msg.content != SUMMARY_PREFIX + self.summary):
+                self._summary_msg = Message(role="system", content=SUMMARY_PREFIX + self.summary)
+            summary_part = [self._summary_msg] if self._summary_msg is not None else []
+
+        history[:] = pinned + summary_part + [m for t in turns for m in t]
+
+    def _estimate(self, pinned: List[Message], turns: List[List[Message]]) -> int:
+        extra = [self._summary_msg] if self._summary_msg is not None else []
+        return estimate_messages_tokens(pinned + extra + [m for t in turns for m in t])
+
+
+def attach_memory(session, memory: ConversationMemory):
+    """
+    给会话挂上记忆管理：当前 history 中的消息（一般是 system prompt）全部 pin 住。
+    """
+    memory.n_pinned = len(session.history)
+    session.memory = memory
+    return session
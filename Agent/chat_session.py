@@ -1,8 +1,9 @@
 # chat_session.py
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Optional, Sequence, Union, Dict, Any, Callable
+import uuid
 from ollama_client import OllamaChatModel, Message
-from vectorstore import SimpleVectorStore
+from vectorstore import SimpleVectorStore, Document
 from local_tools import TOOLS_SPEC, execute_tool
 
 
@@ -13,30 +14,74 @@ class ChatSession:
     """
     model: OllamaChatModel
     history: List[Message] = field(default_factory=list)
+    last_stream_stats: Dict[str, Any] = field(default_factory=dict)
+    label: str = ""   # 调用方标签（intent / policy / web_chat ...），用于 LLM 指标聚合
+    memory: Optional[Any] = None   # chat_memory.ConversationMemory：限制每轮发送的上下文大小
+    # 会话标识：多个 Ollama 实例（backend_pool）时让同一会话尽量落到同一实例，复用 KV cache
+    affinity_key: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
 
-    def ask(self, user_input: str) -> str:
+    def ask(
+        self,
+        user_input: str,
+        format: Optional[Union[str, Dict[str, Any]]] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        """
+        stop_when 不为 None 时改用流式请求：每收到一段输出就调用 stop_when(delta)，
+        返回 True 即中止生成（统计信息放在 self.last_stream_stats）。
+        """
         self.history.append(Message(role="user", content=user_input))
-        reply_msg = self.model.chat(self.history)
+        if self.memory is not None:
+            self.memory.apply(self.history)
+        if stop_when is None:
+            reply_msg = self.model.chat(
+                self.history, format=format, label=self.label, affinity_key=self.affinity_key
+            )
+        else:
+            reply_msg, self.last_stream_stats = self.model.chat_stream(
+                self.history, format=format, on_delta=stop_when, label=self.label,
+                affinity_key=self.affinity_key,
+            )
         self.history.append(reply_msg)
         return reply_msg.content
 
 
 class RAGChatSession(ChatSession):
     """
-    带 RAG：每次先检索向量库，加 system 消息
+    带 RAG：每次先检索向量库，加 system 消息。
+    retrieval_filter：只检索带这些标签（任意一个）的文档，例如 ("policy", "kpi")；
+    知识库里没有任何文档带这些标签时（例如没有按目录分类的旧知识库）不过滤。
     """
     def __init__(
         self,
         model: OllamaChatModel,
         retriever: SimpleVectorStore,
         k: int = 4,
+        label: str = "",
+        retrieval_filter: Optional[Sequence[str]] = None,
     ):
-        super(RAGChatSession, self).__init__(model=model)
+        super(RAGChatSession, self).__init__(model=model, label=label)
         self.retriever = retriever
         self.k = k
+        self.retrieval_filter = retrieval_filter
 
-    def ask(self, user_input: str) -> str:
-        docs = self.retriever.similarity_search(user_input, k=self.k)
+    def retrieve(self, query: str) -> List[Document]:
+        flt = self.retrieval_filter
+        if flt is not None and not self.retriever.has_tags(flt):
+            flt = None
+        return self.retriever.similarity_search(query, k=self.k, filter=flt)
+
+    def ask(
+        self,
+        user_input: str,
+        format: Optional[Union[str, Dict[str, Any]]] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        retrieval_query: Optional[str] = None,
+    ) -> str:
+        """
+        retrieval_query：检索用的短 query（见 retrieval_query.py），None 时直接用 user_input 检索。
+        """
+        docs = self.retrieve(retrieval_query or user_input)
         if docs:
             lines = []
             for i, d in enumerate(docs):
@@ -53,7 +98,7 @@ class RAGChatSession(ChatSession):
                 Message(role="system", content=rag_system_content)
             )
 
-        return super(RAGChatSession, self).ask(user_input)
+        return super(RAGChatSession, self).ask(user_input, format=format, stop_when=stop_when)
 
 
 class ToolRAGChatSession(RAGChatSession):
@@ -66,9 +111,9 @@ class ToolRAGChatSession(RAGChatSession):
     - 第二轮 chat_with_tools(tool_choice='none')：生成最终回答
     """
 
-    def ask(self, user_input: str) -> str:
+    def ask(self, user_input: str, retrieval_query: Optional[str] = None) -> str:
         # 1. RAG 部分（不调用 super().ask）
-        docs = self.retriever.similarity_search(user_input, k=self.k)
+        docs = self.retrieve(retrieval_query or user_input)
         if docs:
             lines = []
             for i, d in enumerate(docs):
@@ -87,12 +132,16 @@ class ToolRAGChatSession(RAGChatSession):
 
         # 2. 当前用户消息
         self.history.append(Message(role="user", content=user_input))
+        if self.memory is not None:
+            self.memory.apply(self.history)
 
         # 3. 第一轮：让模型决定是否调用工具
         assistant_msg, tool_calls = self.model.chat_with_tools(
             messages=self.history,
             tools=TOOLS_SPEC,
             tool_choice="auto",
+            label=self.label,
+            affinity_key=self.affinity_key,
         )
         self.history.append(assistant_msg)
 
@@ -112,6 +161,8 @@ class ToolRAGChatSession(RAGChatSession):
             messages=self.history,
             tools=TOOLS_SPEC,
             tool_choice="none",
+            label=self.label,
+            affinity_key=self.affinity_key,
         )
         self.history.append(final_msg)
         return final_msg.content
@@ -0,0 +1,500 @@
+# experiment_store.py
+# 实验记录 / 候选策略的追加式存储（JSONL + 紧凑索引）。
+#
+# - 写：append() 只把记录放进内存队列，后台线程攒一批后用一次 os.write（O_APPEND）写入，
+#   一批只 fsync 一次（group commit）。整批是完整的行，并发的 campaign / 进程之间不会出现交错的半行。
+# - fsync 策略："always"（append 等到所在批次落盘才返回，多个写者共享一次 fsync）/
+#   "batch"（每批 fsync，append 立即返回）/ "never"（只写进 OS 缓存）。
+# - 去重：按内容 hash（忽略 ts 等易变字段），与同一 id 当前最新记录（含还在队列里的）完全相同时不写
+#   （断点续跑、重复调用工具都不会产生重复行）；同一 id 改回旧版本内容（v1 -> v2 -> v1）仍会写入。
+# - 索引：<path>.idx 每行 "offset\tlength\thash\tid"，与数据同批追加；打开时加载索引，
+#   再扫描索引之后的数据尾部（崩溃时没来得及写索引的记录 / 其它进程写入的记录）。
+#   多个写者交错时会各自把对方的记录再登记一遍，索引文件里同一 offset 可能出现多行，加载时按 offset 去重。
+#   索引只是加速用的缓存：丢了或对不上都会从数据文件重建。
+# - 同一 id 多次写入时以最后一条为准；compact() 只保留每个 id 的最新记录并重写文件。
+#
+# 用法：
+#   store = open_store(r"D:/oran_logs/experiments.jsonl", id_field="exp_id")
+#   store.append({"exp_id": "intent_001_round_0", "intent_desc": "...", "kpi": {...}})
+#   store.get("intent_001_round_0"); store.recent(20, where=lambda r: "节能" in r["intent_desc"])
+#
+#   python experiment_store.py stats   D:/oran_logs/experiments.jsonl
+#   python experiment_store.py compact D:/oran_logs/experiments.jsonl
+#   python experiment_store.py recent  D:/oran_logs/experiments.jsonl -n 5
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import argparse
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+
+
+# ==== 配置 ====
+
+FSYNC_POLICIES = ("always", "batch", "never")
+DEFAULT_FSYNC = "batch"
+DEFAULT_FLUSH_INTERVAL_S = 0.05   # 后台线程攒批的最长等待时间
+DEFAULT_MAX_BATCH = 512
+
+# 这些字段不参与内容 hash（同一条实验重复写入时只有时间戳不同）
+_VOLATILE_FIELDS = ("ts",)
+
+
+def content_hash(rec: Dict[str, Any]) -> str:
+    canonical = {k: v for k, v in rec.items() if k not in _VOLATILE_FIELDS}
+    blob = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:32]
+
+
+class ExperimentStore:
+    """
+    线程安全；同一个文件在进程内应只有一个实例（用 open_store 获取）。
+    跨进程并发追加是安全的（整批一次 O_APPEND 写），compact() 则要求没有其它进程在写。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        id_field: str = "exp_id",
+        fsync: str = DEFAULT_FSYNC,
+        flush_interval_s: float = DEFAULT_FLUSH_INTERVAL_S,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        dedup: bool = True,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync 必须是 {FSYNC_POLICIES} 之一，收到 {fsync!r}")
+        self.path = path
+        self.index_path = path + ".idx"
+        self.id_field = id_field
+        self.fsync = fsync
+        self.flush_interval_s = flush_interval_s
+        self.max_batch = max(1, max_batch)
+        self.dedup = dedup
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._io_lock = threading.Lock()           # 串行化文件写入 / 扫描 / 压缩
+        self._pending: List[Tuple[str, str, bytes]] = []   # (id, hash, 行字节)
+        self._submitted = 0                        # 已提交的批内序号
+        self._durable = 0                          # 已写入（按 fsync 策略落盘）的序号
+        self._closed = False
+        self._flush_error: Optional[BaseException] = None
+        self._thread: Optional[threading.Thread] = None
+
+        # 索引（内存）：按文件顺序的 (offset, length, id)，以及 id -> 最新的 (offset, length)
+        self._entries: List[Tuple[int, int, str]] = []
+        self._offsets: set = set()                 # 已登记的 offset，防止同一行被登记两次
+        self._by_id: Dict[str, Tuple[int, int]] = {}
+        self._hash_by_id: Dict[str, str] = {}      # id -> 已写入的最新记录的内容 hash
+        self._pending_hash: Dict[str, str] = {}    # id -> 队列里最新一条的内容 hash（写完或失败后移除）
+        self._scanned_to = 0                       # 数据文件中已经索引到的位置
+
+        self.stats = {"appended": 0, "deduped": 0, "batches": 0, "fsyncs": 0, "rescans": 0, "compactions": 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._io_lock:
+            self._load_index()
+
+    # ==== 索引加载 / 重建 ====
+
+    def _data_size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def _reset_index(self) -> None:
+        self._entries = []
+        self._offsets = set()
+        self._by_id = {}
+        self._hash_by_id = {}
+        self._scanned_to = 0
+
+    def _add_entry(self, offset: int, length: int, rec_id: str, h: str) -> bool:
+        """
+        登记一行；该 offset 已经登记过时什么都不做，返回 False。
+        """
+        if offset in self._offsets:
+            return False
+        self._offsets.add(offset)
+        self._entries.append((offset, length, rec_id))
+        self._by_id[rec_id] = (offset, length)
+        self._hash_by_id[rec_id] = h
+        return True
+
+    def _load_index(self) -> None:
+        # 调用方持有 _io_lock
+        self._reset_index()
+        size = self._data_size()
+        if os.path.isfile(self.index_path):
+            ok = True
+            # 多个写者交错时同一 offset 会被登记多次、也可能不按 offset 顺序出现：
+            # 按 offset 去重（先出现的为准）后排序，保证 _entries 是文件顺序、_by_id 指向最新一行
+            loaded: Dict[int, Tuple[int, str, str]] = {}
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t", 3)
+                    if len(parts) != 4:
+                        continue   # 被杀掉时写了半行索引
+                    offset, length = int(parts[0]), int(parts[1])
+                    if offset + length > size:
+                        ok = False   # 索引比数据新（数据被替换 / 截断过），整体重建
+                        break
+                    loaded.setdefault(offset, (length, parts[2], parts[3]))
+            if ok:
+                for offset in sorted(loaded):
+                    length, h, rec_id = loaded[offset]
+                    self._add_entry(offset, length, rec_id, h)
+                    self._scanned_to = max(self._scanned_to, offset + length)
+            else:
+                os.remove(self.index_path)
+        self._scan_tail()
+
+    def _scan_tail(self) -> int:
+        """
+        扫描 _scanned_to 之后的数据（崩溃时没写索引的记录、其它进程追加的记录），补进索引。
+        末尾的半行（写入时进程被杀）跳过，并在下一次追加前补一个换行把它隔开。
+        """
+        size = self._data_size()
+        if size <= self._scanned_to:
+            return 0
+        new_idx: List[str] = []
+        with open(self.path, "rb") as f:
+            f.seek(self._scanned_to)
+            offset = self._scanned_to
+            for raw in f:
+                length = len(raw)
+                if raw.endswith(b"\n"):
+                    try:
+                        rec = json.loads(raw)
+                    except ValueError:
+                        rec = None
+                    if isinstance(rec, dict):
+                        h = content_hash(rec)
+                        rec_id = self._record_id(rec, h)
+                        if self._add_entry(offset, length, rec_id, h):
+                            new_idx.append(f"{offset}\t{length}\t{h}\t{rec_id}\n")
+                offset += length
+            self._scanned_to = offset
+        if new_idx:
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write("".join(new_idx))
+        self.stats["rescans"] += 1
+        return len(new_idx)
+
+    def _record_id(self, rec: Dict[str, Any], h: str) -> str:
+        rec_id = rec.get(self.id_field)
+        return str(rec_id) if rec_id not in (None, "") else h[:16]
+
+    # ==== 写入 ====
+
+    def append(self, rec: Dict[str, Any]) -> Optional[str]:
+        """
+        追加一条记录，返回记录 id；dedup 时与该 id 的最新记录内容完全相同则不写，返回 None。
+        记录里没有 id_field 时用内容 hash 的前 16 位作为 id。
+        """
+        h = content_hash(rec)
+        rec_id = self._record_id(rec, h)
+        line = (json.dumps(rec, ensure_ascii=False, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"ExperimentStore 已关闭：{self.path}")
+            latest = self._pending_hash.get(rec_id) or self._hash_by_id.get(rec_id)
+            if self.dedup and latest == h:
+                self.stats["deduped"] += 1
+                return None
+            self._pending_hash[rec_id] = h
+            self._pending.append((rec_id, h, line))
+            self._submitted += 1
+            seq = self._submitted
+            self.stats["appended"] += 1
+            self._ensure_thread()
+            self._cond.notify_all()
+            if self.fsync == "always":
+                while self._durable < seq and self._flush_error is None:
+                    self._cond.wait()
+                if self._flush_error is not None:
+                    raise RuntimeError(f"写入 {self.path} 失败：{self._flush_error}")
+        return rec_id
+
+    def _ensure_thread(self) -> None:
+        # 调用方持有 _lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._flusher, name="experiment_store", daemon=True)
+            self._thread.start()
+
+    def _flusher(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending and self._closed:
+                    return
+                # 攒批：等 flush_interval_s 或攒满 max_batch。
+                # "always" 模式下写者都在等落盘，不额外等待：上一批写盘期间到达的记录自然组成下一批
+                deadline = time.time() + (0.0 if self.fsync == "always" else self.flush_interval_s)
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self._write_pending()
+
+    def _write_pending(self) -> None:
+        with self._io_lock:
+            with self._cond:
+                batch, self._pending = self._pending[: self.max_batch], self._pending[self.max_batch:]
+                seq = self._submitted - len(self._pending)
+            if not batch:
+                return
+            try:
+                self._write_batch(batch)
+                error = None
+            except Exception as e:   # 磁盘满 / 权限问题：让等待中的写者看到错误
+                error = e
+                print(f"[ExperimentStore] 写入 {self.path} 失败：{e}")
+            with self._cond:
+                # 写成功时 hash 已由 _add_entry 登记；失败时不登记，调用方重试同一条记录不会被当成重复
+                for rec_id, h, _ in batch:
+                    if self._pending_hash.get(rec_id) == h:
+                        del self._pending_hash[rec_id]
+                self._durable = max(self._durable, seq)
+                self._flush_error = error
+                self._cond.notify_all()
+
+    def _write_batch(self, batch: List[Tuple[str, str, bytes]]) -> None:
+        # 调用方持有 _io_lock
+        payload = b"".join(line for _, _, line in batch)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            before = os.fstat(fd).st_size
+            if before > 0 and not self._ends_with_newline(before):
+                payload = b"\n" + payload   # 上次崩溃留下的半行，先隔开
+            os.write(fd, payload)
+            if self.fsync != "never":
+                os.fsync(fd)
+                self.stats["fsyncs"] += 1
+            after = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        self.stats["batches"] += 1
+
+        if before == self._scanned_to and after == before + len(payload):
+            # 期间没有其它进程写入：直接按偏移登记索引
+            offset = before + (len(payload) - sum(len(line) for _, _, line in batch))
+            idx_lines = []
+            for rec_id, h, line in batch:
+                if self._add_entry(offset, len(line), rec_id, h):
+                    idx_lines.append(f"{offset}\t{len(line)}\t{h}\t{rec_id}\n")
+                offset += len(line)
+            self._scanned_to = after
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write("".join(idx_lines))
+        else:
+            # 和其它进程的写入交错了（各自仍是完整的行）：按文件内容重新扫描尾部
+            self._scan_tail()
+
+    def _ends_with_newline(self, size: int) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(size - 1)
+            return f.read(1) == b"\n"
+
+    def flush(self) -> None:
+        """
+        把队列里的记录立即写盘（不等攒批），读之前会自动调用。
+        """
+        while True:
+            with self._cond:
+                if not self._pending:
+                    break
+            self._write_pending()
+        with self._cond:
+            if self._flush_error is not None:
+                raise RuntimeError(f"写入 {self.path} 失败：{self._flush_error}")
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.flush()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    # ==== 读取 ====
+
+    def _refresh(self) -> None:
+        self.flush()
+        with self._io_lock:
+            self._scan_tail()
+
+    def _read_at(self, f, offset: int, length: int) -> Optional[Dict[str, Any]]:
+        f.seek(offset)
+        try:
+            return json.loads(f.read(length))
+        except ValueError:
+            return None
+
+    def get(self, rec_id: str) -> Optional[Dict[str, Any]]:
+        self._refresh()
+        with self._io_lock:
+            loc = self._by_id.get(rec_id)
+            if loc is None:
+                return None
+            with open(self.path, "rb") as f:
+                rec = self._read_at(f, *loc)
+            if rec is None or self._record_id(rec, content_hash(rec)) != rec_id:
+                # 索引和数据对不上（数据被外部改写）：重建后再查一次
+                self._load_index()
+                loc = self._by_id.get(rec_id)
+                if loc is None:
+                    return None
+                with open(self.path, "rb") as f:
+                    rec = self._read_at(f, *loc)
+            return rec
+
+    def iter_records(self, newest_first: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        遍历每个 id 的最新记录（同一 id 的旧版本跳过，每个 offset 最多产出一次）。
+        """
+        self._refresh()
+        with self._io_lock:
+            # _entries 只追加（重建时换成新列表），拿住引用和长度即可得到一致的快照
+            entries, n = self._entries, len(self._entries)
+            by_id = self._by_id
+            end = self._scanned_to
+        if n == 0 or end == 0:
+            return
+        order = range(n - 1, -1, -1) if newest_first else range(n)
+        seen = set()
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for i in order:
+                offset, length, rec_id = entries[i]
+                if by_id.get(rec_id) != (offset, length) or offset in seen:
+                    continue
+                seen.add(offset)
+                try:
+                    rec = json.loads(mm[offset:offset + length])
+                except ValueError:
+                    continue
+                yield rec
+
+    def recent(
+        self,
+        n: int = 20,
+        where: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        最近写入的 n 条（新的在前）；where 给出时只返回满足条件的记录，从文件尾往前读，找够就停。
+        """
+        out: List[Dict[str, Any]] = []
+        if n <= 0:
+            return out
+        for rec in self.iter_records(newest_first=True):
+            if where is None or where(rec):
+                out.append(rec)
+                if len(out) >= n:
+                    break
+        return out
+
+    def __len__(self) -> int:
+        self._refresh()
+        with self._io_lock:
+            return len(self._by_id)
+
+    # ==== 压缩 ====
+
+    def compact(self) -> Dict[str, int]:
+        """
+        只保留每个 id 的最新记录（并丢掉崩溃留下的半行），原子地重写数据文件和索引。
+        要求没有其它进程同时写这个文件。
+        """
+        self.flush()
+        with self._io_lock:
+            self._scan_tail()
+            before = self._data_size()
+            live = [e for e in self._entries if self._by_id.get(e[2]) == (e[0], e[1])]
+            tmp_data, tmp_idx = self.path + ".compact", self.index_path + ".compact"
+            offset = 0
+            with open(self.path, "rb") as src, open(tmp_data, "wb") as dst, \
+                    open(tmp_idx, "w", encoding="utf-8") as idx:
+                for old_offset, length, rec_id in live:
+                    src.seek(old_offset)
+                    raw = src.read(length)
+                    try:
+                        h = content_hash(json.loads(raw))
+                    except ValueError:
+                        continue
+                    dst.write(raw)
+                    idx.write(f"{offset}\t{length}\t{h}\t{rec_id}\n")
+                    offset += length
+                dst.flush()
+                os.fsync(dst.fileno())
+                idx.flush()
+                os.fsync(idx.fileno())
+            # 先删旧索引再替换数据：中途崩溃时最坏是索引缺失，下次打开会从数据重建
+            if os.path.isfile(self.index_path):
+                os.remove(self.index_path)
+            os.replace(tmp_data, self.path)
+            os.replace(tmp_idx, self.index_path)
+            self._load_index()
+            self.stats["compactions"] += 1
+            result = {"records": len(self._by_id), "bytes_before": before, "bytes_after": self._data_size()}
+        print(f"[ExperimentStore] 压缩 {self.path}：{result}")
+        return result
+
+
+# ==== 进程内共享实例 ====
+
+_STORES: Dict[str, ExperimentStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def open_store(path: str, **kwargs: Any) -> ExperimentStore:
+    """
+    同一路径在进程内只创建一个 ExperimentStore（并发的闭环 / 工具调用共用同一个写队列）。
+    kwargs 只在第一次创建时生效。
+    """
+    key = os.path.abspath(path)
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = ExperimentStore(path, **kwargs)
+            _STORES[key] = store
+        return store
+
+
+@atexit.register
+def close_all_stores() -> None:
+    with _STORES_LOCK:
+        stores = list(_STORES.values())
+    for store in stores:
+        try:
+            store.close()
+        except Exception as e:
+            print(f"[ExperimentStore] 关闭 {store.path} 失败：{e}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="实验记录 / 候选策略存储的维护工具")
+    parser.add_argument("command", choices=["stats", "compact", "recent"])
+    parser.add_argument("path")
+    parser.add_argument("--id-field", default="exp_id")
+    parser.add_argument("-n", type=int, default=5, help="recent 显示的条数")
+    args = parser.parse_args()
+
+    store = open_store(args.path, id_field=args.id_field)
+    if args.command == "stats":
+        print(json.dumps({"records": len(store), "lines": len(store._entries), "bytes": store._data_size()}))
+    elif args.command == "compact":
+        store.compact()
+    else:
+        for rec in store.recent(args.n):
+            print(json.dumps(rec, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# fake_ollama.py
+# 本地假 Ollama 服务：实现 /api/chat（含流式）、/api/embed、/api/embeddings、/api/tags，
+# 延迟可配置，返回的字段格式与真 Ollama 一致（含 total_duration / eval_count 等）。
+# 用于基准测试和压测，不需要 GPU，也不依赖真模型。
+#
+# 用法：
+#   python fake_ollama.py --port 11435 --chat-latency 0.5 --embed-latency 0.02
+#   # 然后把 OLLAMA_BASE_URL 指向 http://127.0.0.1:11435
+#   python fake_ollama.py --port 11436 --max-parallel 1   # 模拟 OLLAMA_NUM_PARALLEL=1 的单机
+#   python fake_ollama.py --port 11437 --stall-rate 0.05 --stall-s 10   # 5% 的请求卡 10 秒才出首 token
+#
+# 或在代码里：
+#   with FakeOllamaServer(chat_latency_s=0.1) as srv:
+#       model = OllamaChatModel("fake", base_url=srv.base_url)
+
+from typing import Any, Callable, Dict, List, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+
+
+DEFAULT_REPLY = (
+    '{"selected_policies": {"nonRT": "nonrt_baseline", "nearRT": "nearrt_macro_only", '
+    '"beam": "beam_default"}, "status": "ok", "reason": "fake ollama reply"}'
+)
+
+
+def fake_embedding(text: str, dim: int = 768) -> List[float]:
+    """
+    确定性的假向量：按 token 哈希累加到固定维度后归一化，相同文本得到相同向量，
+    有公共词的文本余弦相似度更高（足够让检索基准有意义）。
+    """
+    vec = [0.0] * dim
+    for tok in text.lower().split():
+        h = int.from_bytes(hashlib.md5(tok.encode("utf-8")).digest()[:8], "little")
+        vec[h % dim] += 1.0 if (h >> 63) == 0 else -1.0
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+
+class FakeOllamaServer:
+    """
+    - chat_latency_s：非流式 /api/chat 返回前的延迟（模拟 prefill + decode）；流式模式下是首块之前的延迟；
+    - chat_latency_sigma：> 0 时延迟服从对数正态分布，chat_latency_s 为中位数，
+      sigma 越大长尾越重（0.5 时 p99 约为中位数的 3 倍）；
+    - token_latency_s：流式模式下每个输出块之间的间隔；
+    - embed_latency_s：每次 /api/embed 请求的固定延迟；
+    - reply_text：/api/chat 固定返回的内容；
+    - reply_fn：可选，reply_fn(请求体) -> 回复内容，用于按 system prompt 区分不同 agent 的回复；
+    - max_parallel：> 0 时同时最多处理这么多个 /api/chat（其余排队），模拟 OLLAMA_NUM_PARALLEL；
+    - fail_status：不为 None 时 /api/chat 直接返回这个 HTTP 状态码（模拟故障实例，可运行时修改）；
+    - stall_rate / stall_s：每个 /api/chat 以 stall_rate 的概率在首字节之前额外卡 stall_s 秒（模拟 GPU 抢占 /
+      换页等导致的偶发长尾，可运行时修改）；
+    - request_counts：各路径被调用的次数（线程安全）。
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        chat_latency_s: float = 0.0,
+        chat_latency_sigma: float = 0.0,
+        token_latency_s: float = 0.0,
+        embed_latency_s: float = 0.0,
+        reply_text: str = DEFAULT_REPLY,
+        embed_dim: int = 768,
+        reply_fn: Optional[Callable[[Dict[str, Any]], str]] = None,
+        max_parallel: int = 0,
+        fail_status: Optional[int] = None,
+        stall_rate: float = 0.0,
+        stall_s: float = 10.0,
+    ):
+        self.host = host
+        self.port = port
+        self.chat_latency_s = chat_latency_s
+        self.chat_latency_sigma = chat_latency_sigma
+        self.token_latency_s = token_latency_s
+        self.embed_latency_s = embed_latency_s
+        self.reply_text = reply_text
+        self.embed_dim = embed_dim
+        self.reply_fn = reply_fn
+        self.max_parallel = max_parallel
+        self.fail_status = fail_status
+        self.stall_rate = stall_rate
+        self.stall_s = stall_s
+        self.stalls = 0
+        self._parallel = threading.Semaphore(max_parallel) if max_parallel > 0 else None
+        self.request_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        self._httpd: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def sample_chat_latency(self) -> float:
+        if self.chat_latency_s <= 0 or self.chat_latency_sigma <= 0:
+            return self.chat_latency_s
+        with self._lock:
+            return self.chat_latency_s * math.exp(self._rng.gauss(0.0, self.chat_latency_sigma))
+
+    def sample_stall(self) -> float:
+        if self.stall_rate <= 0:
+            return 0.0
+        with self._lock:
+            if self._rng.random() >= self.stall_rate:
+                return 0.0
+            self.stalls += 1
+        return self.stall_s
+
+    def _count(self, path: str) -> None:
+        with self._lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    # ==== 请求处理 ====
+
+    def reply_for(self, body: Dict[str, Any]) -> str:
+        if self.reply_fn is not None:
+            return self.reply_fn(body)
+        return self.reply_text
+
+    def _chat_response(self, body: Dict[str, Any], elapsed_s: float, text: str) -> Dict[str, Any]:
+        prompt_tokens = sum(len((m.get("content") or "").split()) for m in body.get("messages", []))
+        eval_count = max(1, len(text) // 4)
+        ns = int(elapsed_s * 1e9)
+        return {
+            "model": body.get("model", "fake"),
+            "message": {"role": "assistant", "content": text},
+            "done": True,
+            "total_duration": ns,
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": ns // 4,
+            "eval_count": eval_count,
+            "eval_duration": ns - ns // 4,
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, obj: Dict[str, Any], status: int = 200) -> None:
+                data = json.dumps(obj).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                server._count(self.path)
+                if self.path == "/api/tags":
+                    self._send_json({"models": [{"name": "fake"}]})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                server._count(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                t0 = time.time()
+
+                if self.path == "/api/chat":
+                    if server.fail_status is not None:
+                        self._send_json({"error": "fake failure"}, server.fail_status)
+                        return
+                    if server._parallel is not None:
+                        server._parallel.acquire()
+                    try:
+                        time.sleep(server.sample_stall())
+                        if body.get("stream"):
+                            self._stream_chat(body, t0)
+                            return
+                        time.sleep(server.sample_chat_latency())
+                        self._send_json(server._chat_response(body, time.time() - t0, server.reply_for(body)))
+                    finally:
+                        if server._parallel is not None:
+                            server._parallel.release()
+                elif self.path == "/api/embed":
+                    time.sleep(server.embed_latency_s)
+                    inputs = body.get("input", "")
+                    if isinstance(inputs, str):
+                        inputs = [inputs]
+                    self._send_json({
+                        "model": body.get("model", "fake"),
+                        "embeddings": [fake_embedding(t, server.embed_dim) for t in inputs],
+                    })
+                elif self.path == "/api/embeddings":
+                    time.sleep(server.embed_latency_s)
+                    self._send_json({"embedding": fake_embedding(body.get("prompt", ""), server.embed_dim)})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def _stream_chat(self, body: Dict[str, Any], t0: float) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                text = server.reply_for(body)
+                pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+                time.sleep(server.sample_chat_latency())
+                try:
+                    for piece in pieces:
+                        if server.token_latency_s:
+                            time.sleep(server.token_latency_s)
+                        line = {"message": {"role": "assistant", "content": piece}, "done": False}
+                        self.wfile.write((json.dumps(line) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                    final = server._chat_response(body, time.time() - t0, "")
+                    final["eval_count"] = len(pieces)
+                    self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前断开（流式提前结束），正常情况
+                    pass
+                self.close_connection = True
+
+        return Handler
+
+    # ==== 生命周期 ====
+
+    def start(self) -> "FakeOllamaServer":
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self) -> "FakeOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地假 Ollama 服务（基准测试 / 压测用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="/api/chat 延迟中位数（秒）")
+    parser.add_argument("--chat-sigma", type=float, default=0.0, help="> 0 时延迟按对数正态分布抖动")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="流式输出每块间隔（秒）")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="/api/embed 固定延迟（秒）")
+    parser.add_argument("--max-parallel", type=int, default=0, help="> 0 时同时最多处理的 /api/chat 数")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="/api/chat 偶发卡顿的概率")
+    parser.add_argument("--stall-s", type=float, default=10.0, help="卡顿时长（秒）")
+    args = parser.parse_args()
+
+    srv = FakeOllamaServer(
+        host=args.host,
+        port=args.port,
+        chat_latency_s=args.chat_latency,
+        chat_latency_sigma=args.chat_sigma,
+        token_latency_s=args.token_latency,
+        embed_latency_s=args.embed_latency,
+        max_parallel=args.max_parallel,
+        stall_rate=args.stall_rate,
+        stall_s=args.stall_s,
+    ).start()
+    print(f"[FakeOllama] 监听 {srv.base_url}（Ctrl+C 退出）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# hedging.py
+# 对冲请求（hedged requests）：控制 LLM 调用的尾延迟。
+# 一次调用在“首 token 截止时间”内还没有收到任何输出时，向另一个后端（或同一实例的另一个槽位）
+# 再发一份相同的请求，哪个先吐出第一个 token 就用哪个，另一个立即断开（Ollama 检测到断开会停止生成）。
+#
+# - 截止时间 = 最近若干次调用首 token 耗时的 percentile 分位数（默认 p95），样本不足时用 default_delay_s；
+#   这样只有落在尾部的调用才会被对冲，额外负载约为 (100 - percentile)%；
+# - budget_ratio：对冲请求数最多占调用数的这个比例（后端整体变慢时避免把负载翻倍）；
+# - 输掉比赛、且当时还没有首 token 的原始请求会被判定为“卡死”，计入该后端的熔断失败次数（见 backend_pool.py）。
+#
+# 用法：
+#   model = OllamaChatModel("gpt-oss:20b", backends=pool, hedge=HedgePolicy(percentile=95))
+#   print(model.hedge_stats.snapshot())   # hedge_rate / hedge_wins / saved_s ...
+#   或在 MODEL_ROUTES 的路由里写 "hedge": {"percentile": 95, "budget_ratio": 0.1}
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+import threading
+
+from llm_metrics import Histogram, percentile
+
+
+@dataclass
+class HedgePolicy:
+    percentile: float = 95.0       # 首 token 截止时间取最近样本的哪个分位数
+    min_delay_s: float = 0.05      # 截止时间下限（样本很稳定时避免几乎每次都对冲）
+    max_delay_s: float = 30.0      # 截止时间上限
+    default_delay_s: float = 5.0   # 样本数不足 min_samples 时的截止时间
+    min_samples: int = 20
+    budget_ratio: float = 0.1      # 对冲请求数 / 调用数 的上限
+    window: int = 500              # 保留最近多少个首 token 耗时样本
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict[str, Any]]) -> Optional["HedgePolicy"]:
+        """
+        路由配置里的 "hedge" 字段：None / False 表示不对冲，True 表示全部用默认参数。
+        """
+        if not cfg:
+            return None
+        if cfg is True:
+            return cls()
+        return cls(**cfg)
+
+
+class HedgeStats:
+    """
+    线程安全。一个 OllamaChatModel 一份（即一个路由一份），首 token 耗时样本也按模型统计。
+    """
+
+    def __init__(self, policy: HedgePolicy):
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._ttft = deque(maxlen=max(1, policy.window))
+        self.saved = Histogram()   # 对冲赢了时，原始请求首 token 比对冲请求晚了多少秒
+        self.counts = {
+            "calls": 0,
+            "hedged": 0,          # 发出了对冲请求的调用数
+            "hedge_wins": 0,      # 对冲请求先出首 token
+            "stalls": 0,          # 输掉比赛时还没有首 token 的原始请求（计入熔断）
+            "budget_skips": 0,    # 超过截止时间但对冲预算用完
+            "slot_skips": 0,      # 超过截止时间但没有空闲槽位
+            "retries": 0,         # 原始请求连接失败 / 5xx 后换实例重试
+        }
+
+    def observe_ttft(self, ttft_s: float) -> None:
+        with self._lock:
+            self._ttft.append(ttft_s)
+
+    def delay(self) -> float:
+        p = self.policy
+        with self._lock:
+            if len(self._ttft) < p.min_samples:
+                return p.default_delay_s
+            samples = list(self._ttft)
+        return min(p.max_delay_s, max(p.min_delay_s, percentile(samples, p.percentile)))
+
+    def begin_call(self) -> None:
+        with self._lock:
+            self.counts["calls"] += 1
+
+    def try_hedge(self) -> bool:
+        """
+        超过截止时间时调用：预算允许则计一次对冲并返回 True（允许 1 个突发，避免冷启动时完全不能对冲）。
+        """
+        with self._lock:
+            if self.counts["hedged"] >= self.policy.budget_ratio * self.counts["calls"] + 1:
+                self.counts["budget_skips"] += 1
+                return False
+            self.counts["hedged"] += 1
+            return True
+
+    def incr(self, key: str) -> None:
+        with self._lock:
+            self.counts[key] += 1
+
+    def observe_saved(self, saved_s: float) -> None:
+        with self._lock:
+            self.saved.observe(max(0.0, saved_s))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+            samples = list(self._ttft)
+            saved = self.saved.snapshot()
+            saved["total"] = round(self.saved.sum, 4)
+        calls = counts["calls"] or 1
+        return {
+            **counts,
+            "hedge_rate": round(counts["hedged"] / calls, 4),
+            "win_rate": round(counts["hedge_wins"] / counts["hedged"], 4) if counts["hedged"] else 0.0,
+            "ttft_p50_s": round(percentile(samples, 50), 4),
+            "ttft_p95_s": round(percentile(samples, 95), 4),
+            "delay_s": round(self.delay(), 4),
+            "saved_s": {k: v for k, v in saved.items() if k != "buckets"},
+        }
+
+    def format_summary(self) -> str:
+        s = self.snapshot()
+        return (
+            f"hedge rate={s['hedge_rate']:.1%} wins={s['hedge_wins']}/{s['hedged']} stalls={s['stalls']} "
+            f"delay={s['delay_s']:.2f}s saved total={s['saved_s']['total']:.2f}s p50={s['saved_s']['p50']:.2f}s"
+        )
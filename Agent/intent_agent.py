@@ -1,11 +1,15 @@
 # intent_agent.py
 # Intent Translation Agent：自然语言意图 -> 补全后的 Intent JSON
 
-import json
 from typing import Dict, Any
 from chat_session import RAGChatSession
 from ollama_client import OllamaChatModel, Message
 from vectorstore import SimpleVectorStore
+from structured_output import ask_structured, extract_json_block  # noqa: F401  (extract_json_block 保持旧的导入路径)
+
+
+# 只检索带这些标签的知识库文档（标签见 kb_loader.derive_tags）
+INTENT_RETRIEVAL_TAGS = ("intent",)
 
 
 INTENT_SYSTEM_PROMPT = """
@@ -46,19 +50,32 @@ INTENT_SYSTEM_PROMPT = """
 """
 
 
-def extract_json_block(text: str) -> str:
-    """
-    从模型回复中粗暴提取第一个 {...} JSON 块。
-    """
-    start = text.find("{")
-    end = text.rfind("}")
-    if start == -1 or end == -1 or end <= start:
-        raise ValueError("No JSON object found in text")
-    return text[start : end + 1]
+# Intent JSON 的 schema：既作为 Ollama 的 format 参数约束生成，也用于本地校验
+INTENT_JSON_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "intent_id": {"type": "string"},
+        "objective": {"type": "string"},
+        "kpi_targets": {"type": "object"},
+        "constraints": {"type": "object"},
+        "scope": {
+            "type": "object",
+            "properties": {
+                "cells": {"type": "array", "items": {"type": "integer"}},
+                "duration_s": {"type": "number"},
+            },
+            "required": ["cells", "duration_s"],
+        },
+        "traffic_focus": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["objective", "kpi_targets", "constraints", "scope", "traffic_focus"],
+}
 
 
 def create_intent_agent(model: OllamaChatModel, retriever: SimpleVectorStore) -> RAGChatSession:
-    sess = RAGChatSession(model=model, retriever=retriever, k=3)
+    sess = RAGChatSession(
+        model=model, retriever=retriever, k=3, label="intent", retrieval_filter=INTENT_RETRIEVAL_TAGS
+    )
     sess.history.append(Message(role="system", content=INTENT_SYSTEM_PROMPT))
     return sess
 
@@ -67,18 +84,25 @@ def translate_intent(
     intent_agent: RAGChatSession,
     operator_text: str,
     intent_id: str = "intent_001",
+    use_schema: bool = True,
+    stream: bool = False,
 ) -> Dict[str, Any]:
     """
     调用 Intent Agent，把运营自然语言意图转为 JSON。
+
+    use_schema=True 时用 INTENT_JSON_SCHEMA 作为 Ollama 的 format 约束输出；
+    不论是否启用，都会按 schema 校验，失败时做一次定向修复。
+    stream=True 时流式接收，JSON 对象完整后立即中止生成。
     """
     user_prompt = (
         "运营意图如下：\n"
         f"{operator_text}\n\n"
         "请按 system 中的要求输出 JSON。"
     )
-    reply = intent_agent.ask(user_prompt)
-    raw_json = extract_json_block(reply)
-    data = json.loads(raw_json)
+    data = ask_structured(
+        intent_agent, user_prompt, INTENT_JSON_SCHEMA, use_schema=use_schema, stream=stream,
+        retrieval_query=operator_text,
+    )
 
     # 确保有 intent_id 字段
     if "intent_id" not in data or not data["intent_id"]:
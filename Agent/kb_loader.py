@@ -1,9 +1,27 @@
 # kb_loader.py
 import os
-from typing import List
+import re
+from typing import List, Optional, Tuple
 from vectorstore import Document
 
 
+# 近重复 chunk 去重的 Jaccard 阈值（见 near_dedup.py）；None 表示不去重
+KB_DEDUP_THRESHOLD: Optional[float] = 0.85
+
+# 文档标签（metadata["tags"]）来源：
+#   1. 相对知识库根目录的各级目录名（小写），例如 policy/beam/xx.md -> policy、beam；
+#   2. 相对路径（目录 + 文件名，小写）匹配下面的正则时加对应标签；
+#   3. 文件开头的 front-matter：---\ntags: [a, b]\n---（也支持 "tags: a, b" 和 "- a" 列表），正文不含 front-matter。
+KB_TAG_PATTERNS: List[Tuple[str, str]] = [
+    (r"intent|意图", "intent"),
+    (r"polic|策略", "policy"),
+    (r"kpi|metric|指标", "kpi"),
+    (r"experiment|实验", "experiment"),
+]
+
+_FRONT_MATTER_RE = re.compile(r"\A---[ \t]*\r?\n(.*?)\r?\n---[ \t]*(?:\r?\n|\Z)", re.S)
+
+
 def split_text_into_chunks(text, max_chars=500, overlap=100):
     paragraphs = text.split("\n\n")
     chunks = []
@@ -42,7 +60,49 @@ def split_text_into_chunks(text, max_chars=500, overlap=100):
     return chunks
 
 
-def load_knowledge_from_folder(folder_path, exts=None) -> List[Document]:
+def parse_front_matter(text: str) -> Tuple[List[str], str]:
+    """
+    返回 (front-matter 里的 tags, 去掉 front-matter 后的正文)；没有 front-matter 时 tags 为空、正文不变。
+    """
+    m = _FRONT_MATTER_RE.match(text)
+    if not m:
+        return [], text
+    tags: List[str] = []
+    in_tags = False
+    for line in m.group(1).splitlines():
+        stripped = line.strip()
+        if in_tags and stripped.startswith("-"):
+            tags.append(stripped[1:].strip())
+            continue
+        key, sep, value = line.partition(":")
+        in_tags = False
+        if sep and key.strip().lower() in ("tags", "tag"):
+            value = value.strip().strip("[]")
+            if value:
+                tags.extend(value.split(","))
+            else:
+                in_tags = True
+    tags = [t.strip().strip("'\"") for t in tags]
+    return [t for t in tags if t], text[m.end():]
+
+
+def derive_tags(rel_path: str, front_matter_tags: Optional[List[str]] = None) -> List[str]:
+    """
+    按目录名、KB_TAG_PATTERNS 和 front-matter 生成文档标签（小写、去重、排序）。
+    """
+    rel = rel_path.replace("\\", "/").lower()
+    tags = {part for part in rel.split("/")[:-1] if part and part != "."}
+    tags.update(tag for pattern, tag in KB_TAG_PATTERNS if re.search(pattern, rel))
+    tags.update(t.lower() for t in (front_matter_tags or []))
+    return sorted(tags)
+
+
+def load_knowledge_from_folder(folder_path, exts=None, dedup_threshold=KB_DEDUP_THRESHOLD) -> List[Document]:
+    """
+    每个 chunk 的 metadata 带 source / chunk_index / tags（见 derive_tags）。
+    dedup_threshold 不为 None 时对所有 chunk 做近重复去重（MinHash + LSH，需要 numpy），
+    每个簇只保留一个代表，被合并的 chunk 的 id / 来源记在代表的 metadata 里，并打印索引缩小了多少。
+    """
     if exts is None:
         exts = [".txt", ".md"]
 
@@ -64,6 +124,8 @@ def load_knowledge_from_folder(folder_path, exts=None) -> List[Document]:
             except Exception:
                 continue
 
+            front_tags, text = parse_front_matter(text)
+            tags = derive_tags(os.path.relpath(full_path, folder_path), front_tags)
             chunks = split_text_into_chunks(text, max_chars=500, overlap=100)
             for idx, chunk in enumerate(chunks):
                 doc_id = "%s_%d" % (name, idx)
@@ -74,8 +136,18 @@ def load_knowledge_from_folder(folder_path, exts=None) -> List[Document]:
                         metadata={
                             "source": full_path,
                             "chunk_index": idx,
+                            "tags": tags,
                         },
                     )
                 )
 
+    if dedup_threshold is not None and len(docs) > 1:
+        try:
+            from near_dedup import dedup_near_duplicates
+        except ImportError as e:
+            print(f"[KB] 未安装 numpy，跳过近重复去重：{e}")
+            return docs
+        docs, stats = dedup_near_duplicates(docs, threshold=dedup_threshold)
+        print(stats.format_summary())
+
     return docs
@@ -0,0 +1,227 @@
+# kpi_gap.py
+# 数值 KPI gap 引擎：把 sim_result.kpi 和 intent_json 里的 kpi_targets / constraints 逐项对比，
+# 记录每一轮的 gap 轨迹，并判断闭环是否可以提前结束（目标已达成 / 连续几轮没有进展）。
+#
+# intent_json 的 key 由 LLM 生成，写法不固定（例如 "ue_tput_5p_min_Mbps": 2.0、
+# "sum_tput_Mbps": {"min": 80}、"energy_max_W": "500 W"），这里按关键字做宽松匹配。
+
+from typing import Dict, Any, List, Optional, Tuple
+from dataclasses import dataclass, asdict
+import re
+
+
+# (关键字, sim_result.kpi 中的字段, 默认方向)；方向 "min" 表示 current >= target
+# 按顺序匹配：95p 要排在 5p 前面，energy 要排在 sum/total 前面
+_KPI_ALIASES: List[Tuple[Tuple[str, ...], str, str]] = [
+    (("energy", "power"), "estimated_energy_W", "max"),
+    (("sleep",), "sleep_ratio_small_cells", "min"),
+    (("95p", "95%"), "ue_tput_95p", "min"),
+    (("50p", "50%", "median"), "ue_tput_50p", "min"),
+    (("5p", "5%", "tail", "cell_edge"), "ue_tput_5p", "min"),
+    (("sum", "total"), "sum_tput_Mbps", "min"),
+]
+
+# constraints 中的定性优先级 -> 相对基线（第 0 轮）的软目标
+_PRIORITY_RELATIVE_TARGETS: Dict[str, Dict[str, Tuple[str, float]]] = {
+    "energy_priority": {
+        "high": ("estimated_energy_W", 0.85),     # 能耗至少比基线低 15%
+        "medium": ("estimated_energy_W", 0.95),
+    },
+}
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+@dataclass
+class KpiGap:
+    kpi: str                # sim_result.kpi 中的字段名
+    source: str             # 来自 intent_json 的哪个 key
+    direction: str          # "min"（越大越好，需 >= target）/ "max"（越小越好，需 <= target）
+    target: float
+    current: Optional[float]
+    gap: Optional[float]    # 有符号差值：>= 0 表示达标，< 0 表示差多少
+    met: bool
+    soft: bool = False      # True 表示来自定性 constraints 的软目标，不参与“全部达标”判断
+
+    @property
+    def shortfall_ratio(self) -> float:
+        """
+        归一化缺口（未达标时 = |gap| / |target|，达标为 0），用于跨 KPI 汇总进展。
+        """
+        if self.met or self.gap is None:
+            return 0.0 if self.met else 1.0
+        return abs(self.gap) / max(abs(self.target), 1e-9)
+
+
+def _to_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        m = _NUMBER_RE.search(value)
+        if m:
+            return float(m.group(0))
+    return None
+
+
+def _match_kpi(key: str) -> Optional[Tuple[str, str]]:
+    lower = key.lower()
+    for keywords, field, default_dir in _KPI_ALIASES:
+        if any(kw in lower for kw in keywords):
+            if "max" in lower or "upper" in lower:
+                return field, "max"
+            if "min" in lower or "lower" in lower:
+                return field, "min"
+            return field, default_dir
+    return None
+
+
+def parse_intent_targets(intent_json: Dict[str, Any]) -> List[Tuple[str, str, str, float]]:
+    """
+    从 kpi_targets 和 constraints 中提取所有数值目标：[(source_key, kpi_field, direction, target)]。
+    值可以是数字、带单位的字符串，或 {"min": x} / {"max": y} 形式的 dict。
+    """
+    targets = []
+    for section in ("kpi_targets", "constraints"):
+        for key, value in (intent_json.get(section) or {}).items():
+            matched = _match_kpi(key)
+            if matched is None:
+                continue
+            field, direction = matched
+            if isinstance(value, dict):
+                for bound in ("min", "max"):
+                    num = _to_number(value.get(bound))
+                    if num is not None:
+                        targets.append((f"{section}.{key}.{bound}", field, bound, num))
+                continue
+            num = _to_number(value)
+            if num is not None:
+                targets.append((f"{section}.{key}", field, direction, num))
+    return targets
+
+
+def _make_gap(kpi_name, source, direction, target, kpi, soft=False) -> KpiGap:
+    current = _to_number(kpi.get(kpi_name))
+    if current is None:
+        return KpiGap(kpi_name, source, direction, target, None, None, False, soft)
+    gap = current - target if direction == "min" else target - current
+    return KpiGap(kpi_name, source, direction, target, current, gap, gap >= 0, soft)
+
+
+def compute_kpi_gaps(
+    sim_result: Dict[str, Any],
+    intent_json: Dict[str, Any],
+    baseline_kpi: Optional[Dict[str, Any]] = None,
+) -> List[KpiGap]:
+    """
+    逐项比较当前 KPI 与意图目标。
+    baseline_kpi（一般是第 0 轮的 KPI）用于把 energy_priority 这类定性约束换算成软目标。
+    """
+    kpi = sim_result.get("kpi", {}) or {}
+    gaps = [
+        _make_gap(field, source, direction, target, kpi)
+        for source, field, direction, target in parse_intent_targets(intent_json)
+    ]
+
+    if baseline_kpi:
+        constraints = intent_json.get("constraints") or {}
+        for key, levels in _PRIORITY_RELATIVE_TARGETS.items():
+            level = str(constraints.get(key, "")).lower()
+            if level not in levels:
+                continue
+            field, ratio = levels[level]
+            base = _to_number(baseline_kpi.get(field))
+            if base is None or any(g.kpi == field for g in gaps):
+                continue
+            gaps.append(_make_gap(field, f"constraints.{key}={level}", "max", base * ratio, kpi, soft=True))
+    return gaps
+
+
+def format_gap_table(gaps: List[KpiGap], prev_gaps: Optional[List[KpiGap]] = None) -> str:
+    """
+    紧凑的文本 gap 表（给 policy agent 用），每行：kpi|current|target|gap|met|delta_vs_prev。
+    """
+    prev = {(g.kpi, g.source): g for g in (prev_gaps or [])}
+    lines = ["kpi|current|target|gap|met|delta"]
+    for g in gaps:
+        op = ">=" if g.direction == "min" else "<="
+        cur = "NA" if g.current is None else f"{g.current:.3g}"
+        gap = "NA" if g.gap is None else f"{g.gap:+.3g}"
+        p = prev.get((g.kpi, g.source))
+        if p is not None and p.current is not None and g.current is not None:
+            delta = f"{g.current - p.current:+.3g}"
+        else:
+            delta = "-"
+        met = ("Y" if g.met else "N") + ("(soft)" if g.soft else "")
+        lines.append(f"{g.kpi}|{cur}|{op}{g.target:.3g}|{gap}|{met}|{delta}")
+    return "\n".join(lines)
+
+
+class ConvergenceTracker:
+    """
+    记录每一轮的 gap，并给出是否提前结束闭环的判断：
+    - targets_met：所有硬目标都已达标（软目标不要求）；
+    - stalled：连续 patience 轮，总归一化缺口的改善都小于 min_improvement。
+    intent 里没有任何数值目标时，不会提前结束。
+    """
+
+    def __init__(self, intent_json: Dict[str, Any], patience: int = 2, min_improvement: float = 0.02):
+        self.intent_json = intent_json
+        self.patience = patience
+        self.min_improvement = min_improvement
+        self.baseline_kpi: Optional[Dict[str, Any]] = None
+        self.history: List[Dict[str, Any]] = []
+
+    def update(self, round_idx: int, sim_result: Dict[str, Any]) -> List[KpiGap]:
+        if self.baseline_kpi is None:
+            self.baseline_kpi = dict(sim_result.get("kpi", {}) or {})
+        gaps = compute_kpi_gaps(sim_result, self.intent_json, self.baseline_kpi)
+        self.history.append({
+            "round_idx": round_idx,
+            "policy_ids": sim_result.get("policy_ids", {}),
+            "gaps": gaps,
+            "shortfall": sum(g.shortfall_ratio for g in gaps if not g.soft),
+        })
+        return gaps
+
+    @property
+    def latest_gaps(self) -> List[KpiGap]:
+        return self.history[-1]["gaps"] if self.history else []
+
+    def gap_table(self) -> str:
+        prev = self.history[-2]["gaps"] if len(self.history) >= 2 else None
+        return format_gap_table(self.latest_gaps, prev)
+
+    def should_stop(self) -> Tuple[bool, str]:
+        if not self.history:
+            return False, ""
+
+        hard = [g for g in self.latest_gaps if not g.soft]
+        if not hard:
+            # 没有可量化的目标，交给 policy agent / MAX_ROUNDS 决定何时结束
+            return False, ""
+        if all(g.met for g in hard):
+            return True, "targets_met"
+
+        if len(self.history) > self.patience:
+            window = [h["shortfall"] for h in self.history[-(self.patience + 1):]]
+            best_before = window[0]
+            improvement = best_before - min(window[1:])
+            if improvement < self.min_improvement:
+                return True, "stalled"
+        return False, ""
+
+    def trajectory(self) -> List[Dict[str, Any]]:
+        """
+        每轮 gap 的可序列化快照（写日志 / JSONL 用）。
+        """
+        return [
+            {
+                "round_idx": h["round_idx"],
+                "policy_ids": h["policy_ids"],
+                "shortfall": round(h["shortfall"], 4),
+                "gaps": [asdict(g) for g in h["gaps"]],
+            }
+            for h in self.history
+        ]
@@ -0,0 +1,254 @@
+# llm_metrics.py
+# 进程内 LLM 调用指标：每次 /api/chat 调用记录 Ollama 返回的时间分解
+# （total / load / prompt_eval(prefill) / eval(decode)）、token 数、墙钟时间和调用方标签，
+# 按标签聚合成直方图 + 分位数，可导出为 JSONL，web_chat 的 /metrics 直接返回 snapshot()。
+#
+# 用来回答“这一轮为什么慢”：是模型加载、长 prompt 的 prefill，还是生成本身（decode）。
+
+from typing import Any, Dict, List, Optional
+from collections import deque
+from dataclasses import dataclass, asdict
+import bisect
+import json
+import os
+import threading
+import time
+
+
+# Ollama 返回的时间字段单位是纳秒
+_NS = 1e-9
+
+# 直方图桶上界（秒），覆盖几十毫秒的短回复到几分钟的长推理
+DEFAULT_BUCKETS_S = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# 每个直方图保留的最近样本数（分位数基于这些样本计算）
+MAX_SAMPLES = 2048
+
+
+@dataclass
+class LLMCallRecord:
+    ts: float                       # 调用开始时间（unix 秒）
+    label: str                      # 调用方标签：intent / policy / sim_summary / web_chat ...
+    model: str
+    kind: str                       # chat / chat_with_tools / chat_stream
+    wall_s: float                   # 客户端看到的墙钟时间
+    n_messages: int
+    prompt_chars: int
+    completion_chars: int
+    total_s: Optional[float] = None             # total_duration
+    load_s: Optional[float] = None              # load_duration（模型加载）
+    prompt_eval_count: Optional[int] = None     # prefill token 数
+    prompt_eval_s: Optional[float] = None       # prefill 耗时
+    eval_count: Optional[int] = None            # decode token 数
+    eval_s: Optional[float] = None              # decode 耗时
+    ok: bool = True
+    error: str = ""
+
+    @property
+    def decode_tokens_per_s(self) -> Optional[float]:
+        if not self.eval_count or not self.eval_s:
+            return None
+        return self.eval_count / self.eval_s
+
+
+def _ns_to_s(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    return float(value) * _NS
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(p / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计 token 数（不依赖 tokenizer）：CJK 字符按 1 个 token，其余按约 4 个字符 1 个 token。
+    只用于比较不同 prompt 编码方式的相对大小；精确值以 Ollama 返回的 prompt_eval_count 为准。
+    """
+    cjk = sum(1 for ch in text if "\u3000" <= ch <= "\u9fff" or "\uff00" <= ch <= "\uffef")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_messages_tokens(messages: List[Any]) -> int:
+    # 每条消息额外算 4 个 token 的角色 / 模板开销
+    return sum(estimate_tokens(m.content or "") + 4 for m in messages)
+
+
+def make_record(
+    label: str,
+    model: str,
+    kind: str,
+    t_start: float,
+    messages: List[Any],
+    completion: str,
+    data: Optional[Dict[str, Any]] = None,
+    error: Optional[BaseException] = None,
+) -> LLMCallRecord:
+    """
+    由一次调用的输入消息、输出文本和 Ollama 响应（非流式的响应体 / 流式的最后一个 done 块）组装记录。
+    """
+    data = data or {}
+    return LLMCallRecord(
+        ts=t_start,
+        label=label or "unlabeled",
+        model=model,
+        kind=kind,
+        wall_s=time.time() - t_start,
+        n_messages=len(messages),
+        prompt_chars=sum(len(m.content or "") for m in messages),
+        completion_chars=len(completion or ""),
+        total_s=_ns_to_s(data.get("total_duration")),
+        load_s=_ns_to_s(data.get("load_duration")),
+        prompt_eval_count=data.get("prompt_eval_count"),
+        prompt_eval_s=_ns_to_s(data.get("prompt_eval_duration")),
+        eval_count=data.get("eval_count"),
+        eval_s=_ns_to_s(data.get("eval_duration")),
+        ok=error is None,
+        error="" if error is None else f"{type(error).__name__}: {error}",
+    )
+
+
+class Histogram:
+    """
+    固定桶计数（累计分布，便于按桶对比）+ 最近 MAX_SAMPLES 个样本（用于分位数）。
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_S, max_samples: int = MAX_SAMPLES):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # 最后一个是 +Inf 桶
+        self.samples: deque = deque(maxlen=max_samples)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        values = list(self.samples)
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 4) if self.count else 0.0,
+            "p50": round(percentile(values, 50), 4),
+            "p95": round(percentile(values, 95), 4),
+            "p99": round(percentile(values, 99), 4),
+            "max": round(max(values), 4) if values else 0.0,
+            "buckets": {
+                **{f"le_{b:g}": c for b, c in zip(self.buckets, self.counts)},
+                "le_inf": self.counts[-1],
+            },
+        }
+
+
+# 每个标签下维护的直方图：记录字段 -> 直方图名
+_HISTOGRAM_FIELDS = {
+    "wall_s": "wall_s",
+    "load_s": "load_s",
+    "prompt_eval_s": "prefill_s",
+    "eval_s": "decode_s",
+}
+
+
+class MetricsRegistry:
+    """
+    线程安全的进程内指标表。
+    - record()：记录一次调用（可选同时追加写入 jsonl_path）；
+    - snapshot()：按标签聚合的计数 / 错误数 / token 数 / 各阶段耗时直方图；
+    - export_jsonl()：把内存中最近的调用记录导出为 JSONL。
+    """
+
+    def __init__(self, max_records: int = 10000, jsonl_path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self.records: deque = deque(maxlen=max_records)
+        self.jsonl_path = jsonl_path
+        self._labels: Dict[str, Dict[str, Any]] = {}
+
+    def _label_stats(self, label: str) -> Dict[str, Any]:
+        stats = self._labels.get(label)
+        if stats is None:
+            stats = {
+                "calls": 0,
+                "errors": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "hist": {name: Histogram() for name in _HISTOGRAM_FIELDS.values()},
+                "decode_tps": Histogram(buckets=(5, 10, 20, 40, 80, 160, 320)),
+            }
+            self._labels[label] = stats
+        return stats
+
+    def record(self, rec: LLMCallRecord) -> None:
+        with self._lock:
+            self.records.append(rec)
+            for key in (rec.label, "_all"):
+                stats = self._label_stats(key)
+                stats["calls"] += 1
+                if not rec.ok:
+                    stats["errors"] += 1
+                stats["prompt_tokens"] += rec.prompt_eval_count or 0
+                stats["completion_tokens"] += rec.eval_count or 0
+                for fld, name in _HISTOGRAM_FIELDS.items():
+                    value = getattr(rec, fld)
+                    if value is not None:
+                        stats["hist"][name].observe(value)
+                tps = rec.decode_tokens_per_s
+                if tps is not None:
+                    stats["decode_tps"].observe(tps)
+
+            if self.jsonl_path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.jsonl_path)), exist_ok=True)
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(asdict(rec), ensure_ascii=False) + "\n")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for label, stats in self._labels.items():
+                out[label] = {
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "prompt_tokens": stats["prompt_tokens"],
+                    "completion_tokens": stats["completion_tokens"],
+                    **{name: h.snapshot() for name, h in stats["hist"].items()},
+                    "decode_tokens_per_s": stats["decode_tps"].snapshot(),
+                }
+            return out
+
+    def recent(self, n: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [asdict(r) for r in list(self.records)[-n:]]
+
+    def export_jsonl(self, path: str) -> int:
+        with self._lock:
+            rows = [asdict(r) for r in self.records]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return len(rows)
+
+    def format_summary(self) -> str:
+        """
+        每个标签一行：调用数、墙钟 p50/p95，以及 load / prefill / decode 的 p50，便于终端查看。
+        """
+        lines = []
+        for label, s in sorted(self.snapshot().items()):
+            lines.append(
+                f"[LLM {label}] calls={s['calls']} errors={s['errors']} "
+                f"wall p50={s['wall_s']['p50']:.2f}s p95={s['wall_s']['p95']:.2f}s | "
+                f"load p50={s['load_s']['p50']:.2f}s prefill p50={s['prefill_s']['p50']:.2f}s "
+                f"decode p50={s['decode_s']['p50']:.2f}s | "
+                f"tokens in/out={s['prompt_tokens']}/{s['completion_tokens']}"
+            )
+        return "\n".join(lines)
+
+
+# 全局默认指标表：OllamaChatModel 不指定 metrics 时都记到这里
+REGISTRY = MetricsRegistry()
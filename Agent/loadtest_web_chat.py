@@ -0,0 +1,330 @@
+# loadtest_web_chat.py
+# web_chat.py 压测：在本地起一个假 Ollama（延迟服从对数正态分布），再以子进程方式启动 web_chat
+# （dev = Flask 开发服务器 / waitress = 生产 WSGI），然后用多个并发用户回放多轮对话，
+# 每个用户一个 session_id。输出吞吐、p50/p95/p99 延迟、错误率、服务进程内存增长。
+#
+# 用法：
+#   python loadtest_web_chat.py --users 32 --turns 6 --mode waitress
+#   python loadtest_web_chat.py --users 32 --compare-modes --out loadtest.json
+#   python loadtest_web_chat.py --url http://10.0.0.5:5000 --users 8    # 压一个已经在跑的服务
+#
+# 注意：压已有服务时，它后面连的是真 Ollama，结果反映的是真实模型延迟。
+
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from fake_ollama import FakeOllamaServer
+from llm_metrics import percentile
+
+
+# 多轮对话脚本：每个虚拟用户随机选一个，按顺序发送
+CONVERSATIONS: List[List[str]] = [
+    [
+        "今晚 22 点以后想给小小区做节能，有什么建议？",
+        "如果同时要保证视频业务的 5% UE 吞吐不低于 2 Mbps 呢？",
+        "给一个具体的 non-RT 策略参数组合。",
+        "这个组合对宏站负载有什么影响？",
+    ],
+    [
+        "上一轮仿真里 sum throughput 掉了 10%，可能是什么原因？",
+        "查一下历史实验里和视频体验相关的记录。",
+        "near-RT 的 video_to_small_threshold 应该往哪个方向调？",
+        "调完之后需要关注哪些 KPI？",
+        "帮我把结论整理成三条要点。",
+    ],
+    [
+        "解释一下 beam_geometry_16 和 beam_default 的区别。",
+        "边缘用户多的时候选哪个？",
+        "能耗上有差异吗？",
+    ],
+    [
+        "URLLC 业务时延突然升高，先排查什么？",
+        "如果是小区负载不均导致的，near-RT 侧怎么处理？",
+        "给出一个回滚方案。",
+        "回滚后多久能在 KPI 上看到效果？",
+        "把上面的步骤写成值班手册的格式。",
+        "再补充一下需要通知哪些团队。",
+    ],
+]
+
+
+# ==== 服务进程管理 ====
+
+def _rss_mb(pid: int) -> Optional[float]:
+    """
+    读取进程常驻内存（MB）：优先用 psutil（Windows 也可用），否则读 /proc；都不可用时返回 None。
+    """
+    try:
+        import psutil  # type: ignore
+
+        return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        return None
+    return None
+
+
+def _wait_ready(url: str, timeout_s: float) -> None:
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        try:
+            if requests.get(url + "/metrics", timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"web_chat 未在 {timeout_s:.0f}s 内就绪：{url}")
+
+
+def start_web_chat(mode: str, port: int, ollama_url: str, kb_folder: str, threads: int) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "OLLAMA_BASE_URL": ollama_url,
+        "KNOWLEDGE_FOLDER": kb_folder,
+        "WEB_CHAT_SERVER": mode,
+        "WEB_CHAT_PORT": str(port),
+        "WEB_CHAT_DEBUG": "0",
+        "WEB_CHAT_THREADS": str(threads),
+        "PYTHONUNBUFFERED": "1",
+    })
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "web_chat.py")
+    return subprocess.Popen(
+        [sys.executable, script],
+        cwd=os.path.dirname(script),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _write_synth_kb(folder: str, n_files: int = 20) -> None:
+    rng = random.Random(7)
+    words = "小区 休眠 能耗 吞吐 时延 波束 切换 负载 门限 策略 意图 macro small UE KPI".split()
+    os.makedirs(folder, exist_ok=True)
+    for i in range(n_files):
+        paras = ["".join(rng.choice(words) for _ in range(80)) for _ in range(6)]
+        with open(os.path.join(folder, f"kb_{i:03d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paras))
+
+
+# ==== 负载生成 ====
+
+class _Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.requests = 0
+
+    def add(self, latency_s: float, error: Optional[str]) -> None:
+        with self._lock:
+            self.requests += 1
+            if error is None:
+                self.latencies.append(latency_s)
+            else:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+
+def _run_user(
+    url: str,
+    user_idx: int,
+    turns: int,
+    think_time_s: float,
+    timeout_s: float,
+    seed: int,
+    rec: _Recorder,
+) -> None:
+    rng = random.Random(seed * 1000 + user_idx)
+    script = rng.choice(CONVERSATIONS)
+    session_id = f"load_{seed}_{user_idx}"
+    http = requests.Session()
+    for t in range(turns):
+        msg = script[t % len(script)]
+        t0 = time.perf_counter()
+        error = None
+        try:
+            resp = http.post(url + "/api/chat", json={"session_id": session_id, "message": msg}, timeout=timeout_s)
+            if resp.status_code != 200:
+                error = f"http_{resp.status_code}"
+            elif "reply" not in resp.json():
+                error = "bad_body"
+        except requests.Timeout:
+            error = "timeout"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        rec.add(time.perf_counter() - t0, error)
+        if think_time_s > 0:
+            time.sleep(rng.expovariate(1.0 / think_time_s))
+
+
+def run_load(
+    url: str,
+    users: int,
+    turns: int,
+    think_time_s: float = 0.0,
+    timeout_s: float = 60.0,
+    seed: int = 0,
+    server_pid: Optional[int] = None,
+) -> Dict[str, Any]:
+    rec = _Recorder()
+    rss_samples: List[float] = []
+    stop = threading.Event()
+
+    def _sample_rss():
+        while not stop.is_set():
+            v = _rss_mb(server_pid) if server_pid else None
+            if v is not None:
+                rss_samples.append(v)
+            stop.wait(0.5)
+
+    rss_start = _rss_mb(server_pid) if server_pid else None
+    sampler = threading.Thread(target=_sample_rss, daemon=True)
+    sampler.start()
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        futures = [
+            pool.submit(_run_user, url, i, turns, think_time_s, timeout_s, seed, rec)
+            for i in range(users)
+        ]
+        for f in futures:
+            f.result()
+    elapsed = time.perf_counter() - t0
+
+    stop.set()
+    sampler.join(timeout=2)
+    rss_end = _rss_mb(server_pid) if server_pid else None
+
+    lat = rec.latencies
+    n_err = sum(rec.errors.values())
+    # 采样间隔 0.5s，短压测可能一个采样都没有，峰值要把起止两次读数也算上
+    rss_all = [v for v in [rss_start, *rss_samples, rss_end] if v is not None]
+    report: Dict[str, Any] = {
+        "users": users,
+        "turns": turns,
+        "requests": rec.requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(rec.requests / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency_s": {
+            "p50": round(percentile(lat, 50), 4),
+            "p95": round(percentile(lat, 95), 4),
+            "p99": round(percentile(lat, 99), 4),
+            "max": round(max(lat), 4) if lat else 0.0,
+        },
+        "error_rate": round(n_err / rec.requests, 4) if rec.requests else 0.0,
+        "errors": rec.errors,
+        "rss_mb": {
+            "start": None if rss_start is None else round(rss_start, 1),
+            "end": None if rss_end is None else round(rss_end, 1),
+            "peak": round(max(rss_all), 1) if rss_all else None,
+            "growth": None if rss_start is None or rss_end is None else round(rss_end - rss_start, 1),
+        },
+    }
+    try:
+        server_metrics = requests.get(url + "/metrics", timeout=5).json()
+        report["server"] = {
+            "sessions": server_metrics.get("sessions"),
+            "sessions_evicted": server_metrics.get("sessions_evicted"),
+            "history_messages": server_metrics.get("history_messages"),
+            "llm_calls": (server_metrics.get("llm", {}).get("_all") or {}).get("calls"),
+        }
+    except (requests.RequestException, ValueError):
+        pass
+    return report
+
+
+def run_mode(mode: str, args: argparse.Namespace, fake: FakeOllamaServer, kb_folder: str) -> Dict[str, Any]:
+    proc = start_web_chat(mode, args.port, fake.base_url, kb_folder, args.threads)
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        _wait_ready(url, args.startup_timeout)
+        print(f"[LoadTest] {mode}: {args.users} 用户 x {args.turns} 轮 ...")
+        report = run_load(url, args.users, args.turns, args.think_time, args.timeout, args.seed, proc.pid)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    report["mode"] = mode
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lat = report["latency_s"]
+    rss = report["rss_mb"]
+    rss_text = "NA" if rss["start"] is None else f"{rss['start']}->{rss['end']}MB (peak {rss['peak']}, +{rss['growth']})"
+    return (
+        f"[{report.get('mode', 'remote')}] {report['requests']} req in {report['elapsed_s']}s, "
+        f"{report['throughput_rps']} req/s | p50={lat['p50']:.3f}s p95={lat['p95']:.3f}s "
+        f"p99={lat['p99']:.3f}s max={lat['max']:.3f}s | errors={report['error_rate']:.2%} {report['errors'] or ''} | "
+        f"rss {rss_text}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="web_chat.py 压测（多会话多轮对话回放）")
+    parser.add_argument("--url", default="", help="压测已运行的服务；不填则本地启动 web_chat + 假 Ollama")
+    parser.add_argument("--mode", choices=["dev", "waitress"], default="waitress")
+    parser.add_argument("--compare-modes", action="store_true", help="依次压测 dev 和 waitress 并对比")
+    parser.add_argument("--users", type=int, default=16, help="并发用户数（每个用户一个 session_id）")
+    parser.add_argument("--turns", type=int, default=5, help="每个用户的对话轮数")
+    parser.add_argument("--think-time", type=float, default=0.0, help="用户两轮之间的平均思考时间（秒，指数分布）")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单个请求超时（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--threads", type=int, default=16, help="waitress 工作线程数")
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="假 Ollama /api/chat 延迟中位数（秒）")
+    parser.add_argument("--chat-sigma", type=float, default=0.5, help="假 Ollama 延迟的对数正态 sigma")
+    parser.add_argument("--embed-latency", type=float, default=0.01)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--out", default="", help="结果 JSON 输出路径")
+    args = parser.parse_args()
+
+    reports: List[Dict[str, Any]] = []
+    if args.url:
+        rep = run_load(args.url.rstrip("/"), args.users, args.turns, args.think_time, args.timeout, args.seed)
+        reports.append(rep)
+        print(format_report(rep))
+    else:
+        kb_folder = tempfile.mkdtemp(prefix="loadtest_kb_")
+        _write_synth_kb(kb_folder)
+        with FakeOllamaServer(
+            chat_latency_s=args.chat_latency,
+            chat_latency_sigma=args.chat_sigma,
+            embed_latency_s=args.embed_latency,
+        ) as fake:
+            modes = ["dev", "waitress"] if args.compare_modes else [args.mode]
+            for mode in modes:
+                rep = run_mode(mode, args, fake, kb_folder)
+                rep["fake_ollama"] = {"chat_latency_s": args.chat_latency, "chat_latency_sigma": args.chat_sigma}
+                reports.append(rep)
+                print(format_report(rep))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+        print(f"[LoadTest] 结果已保存 -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
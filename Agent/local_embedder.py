@@ -0,0 +1,323 @@
+# local_embedder.py
+# 本地 CPU 文本向量化，不需要 embedding 服务（/api/embed 经常 500 时的替代方案）：
+# 哈希 TF-IDF + 可选的稀疏随机投影，全部用 NumPy 批量计算。
+#
+# - 分词：英文 / 数字按单词（policy id 这类 a_b-c.d 算一个词），中文按单字 + 相邻二字（bigram）；
+# - 哈希：词 -> crc32 -> n_features 维的特征下标（不需要词表，跨进程稳定）；
+# - 权重：tf = 1 + log(词频)，idf 由已加入索引的文档统计（log((1 + N) / (1 + df)) + 1）；
+# - 投影：dim > 0 时每个特征按 density 个哈希位置 ±1 投到 dim 维稠密 float32 向量（稀疏随机投影），
+#   dim = 0 时直接在 n_features 维稀疏空间里算余弦相似度（更准，查询稍慢）。
+#
+# SimpleVectorStore(embed_model="local-tfidf") 即可使用（"local-tfidf:0" 不投影，"local-tfidf:384" 投影到 384 维）。
+# 单独使用：
+#   index = LocalTfidfIndex(HashingTfidfEmbedder(dim=256))
+#   index.add(["文本一", "text two"])
+#   index.search("查询", k=4)   # -> [(文档序号, 相似度), ...]
+#   index.set_partition("policy", [0, 5, 9])   # 预先登记的文档子集（例如按标签）
+#   index.search("查询", k=4, partition="policy")   # 只对子集打分
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import math
+import re
+import threading
+import zlib
+
+import numpy as np
+
+
+DEFAULT_DIM = 256
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:[._\-][a-z0-9]+)*")
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]+")
+_MAX_TOKEN_CACHE = 1_000_000
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def embedder_from_model_name(name: str) -> "HashingTfidfEmbedder":
+    """
+    "local-tfidf" -> 默认 256 维投影；"local-tfidf:<dim>" 指定投影维度（0 表示不投影）。
+    """
+    _, _, dim = name.partition(":")
+    return HashingTfidfEmbedder(dim=int(dim) if dim else DEFAULT_DIM)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    与 term_matrix 的特征一一对应的分词结果（调试用；term_matrix 对中文直接按码点批量哈希，不生成字符串）。
+    """
+    low = text.lower()
+    out = _WORD_RE.findall(low)
+    for run in _CJK_RE.findall(low):
+        out.extend(run)
+        out.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return out
+
+
+def _mix(x: np.ndarray, salt: int) -> np.ndarray:
+    h = (x + np.uint64(salt)) * _GOLDEN
+    return h ^ (h >> np.uint64(31))
+
+
+class HashingTfidfEmbedder:
+    """
+    无状态（idf 由 LocalTfidfIndex 维护），线程安全；只缓存 词 -> 特征下标。
+    """
+
+    def __init__(self, n_features: int = 1 << 18, dim: int = DEFAULT_DIM, density: int = 4, seed: int = 0):
+        if n_features & (n_features - 1) or not 0 < n_features <= 1 << 31:
+            raise ValueError("n_features 必须是不超过 2^31 的 2 的幂")
+        self.n_features = n_features
+        self.dim = dim
+        self.density = max(1, density)
+        self._mask = n_features - 1
+        self._cache: dict = {}
+        rng = np.random.default_rng(seed)
+        # 每个投影哈希一组 (奇数乘子, 加数)，uint64 运算自然回绕
+        self._mult = rng.integers(1, 1 << 63, size=self.density, dtype=np.uint64) | np.uint64(1)
+        self._add = rng.integers(0, 1 << 63, size=self.density, dtype=np.uint64)
+
+    def _feature_ids(self, tokens: List[str]) -> List[int]:
+        cache = self._cache
+        out = []
+        for tok in tokens:
+            h = cache.get(tok)
+            if h is None:
+                if len(cache) >= _MAX_TOKEN_CACHE:
+                    cache.clear()
+                h = cache[tok] = zlib.crc32(tok.encode("utf-8")) & self._mask
+            out.append(h)
+        return out
+
+    def term_matrix(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        返回等长的 (doc, feat, tf)：每个 (文档序号, 特征) 一项，tf = 1 + log(词频)，按 (doc, feat) 排序。
+        英文词查缓存 / crc32；中文把整批文本的汉字串拼起来转成码点数组，单字和二字组合都用整数哈希批量计算。
+        """
+        n = len(texts)
+        words: List[int] = []
+        word_lens: List[int] = []
+        cjk_parts: List[str] = []
+        cjk_lens: List[int] = []
+        for text in texts:
+            low = (text or "").lower()
+            ids = self._feature_ids(_WORD_RE.findall(low))
+            words.extend(ids)
+            word_lens.append(len(ids))
+            # "\0" 分隔各个汉字串（以及各个文档），二字组合不跨越分隔符
+            cjk = "\0".join(_CJK_RE.findall(low)) + "\0"
+            cjk_parts.append(cjk)
+            cjk_lens.append(len(cjk))
+
+        mask = np.uint64(self._mask)
+        cp = np.frombuffer("".join(cjk_parts).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        cjk_doc = np.repeat(np.arange(n, dtype=np.int64), cjk_lens)
+        valid = cp != 0
+        pair = valid[:-1] & valid[1:]
+        feat = np.concatenate([
+            np.asarray(words, dtype=np.int64),
+            (_mix(cp[valid], 1) & mask).astype(np.int64),
+            (_mix((cp[:-1][pair] << np.uint64(21)) | cp[1:][pair], 2) & mask).astype(np.int64),
+        ])
+        if not len(feat):
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=np.float32)
+        doc = np.concatenate([
+            np.repeat(np.arange(n, dtype=np.int64), word_lens),
+            cjk_doc[valid],
+            cjk_doc[:-1][pair],
+        ])
+        keys, counts = np.unique((doc << 32) | feat, return_counts=True)
+        tf = (1.0 + np.log(counts)).astype(np.float32)
+        return keys >> 32, keys & 0xFFFFFFFF, tf
+
+    def project(self, doc: np.ndarray, feat: np.ndarray, weights: np.ndarray, n_docs: int) -> np.ndarray:
+        """
+        稀疏随机投影到 (n_docs, dim) 的 float32 矩阵，每行 L2 归一化（全零行保持为零）。
+        """
+        if self.dim <= 0:
+            raise ValueError("dim = 0 时不做投影")
+        dim = self.dim
+        out = np.zeros(n_docs * dim, dtype=np.float64)
+        f = feat.astype(np.uint64)
+        base = doc * dim
+        for j in range(self.density):
+            h = f * self._mult[j] + self._add[j]
+            h ^= h >> np.uint64(29)
+            idx = (h % np.uint64(dim)).astype(np.int64)
+            signed = np.where((h >> np.uint64(63)) == 0, weights, -weights)
+            out += np.bincount(base + idx, weights=signed, minlength=n_docs * dim)
+        mat = out.reshape(n_docs, dim).astype(np.float32)
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        np.divide(mat, norms, out=mat, where=norms > 0)
+        return mat
+
+    def encode(self, texts: Sequence[str], idf: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        批量编码成稠密向量（需要 dim > 0）；idf 为 None 时只用 tf。
+        """
+        doc, feat, tf = self.term_matrix(texts)
+        weights = tf if idf is None else tf * idf[feat]
+        return self.project(doc, feat, weights, len(texts))
+
+
+class LocalTfidfIndex:
+    """
+    文档的 (doc, feat, tf) 三元组 + 文档频率 df。加入新文档后 idf 会变，稠密矩阵 / 文档范数在下一次检索时
+    重新计算（纯向量化运算，十万级 chunk 约一秒）。线程安全。
+    """
+
+    def __init__(self, embedder: HashingTfidfEmbedder):
+        self.embedder = embedder
+        self.n_docs = 0
+        self._df = np.zeros(embedder.n_features, dtype=np.int32)
+        self._parts: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._lock = threading.Lock()
+        self._built_for = -1
+        self._idf: Optional[np.ndarray] = None
+        self._matrix: Optional[np.ndarray] = None                  # dim > 0：(n_docs, dim)
+        self._sparse: Optional[Tuple[np.ndarray, ...]] = None       # dim = 0：按特征排序的倒排 (feat, doc, 归一化权重)
+        # 分区：名字 -> 升序文档序号；_views 缓存每个分区的子矩阵 / 子倒排表（重建索引时清空）
+        self._partitions: Dict[str, np.ndarray] = {}
+        self._views: Dict[str, Tuple[Optional[np.ndarray], Optional[Tuple[np.ndarray, ...]]]] = {}
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def add(self, texts: Sequence[str]) -> None:
+        doc, feat, tf = self.embedder.term_matrix(texts)
+        with self._lock:
+            self._df += np.bincount(feat, minlength=self.embedder.n_features).astype(np.int32)
+            self._parts.append((doc + self.n_docs, feat, tf))
+            self.n_docs += len(texts)
+
+    def _build(self) -> None:
+        # 调用方持有 _lock
+        if self._built_for == self.n_docs:
+            return
+        idf = (np.log((1.0 + self.n_docs) / (1.0 + self._df)) + 1.0).astype(np.float32)
+        if len(self._parts) > 1:
+            self._parts = [tuple(np.concatenate(cols) for cols in zip(*self._parts))]
+        if self._parts:
+            doc, feat, tf = self._parts[0]
+        else:
+            doc = feat = np.zeros(0, dtype=np.int64)
+            tf = np.zeros(0, dtype=np.float32)
+        weights = tf * idf[feat]
+        if self.embedder.dim > 0:
+            self._matrix = self.embedder.project(doc, feat, weights, self.n_docs)
+        else:
+            norms = np.sqrt(np.bincount(doc, weights=weights.astype(np.float64) ** 2, minlength=self.n_docs))
+            norms[norms == 0] = 1.0
+            order = np.argsort(feat, kind="stable")
+            self._sparse = (feat[order], doc[order], (weights / norms[doc]).astype(np.float32)[order])
+        self._idf = idf
+        self._views.clear()
+        self._built_for = self.n_docs
+
+    def set_partition(self, name: str, rows: Sequence[int]) -> None:
+        """
+        登记（或更新）一个文档子集。之后 scores_for / search_vector 传 partition=name 时只对这些文档打分。
+        """
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        with self._lock:
+            self._partitions[name] = rows
+            self._views.pop(name, None)
+
+    def _view(self, name: str) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[Tuple[np.ndarray, ...]]]:
+        # 调用方持有 _lock 且已 _build()
+        rows = self._partitions[name]
+        rows = rows[rows < self.n_docs]
+        view = self._views.get(name)
+        if view is None:
+            if self._matrix is not None:
+                view = (self._matrix[rows], None)
+            else:
+                p_feat, p_doc, p_w = self._sparse
+                keep = np.isin(p_doc, rows)
+                # 过滤后仍按特征有序，文档序号换成分区内的位置
+                view = (None, (p_feat[keep], np.searchsorted(rows, p_doc[keep]), p_w[keep]))
+            self._views[name] = view
+        return (rows,) + view
+
+    def query_vector(self, query: str) -> Any:
+        """
+        按当前 idf 编码 query：投影模式下是 (dim,) 的稠密向量，不投影时是 (特征, 归一化权重)。
+        结果只对当前索引版本（文档数）有效，可以缓存起来重复用于 scores_for。
+        """
+        with self._lock:
+            self._build()
+            idf = self._idf
+        doc, feat, tf = self.embedder.term_matrix([query])
+        weights = tf * idf[feat]
+        if self.embedder.dim > 0:
+            return self.embedder.project(doc, feat, weights, 1)[0]
+        q_norm = math.sqrt(float(np.dot(weights, weights))) or 1.0
+        return feat, weights / q_norm
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        query 与每个文档的余弦相似度，shape (n_docs,)。
+        """
+        return self.scores_for(self.query_vector(query))
+
+    def scores_for(self, qvec: Any, partition: Optional[str] = None) -> np.ndarray:
+        """
+        partition 为 None 时返回所有文档的得分；否则只对该分区打分，返回值与 partition_rows(partition) 一一对应。
+        """
+        return self._scores(qvec, partition)[1]
+
+    def _scores(self, qvec: Any, partition: Optional[str]) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        with self._lock:
+            self._build()
+            if partition is None:
+                rows, matrix, sparse, n_docs = None, self._matrix, self._sparse, self.n_docs
+            else:
+                rows, matrix, sparse = self._view(partition)
+                n_docs = len(rows)
+        return rows, self._score_view(qvec, matrix, sparse, n_docs)
+
+    @staticmethod
+    def _score_view(
+        qvec: Any, matrix: Optional[np.ndarray], sparse: Optional[Tuple[np.ndarray, ...]], n_docs: int
+    ) -> np.ndarray:
+        if n_docs == 0:
+            return np.zeros(0, dtype=np.float32)
+        if matrix is not None:
+            return matrix @ qvec
+        feat, weights = qvec
+        # 查询通常只有几十个特征：逐个取倒排表里的区间
+        p_feat, p_doc, p_w = sparse
+        starts = np.searchsorted(p_feat, feat, side="left")
+        ends = np.searchsorted(p_feat, feat, side="right")
+        docs, contrib = [], []
+        for s, e, w in zip(starts, ends, weights):
+            if e > s:
+                docs.append(p_doc[s:e])
+                contrib.append(p_w[s:e] * w)
+        if not docs:
+            return np.zeros(n_docs, dtype=np.float32)
+        return np.bincount(
+            np.concatenate(docs), weights=np.concatenate(contrib), minlength=n_docs
+        ).astype(np.float32)
+
+    def partition_rows(self, name: str) -> np.ndarray:
+        with self._lock:
+            rows = self._partitions[name]
+            return rows[rows < self.n_docs]
+
+    def search(self, query: str, k: int = 4, partition: Optional[str] = None) -> List[Tuple[int, float]]:
+        return self.search_vector(self.query_vector(query), k, partition)
+
+    def search_vector(self, qvec: Any, k: int = 4, partition: Optional[str] = None) -> List[Tuple[int, float]]:
+        """
+        返回 [(文档序号, 相似度)]，文档序号总是全局序号（分区检索时也一样）。
+        """
+        rows, scores = self._scores(qvec, partition)
+        if not len(scores):
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        if rows is not None:
+            return [(int(rows[i]), float(scores[i])) for i in top]
+        return [(int(i), float(scores[i])) for i in top]
@@ -5,11 +5,24 @@ from typing import Any, Dict
 import os
 import json
 
+from experiment_store import ExperimentStore, open_store
+
 # ====== 日志路径配置（根据实际情况修改） ======
-# 历史实验日志（每行一个 JSON）
+# 历史实验日志（每行一个 JSON，闭环每轮自动追加）
 EXPERIMENT_LOG_PATH = r"D:\oran_logs\experiments.jsonl"
 # 元认知候选策略输出
 CANDIDATE_FILE_PATH = r"D:\oran_logs\candidate_policies.jsonl"
+# 两个日志的 fsync 策略："always" / "batch" / "never"（见 experiment_store.py）
+EXPERIMENT_STORE_FSYNC = "batch"
+
+
+def get_experiment_store() -> ExperimentStore:
+    return open_store(EXPERIMENT_LOG_PATH, id_field="exp_id", fsync=EXPERIMENT_STORE_FSYNC)
+
+
+def get_candidate_store() -> ExperimentStore:
+    # 候选策略没有自然的 id，用内容 hash 作 id（相同候选只存一次）
+    return open_store(CANDIDATE_FILE_PATH, id_field="candidate_id", fsync=EXPERIMENT_STORE_FSYNC)
 
 
 # ===== 基础工具：加法 & 读文本文件 =====
@@ -45,6 +58,7 @@ def _format_experiment_record(rec: Dict[str, Any]) -> str:
     nonrt = pol.get("nonRT_params", {})
     nearrt = pol.get("nearRT_params", {})
     beam = pol.get("beam_params", {})
+    policy_ids = rec.get("policy_ids")
 
     kpi = rec.get("kpi", {})
     sum_tput = kpi.get("sum_tput_Mbps", "?")
@@ -56,6 +70,24 @@ def _format_experiment_record(rec: Dict[str, Any]) -> str:
     lines.append(f"[实验 {exp_id}]")
     lines.append(f"- 意图: {intent}")
 
+    if policy_ids and not pol:
+        # 闭环自动记录的实验只有策略 id，没有展开的参数
+        lines.append(
+            "- 策略组合: "
+            f"non-RT={policy_ids.get('nonRT', '?')}, "
+            f"near-RT={policy_ids.get('nearRT', '?')}, "
+            f"Beam={policy_ids.get('beam', '?')}"
+        )
+        decision = rec.get("decision") or {}
+        if decision:
+            lines.append(f"- 下一轮选择: {json.dumps(decision, ensure_ascii=False)}")
+        lines.append("- 结果:")
+        lines.append(f"  - 总下行吞吐 ≈ {sum_tput} Mbps")
+        lines.append(f"  - 5% UE 吞吐 ≈ {ue_5p} Mbps")
+        lines.append(f"  - 估算能耗 ≈ {energy} W")
+        lines.append(f"  - 小小区休眠比例 ≈ {sleep_ratio}")
+        return "\n".join(lines)
+
     lines.append("- 关键策略:")
     lines.append(
         "  - non-RT: "
@@ -88,23 +120,15 @@ def _format_experiment_record(rec: Dict[str, Any]) -> str:
 
 def tool_get_policy_history(intent_pattern: str, max_records: int = 20) -> str:
     """
-    根据意图关键字，从 experiments.jsonl 中筛选历史实验，
+    根据意图关键字，从 experiments.jsonl 中筛选历史实验（最新的在前），
     并返回一个自然语言摘要，供元认知 agent 阅读。
     """
-    matches = []
-    try:
-        with open(EXPERIMENT_LOG_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                rec = json.loads(line)
-                if intent_pattern in rec.get("intent_desc", ""):
-                    matches.append(rec)
-                    if len(matches) >= max_records:
-                        break
-    except FileNotFoundError:
+    if not os.path.isfile(EXPERIMENT_LOG_PATH):
         return f"[ERROR] experiment log file not found: {EXPERIMENT_LOG_PATH}"
+    try:
+        matches = get_experiment_store().recent(
+            max_records, where=lambda rec: intent_pattern in rec.get("intent_desc", "")
+        )
     except Exception as e:
         return f"[ERROR] reading experiment log failed: {e}"
 
@@ -119,19 +143,20 @@ def tool_save_policy_candidate(intent_id: str, proposal_json: str) -> str:
     """
     把元认知 agent 生成的策略候选追加写入一个文件。
     proposal_json 建议是一个 JSON 字符串（包含高层建议）。
+    内容完全相同的候选只保存一次。
     """
     record = {
         "intent_id": intent_id,
         "proposal_json": proposal_json,
     }
     try:
-        os.makedirs(os.path.dirname(CANDIDATE_FILE_PATH), exist_ok=True)
-        with open(CANDIDATE_FILE_PATH, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        candidate_id = get_candidate_store().append(record)
     except Exception as e:
         return f"[ERROR] failed to save candidate policy: {e}"
 
-    return f"候选策略已保存到 {CANDIDATE_FILE_PATH}, intent_id={intent_id}"
+    if candidate_id is None:
+        return f"相同的候选策略已存在于 {CANDIDATE_FILE_PATH}, intent_id={intent_id}"
+    return f"候选策略已保存到 {CANDIDATE_FILE_PATH}, intent_id={intent_id}, candidate_id={candidate_id}"
 
 
 # ===== 工具注册表 =====
@@ -0,0 +1,139 @@
+# loop_checkpoint.py
+# 闭环实验的断点续跑：每个阶段（translate_intent / simulate / summarize / select_policy）完成后，
+# 把结果和继续运行所需的会话 history 原子地写进一个小 JSON 文件。
+# 进程因为 Ollama 超时、Matlab 崩溃、JSON 解析失败等原因退出后，用 --resume 从第一个未完成的阶段继续，
+# 已经完成的 LLM 调用和仿真不会重跑。
+#
+# 文件结构（一个意图一个文件）：
+# {
+#   "version": 1, "intent_id": ..., "operator_text": ..., "intent_json": {...},
+#   "rounds": {"0": {"simulate": {...}, "summarize": "...", "select_policy": {...}}, ...},
+#   "loop": {"completed_rounds": 2, "last_policy_ids": {...}, "next_policy_ids": {...}, "rounds_trace": [...]},
+#   "sessions": {"intent": {"history": [...]}, "policy": {"history": [...], "round_log": {...}}, ...},
+#   "finished": false, "result": null
+# }
+
+from typing import Any, Dict, List, Optional
+import json
+import os
+import threading
+
+from ollama_client import Message
+
+
+CHECKPOINT_VERSION = 1
+
+
+def write_json_atomic(path: str, obj: Any) -> None:
+    """
+    先写临时文件并 fsync，再 os.replace 覆盖：进程在任何时刻被杀掉，文件要么是旧版本，要么是新版本。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _dump_history(history: List[Message]) -> List[Dict[str, str]]:
+    return [{"role": m.role, "content": m.content} for m in history]
+
+
+def _load_history(items: List[Dict[str, str]]) -> List[Message]:
+    return [Message(role=it["role"], content=it["content"]) for it in items]
+
+
+class LoopCheckpoint:
+    """
+    线程安全：同一轮里的多个阶段在 TaskGraph 中并发完成，各自调用 put_stage。
+    resume=False 时忽略磁盘上已有的检查点（从头开始并覆盖）。
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state: Dict[str, Any] = {}
+        if resume and os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("version") != CHECKPOINT_VERSION:
+                raise ValueError(f"检查点版本不兼容：{path}")
+            self.state = state
+        self.resumed = bool(self.state)
+        self.state.setdefault("version", CHECKPOINT_VERSION)
+        self.state.setdefault("rounds", {})
+        self.state.setdefault("sessions", {})
+        self.state.setdefault("loop", {})
+        self.state.setdefault("finished", False)
+
+    # ==== 通用字段 ====
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            return self.state.get(key, default)
+
+    def set(self, **fields: Any) -> None:
+        with self._lock:
+            self.state.update(fields)
+            write_json_atomic(self.path, self.state)
+
+    # ==== 阶段结果 ====
+
+    def has_stage(self, round_idx: int, stage: str) -> bool:
+        with self._lock:
+            return stage in self.state["rounds"].get(str(round_idx), {})
+
+    def get_stage(self, round_idx: int, stage: str) -> Any:
+        with self._lock:
+            return self.state["rounds"][str(round_idx)][stage]
+
+    def put_stage(
+        self,
+        round_idx: int,
+        stage: str,
+        value: Any,
+        sessions: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        记录一个阶段的结果；sessions 给出该阶段改动过的会话，一并快照（只在阶段成功后快照，
+        避免把失败调用留下的半截 user 消息写进检查点）。
+        """
+        with self._lock:
+            self.state["rounds"].setdefault(str(round_idx), {})[stage] = value
+            for name, sess in (sessions or {}).items():
+                self.state["sessions"][name] = self._dump_session(sess)
+            write_json_atomic(self.path, self.state)
+
+    # ==== 会话 ====
+
+    @staticmethod
+    def _dump_session(sess) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"history": _dump_history(sess.history)}
+        round_log = getattr(sess, "round_log", None)
+        if round_log is not None:
+            out["round_log"] = {
+                "entries": list(round_log.entries),
+                "prev_kpi": round_log.prev_kpi,
+                "rounds": round_log.rounds,
+            }
+        memory = getattr(sess, "memory", None)
+        if memory is not None and memory.summary:
+            out["memory_summary"] = memory.summary
+        return out
+
+    def restore_session(self, name: str, sess) -> bool:
+        with self._lock:
+            snap = self.state["sessions"].get(name)
+        if not snap:
+            return False
+        sess.history[:] = _load_history(snap["history"])
+        if "round_log" in snap and getattr(sess, "round_log", None) is not None:
+            sess.round_log.entries.clear()
+            sess.round_log.entries.extend(snap["round_log"]["entries"])
+            sess.round_log.prev_kpi = snap["round_log"]["prev_kpi"]
+            sess.round_log.rounds = snap["round_log"]["rounds"]
+        if "memory_summary" in snap and getattr(sess, "memory", None) is not None:
+            sess.memory.restore(snap["memory_summary"], sess.history)
+        return True
@@ -9,6 +9,7 @@ from intent_agent import create_intent_agent, translate_intent
 from policy_agent import create_policy_agent, select_policy, DEFAULT_POLICY_LIBRARY
 from meta_agent import create_meta_agent, meta_optimize_intent
 from sim_summary_agent import create_sim_summary_agent, summarize_simulation
+from kpi_gap import ConvergenceTracker, compute_kpi_gaps
 
 
 # ==== 配置 ====
@@ -112,16 +113,13 @@ def extract_kpis_from_sim(sim_result: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def is_gap_small_enough(gap_summary: Dict[str, Any], intent_json: Dict[str, Any]) -> bool:
+def is_gap_small_enough(sim_result: Dict[str, Any], intent_json: Dict[str, Any]) -> bool:
     """
-    一个非常粗糙的判断函数：
-    - 如果 gap_summary 里有 ue_tput_5p_gap 且 >= -0.1（说明基本达标），就认为可以结束。
-    实际工程中你可以更细致地解析 gap_summary。
+    用数值 gap 判断：intent_json 里所有可量化的 KPI 目标都达标，就认为可以结束。
+    （没有任何数值目标时返回 False，交给轮数上限结束。）
     """
-    gap = gap_summary.get("ue_tput_5p_gap")
-    if isinstance(gap, (int, float)) and gap >= -0.1:
-        return True
-    return False
+    gaps = [g for g in compute_kpi_gaps(sim_result, intent_json) if not g.soft]
+    return bool(gaps) and all(g.met for g in gaps)
 
 
 def main():
@@ -159,6 +157,7 @@ def main():
 
     # 6) 多轮控制循环
     max_rounds = 5
+    tracker = ConvergenceTracker(intent_json)
     for round_idx in range(max_rounds):
         print(f"\n================ Round {round_idx} ================")
         print("[Main] 当前策略组合：", last_policy_ids)
@@ -167,6 +166,18 @@ def main():
         sim_result = run_simulation_with_policy(round_idx, intent_json, last_policy_ids)
         current_kpis = extract_kpis_from_sim(sim_result)
         print("[Main] 当前KPI：", current_kpis)
+        tracker.update(round_idx, sim_result)
+        print("[Main] KPI gap 表：")
+        print(tracker.gap_table())
+
+        # 6.1.1 如果 gap 已经足够小，或者连续几轮没有进展，提前停止迭代
+        if is_gap_small_enough(sim_result, intent_json):
+            print("\n[Main] 意图指标已基本达标，停止迭代。")
+            break
+        stop, reason = tracker.should_stop()
+        if stop:
+            print(f"\n[Main] KPI gap 连续多轮没有改善（{reason}），停止迭代。")
+            break
 
         # 6.2 仿真总结（可选，每轮或每几轮调用一次）
         report_text = summarize_simulation(sim_agent, sim_result)
@@ -177,9 +188,10 @@ def main():
         policy_decision = select_policy(
             policy_agent,
             intent_json=intent_json,
-            current_kpis=current_kpis,
+            summary_text=report_text,
             last_policy_ids=last_policy_ids,
             policy_library=DEFAULT_POLICY_LIBRARY,
+            gap_table=tracker.gap_table(),
         )
         print("[Main] Policy decision:", policy_decision)
 
@@ -198,12 +210,6 @@ def main():
             print(meta_reply)
             # 通常这里不会立刻生效，而是你读完建议后，拿它去问 GPT-5.1 改代码/策略库
 
-        # 6.5 如果 gap 已经足够小，可以提前停止迭代
-        gap_summary = policy_decision.get("gap_summary", {})
-        if is_gap_small_enough(gap_summary, intent_json):
-            print("\n[Main] 意图指标已基本达标，停止迭代。")
-            break
-
 
 if __name__ == "__main__":
     main()
@@ -3,17 +3,29 @@
 # 当前版本：不启用 meta agent，Policy 只看 intent_json + summary_text。
 # 通过调用 matlab.exe -batch，而不是 matlab.engine。
 
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Union
+import argparse
 import os
 import json
 import subprocess
+import time
 
-from ollama_client import OllamaChatModel
-from vectorstore import SimpleVectorStore
+from ollama_client import OllamaChatModel, CHAT_SINGLE_FLIGHT
+from model_router import ModelRouter
+from backend_pool import BackendPool
+from vectorstore import SimpleVectorStore, EMBED_SINGLE_FLIGHT
 from kb_loader import load_knowledge_from_folder
 from intent_agent import create_intent_agent, translate_intent
 from policy_agent import create_policy_agent, select_policy, DEFAULT_POLICY_LIBRARY
 from sim_summary_agent import create_sim_summary_agent, summarize_simulation
+from sim_cache import SimResultCache, compute_sim_code_version, make_cache_key
+from sim_worker_pool import SimWorkerPool
+from speculative_sim import SpeculativeSimulator, propose_candidates
+from task_graph import TaskGraph
+from kpi_gap import ConvergenceTracker
+from structured_output import STREAM_SAVINGS
+from loop_checkpoint import LoopCheckpoint
+from local_tools import get_experiment_store
 
 
 # ==== 配置 ====
@@ -21,9 +33,37 @@ from sim_summary_agent import create_sim_summary_agent, summarize_simulation
 # LLM / 向量库
 OLLAMA_BASE_URL = "http://127.0.0.1:11434"
 OLLAMA_MODEL_NAME = "gpt-oss:20b"
-EMBED_MODEL_NAME = "nomic-embed-text"
+# "local-tfidf"：本地 CPU 向量化，检索不需要 embedding 服务；改成 "nomic-embed-text" 等则走 Ollama /api/embed
+EMBED_MODEL_NAME = "local-tfidf"
 KNOWLEDGE_FOLDER = r"D:\agent_kb"  # 你的 RAG 知识库目录（可按需修改）
 
+# 多个 Ollama 实例（不同机器）时填这里：请求分给在飞请求最少的实例，同一会话尽量落在同一实例（复用 KV cache），
+# 连续失败的实例被摘除、探测恢复后重新加入；为空时只用 OLLAMA_BASE_URL
+OLLAMA_BACKEND_URLS: List[str] = []
+
+# 按 agent 路由模型：每个 agent 各自的槽位数 / options，sim_summary 槽位占满时回退到 policy 路由；
+# MODEL_ROUTING_ENABLED = False 时所有 agent 共用一个 OLLAMA_MODEL_NAME 客户端。
+# 默认所有路由都用 OLLAMA_MODEL_NAME；要把仿真报告这类不需要 20B 的任务交给小模型，
+# 先 ollama pull 小模型，再把 SMALL_MODEL_NAME 改成它（例如 "qwen2.5:3b"）
+MODEL_ROUTING_ENABLED = True
+SMALL_MODEL_NAME = OLLAMA_MODEL_NAME
+MODEL_ROUTES = {
+    "default": {"model": OLLAMA_MODEL_NAME, "slots": 2},
+    "intent": {"model": OLLAMA_MODEL_NAME, "slots": 2, "options": {"temperature": 0.0, "num_ctx": 8192}},
+    "policy": {"model": OLLAMA_MODEL_NAME, "slots": 2, "options": {"temperature": 0.0, "num_ctx": 8192}},
+    "sim_summary": {
+        "model": SMALL_MODEL_NAME,
+        "slots": 4,
+        "options": {"temperature": 0.2, "num_ctx": 8192, "num_predict": 800},
+        "fallback": "policy",
+    },
+}
+
+# 对冲请求（控制尾延迟）：首 token 超过最近 p95 仍没出来时向另一个实例（单实例时是另一个槽位）再发一份，
+# 先出首 token 的胜出；反复卡死 / 失败的实例会被熔断。开启后约多 5%~10% 的请求量，默认关闭
+LLM_HEDGING_ENABLED = False
+LLM_HEDGE_CONFIG = {"percentile": 95, "budget_ratio": 0.1, "min_samples": 20, "default_delay_s": 5.0}
+
 # Matlab 相关
 # TODO: 把下面这个路径改成你自己电脑上的 matlab.exe
 MATLAB_EXE_PATH = r"D:\matlab\bin\matlab.exe"
@@ -31,30 +71,86 @@ MATLAB_EXE_PATH = r"D:\matlab\bin\matlab.exe"
 MATLAB_WORK_DIR = r"D:\研究生\O-RAN Simulation2\O-RAN Simulation"  # 你的 Matlab 工程目录
 MATLAB_RESULT_DIR = r"D:/oran_logs/sim_results"                     # oranSim_run_two_phase_10s 输出 JSON 的目录
 
+# 仿真结果缓存：控制输入 + 仿真代码版本 + seed 相同的仿真只跑一次
+SIM_CACHE_ENABLED = True
+SIM_CACHE_DIR = r"D:/oran_logs/sim_cache"
+SIM_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 常驻仿真 worker 池：> 0 时启动这么多个常驻 Matlab worker（启动开销只付一次），
+# = 0 时沿用每轮冷启动 matlab -batch 的 file mode
+SIM_POOL_WORKERS = 0
+SIM_POOL_DIR = r"D:/oran_logs/sim_pool"
+
+# 流水线模式：summary / policy agent 思考的同时，投机预仿真下一轮最可能的策略组合，
+# 每轮耗时趋近 max(仿真, LLM) 而不是两者之和（需要 SIM_POOL_WORKERS > 0）
+PIPELINE_MODE = False
+SPECULATIVE_CANDIDATES = 3
+SWEEP_CACHE_PATH = r"D:/oran_logs/sweep_results.jsonl"  # 可选：sweep_runner 的 KPI 表，用于候选排序
+
 # 控制循环
 MAX_ROUNDS = 3  # 为了速度先跑 2~3 轮就够看效果了
 
+# 仿真报告生成方式："template"（模板渲染，不调 LLM）/ "hybrid"（只让 LLM 诊断问题 UE）/ "llm"
+SUMMARY_MODE = "template"
+
+# 数值 gap 收敛判断：目标全部达标，或连续 CONVERGENCE_PATIENCE 轮没有进展时提前结束
+EARLY_STOP = True
+CONVERGENCE_PATIENCE = 2
+
+# 结构化输出（intent / policy JSON）走流式请求：JSON 对象一闭合就中止生成
+STRUCTURED_STREAM = True
+
+# Policy agent 的 prompt 编码："compact"（策略库放 system 前缀、每轮只发 KPI 增量 + 决策记录，
+# prompt 长度不随轮数增长）/ "full"（每轮完整发送策略库和仿真报告，history 逐轮累积）
+POLICY_PROMPT_MODE = "compact"
+
+# 每次 LLM 调用的耗时分解（load / prefill / decode）和 token 数，结束时导出为 JSONL
+LLM_METRICS_PATH = r"D:/oran_logs/llm_calls.jsonl"
+
+# 断点续跑：每个阶段完成后把结果和会话 history 写进 CHECKPOINT_DIR/<intent_id>.json，
+# 进程退出后用 --resume 从第一个未完成的阶段继续
+CHECKPOINT_ENABLED = True
+CHECKPOINT_DIR = r"D:/oran_logs/checkpoints"
+
+# 每轮结束后把 (意图, 策略组合, KPI, 决策) 追加到 local_tools.EXPERIMENT_LOG_PATH，
+# 供 meta agent 的 get_policy_history 工具查询
+EXPERIMENT_LOG_ENABLED = True
+
 
 # ==== 工具函数 ====
 
+_sim_cache: Optional[SimResultCache] = None
+_backend_pool: Optional[BackendPool] = None
 
-def build_vector_store() -> SimpleVectorStore:
+
+def get_sim_cache() -> SimResultCache:
+    global _sim_cache
+    if _sim_cache is None:
+        _sim_cache = SimResultCache(SIM_CACHE_DIR, max_bytes=SIM_CACHE_MAX_BYTES)
+    return _sim_cache
+
+
+def get_backend_pool() -> Optional[BackendPool]:
+    """
+    配置了 OLLAMA_BACKEND_URLS 时返回（并启动健康探测）进程内共享的后端池，否则返回 None。
     """
-    构建一个“只附加文档、不做检索”的 RAG 向量库。
+    global _backend_pool
+    if _backend_pool is None and OLLAMA_BACKEND_URLS:
+        _backend_pool = BackendPool(OLLAMA_BACKEND_URLS).start()
+    return _backend_pool
 
-    行为：
-    - 从 KNOWLEDGE_FOLDER 加载所有 txt（被切 chunk）；
-    - 直接保存到 vs.docs；
-    - 不调用 add_documents()，因此不会对文档做 embedding；
-    - similarity_search() 直接返回这些 docs。
 
-    结果：
-    - 每个 RAGChatSession 在 ask() 时，仍然会把这些文档插入到 prompt 里；
-    - 完全不会访问 /api/embed，不会再有 500。
+def build_vector_store() -> SimpleVectorStore:
+    """
+    构建 RAG 向量库：从 KNOWLEDGE_FOLDER 加载所有 txt（被切 chunk）并建索引。
+
+    EMBED_MODEL_NAME 为 "local-tfidf" 时在本地 CPU 上向量化，检索完全离线，不会访问 /api/embed；
+    每个 RAGChatSession 在 ask() 时插入与问题最相关的 k 个 chunk。
     """
     vs = SimpleVectorStore(
         embed_model=EMBED_MODEL_NAME,
         base_url=OLLAMA_BASE_URL,
+        backends=get_backend_pool(),
     )
     docs = load_knowledge_from_folder(KNOWLEDGE_FOLDER)
     if not docs:
@@ -62,10 +158,10 @@ def build_vector_store() -> SimpleVectorStore:
         vs.docs = []
         vs.embeddings = []
     else:
-        print(f"[RAG] 知识库已加载 {len(docs)} 个 chunks（不建向量索引，不做检索）")
-        # 直接把文档塞进去，不调用 add_documents（add_documents 会触发 embedding）
-        vs.docs = docs
-        vs.embeddings = []
+        t0 = time.time()
+        vs.add_documents(docs)
+        print(f"[RAG] 知识库已加载 {len(docs)} 个 chunks，索引耗时 {time.time() - t0:.2f}s（{EMBED_MODEL_NAME}）")
+        print(f"[RAG] 文档标签：{vs.tag_counts()}")
 
     return vs
 
@@ -76,6 +172,8 @@ def run_matlab_two_phase_filemode(
     intent_desc: str,
     prev_policies: Dict[str, str],
     curr_policies: Dict[str, str],
+    seed: Optional[int] = None,
+    use_cache: bool = True,
 ) -> Dict[str, Any]:
     """
     不使用 matlab.engine，改成：
@@ -84,6 +182,13 @@ def run_matlab_two_phase_filemode(
        执行：cd(MATLAB_WORK_DIR); oranSim_driver_from_json(control_json_path)
     3) Matlab 在 MATLAB_RESULT_DIR 下生成 res_round_<idx>.json；
     4) Python 读回该 JSON 并返回 sim_result。
+
+    seed 不为 None 时写入控制 JSON，Matlab 侧用它代替 rng("shuffle")，结果可复现。
+
+    结果缓存（SIM_CACHE_ENABLED 且 use_cache=True 时）：
+    - key = 控制 JSON（去掉 round_idx / result_dir）+ Matlab 代码版本 + seed 的 hash；
+    - 命中时完全不启动 Matlab，只把 exp_id 改成本轮的编号；
+    - 未命中时正常仿真，并把结果存进缓存。
     """
 
     # 目录准备
@@ -98,6 +203,18 @@ def run_matlab_two_phase_filemode(
         "prev_policy": prev_policies,
         "curr_policy": curr_policies,
     }
+    if seed is not None:
+        control["seed"] = float(seed)
+
+    cache_key = None
+    if SIM_CACHE_ENABLED and use_cache:
+        cache_key = make_cache_key(control, compute_sim_code_version(MATLAB_WORK_DIR))
+        cached = get_sim_cache().get(cache_key)
+        if cached is not None:
+            print(f"[Sim] 仿真缓存命中 key={cache_key[:12]}，跳过 Matlab")
+            cached["exp_id"] = f"exp_round_{round_idx}"
+            return cached
+
     control_path = os.path.join(MATLAB_RESULT_DIR, f"control_round_{round_idx}.json")
     with open(control_path, "w", encoding="utf-8") as f:
         json.dump(control, f, ensure_ascii=False, indent=2)
@@ -159,35 +276,190 @@ def run_matlab_two_phase_filemode(
     with open(res_path, "r", encoding="utf-8") as f:
         sim_result = json.load(f)
 
+    if cache_key is not None:
+        get_sim_cache().put(cache_key, sim_result)
+
     return sim_result
 
 
+def build_sim_pool() -> Optional[SimWorkerPool]:
+    """
+    SIM_POOL_WORKERS > 0 时创建并启动常驻 Matlab worker 池，否则返回 None。
+    """
+    if SIM_POOL_WORKERS <= 0:
+        return None
+    pool = SimWorkerPool(
+        num_workers=SIM_POOL_WORKERS,
+        backend="matlab",
+        pool_dir=SIM_POOL_DIR,
+        matlab_exe_path=MATLAB_EXE_PATH,
+        matlab_work_dir=MATLAB_WORK_DIR,
+        cache=get_sim_cache() if SIM_CACHE_ENABLED else None,
+    )
+    return pool.start()
+
+
+def build_model_router() -> ModelRouter:
+    routes = MODEL_ROUTES
+    if LLM_HEDGING_ENABLED:
+        routes = {name: {"hedge": LLM_HEDGE_CONFIG, **cfg} for name, cfg in MODEL_ROUTES.items()}
+    return ModelRouter(routes, base_url=OLLAMA_BASE_URL, backends=get_backend_pool())
+
+
+def _agent_model(model: Union[OllamaChatModel, ModelRouter], agent: str):
+    return model.for_agent(agent) if isinstance(model, ModelRouter) else model
+
+
+def open_checkpoint(intent_id: str, resume: bool = False) -> Optional[LoopCheckpoint]:
+    """
+    CHECKPOINT_ENABLED 时返回该意图的检查点；resume=False 时从头开始并覆盖旧检查点。
+    """
+    if not CHECKPOINT_ENABLED:
+        return None
+    ckpt = LoopCheckpoint(os.path.join(CHECKPOINT_DIR, f"{intent_id}.json"), resume=resume)
+    if resume and not ckpt.resumed:
+        print(f"[Checkpoint] 没有找到 {intent_id} 的检查点，从头开始")
+    return ckpt
+
+
+def log_experiment_round(
+    intent_id: str,
+    round_idx: int,
+    operator_text: str,
+    prev_policies: Dict[str, str],
+    curr_policies: Dict[str, str],
+    sim_result: Dict[str, Any],
+    policy_decision: Optional[Dict[str, Any]],
+) -> Optional[str]:
+    """
+    把一轮闭环写成一条实验记录（同一 intent_id + round 重跑时以最新的为准，内容相同则去重）。
+    写失败只打印，不影响闭环。
+    """
+    rec = {
+        "exp_id": f"{intent_id}_round_{round_idx}",
+        "intent_id": intent_id,
+        "round_idx": round_idx,
+        "intent_desc": operator_text,
+        "prev_policy_ids": prev_policies,
+        "policy_ids": curr_policies,
+        "kpi": sim_result.get("kpi", {}),
+        "decision": (policy_decision or {}).get("selected_policies") or {},
+        "ts": time.time(),
+    }
+    try:
+        return get_experiment_store().append(rec)
+    except Exception as e:
+        print(f"[Main] 写实验记录失败：{e}")
+        return None
+
+
+def run_simulation_round(
+    sim_pool: Optional[SimWorkerPool],
+    round_idx: int,
+    intent_desc: str,
+    prev_policies: Dict[str, str],
+    curr_policies: Dict[str, str],
+) -> Dict[str, Any]:
+    """
+    有 worker 池就交给池子跑，否则走冷启动的 file mode。
+    """
+    if sim_pool is not None:
+        return sim_pool.simulate(round_idx, intent_desc, prev_policies, curr_policies)
+    return run_matlab_two_phase_filemode(
+        round_idx=round_idx,
+        intent_desc=intent_desc,
+        prev_policies=prev_policies,
+        curr_policies=curr_policies,
+    )
+
+
 # ==== 主流程 ====
 
 
 def main():
+    parser = argparse.ArgumentParser(description="意图 -> 仿真 -> 总结 -> 策略选择 闭环")
+    parser.add_argument("--resume", action="store_true", help="从检查点中第一个未完成的阶段继续")
+    parser.add_argument("--intent-id", default="intent_001", help="意图编号（也是检查点文件名）")
+    args = parser.parse_args()
+
     # 1) 构建 LLM & 向量库
-    model = OllamaChatModel(base_url=OLLAMA_BASE_URL, model_name=OLLAMA_MODEL_NAME)
+    if MODEL_ROUTING_ENABLED:
+        model = build_model_router()
+    else:
+        model = OllamaChatModel(
+            base_url=OLLAMA_BASE_URL, model_name=OLLAMA_MODEL_NAME, backends=get_backend_pool()
+        )
     vs = build_vector_store()
+    sim_pool = build_sim_pool()
+
+    try:
+        run_closed_loop(
+            model,
+            vs,
+            sim_pool,
+            intent_id=args.intent_id,
+            checkpoint=open_checkpoint(args.intent_id, resume=args.resume),
+        )
+    finally:
+        print(model.metrics.format_summary())
+        if isinstance(model, ModelRouter):
+            print(model.format_summary())
+        if _backend_pool is not None:
+            print("[Main] Ollama 后端池：", json.dumps(_backend_pool.snapshot(), ensure_ascii=False))
+        print("[Main] 相同请求合并：chat", CHAT_SINGLE_FLIGHT.snapshot(), "embed", EMBED_SINGLE_FLIGHT.snapshot())
+        print("[Main] 检索 query 缓存：", vs.query_cache.snapshot())
+        if LLM_METRICS_PATH:
+            n = model.metrics.export_jsonl(LLM_METRICS_PATH)
+            print(f"[Main] 已导出 {n} 条 LLM 调用记录 -> {LLM_METRICS_PATH}")
+        if sim_pool is not None:
+            print("[Main] 仿真池指标：", sim_pool.metrics())
+            sim_pool.shutdown()
+
+
+def run_closed_loop(
+    model: Union[OllamaChatModel, ModelRouter],
+    vs: SimpleVectorStore,
+    sim_pool: Optional[SimWorkerPool],
+    operator_text: Optional[str] = None,
+    intent_id: str = "intent_001",
+    max_rounds: Optional[int] = None,
+    sim_round_base: int = 0,
+    checkpoint: Optional[LoopCheckpoint] = None,
+) -> Dict[str, Any]:
+    """
+    跑一个意图的完整闭环，返回结果 + 每轮 trace（campaign_runner 会并发调用多个）。
+
+    model 为 ModelRouter 时每个 agent 走各自的路由（intent / policy / sim_summary）；
+    operator_text 为 None 时从命令行读取；
+    sim_round_base 加到传给仿真的 round_idx 上，多个闭环并发时避免 Matlab 结果目录互相覆盖。
+    checkpoint 不为 None 时每个阶段完成后写检查点；checkpoint.resumed 时跳过已完成的轮次和阶段。
+    """
+    if max_rounds is None:
+        max_rounds = MAX_ROUNDS
 
     # 2) 创建各个 rAPP 的会话
-    intent_agent = create_intent_agent(model, vs)
-    policy_agent = create_policy_agent(model, vs)
-    sim_agent = create_sim_summary_agent(model)
+    intent_agent = create_intent_agent(_agent_model(model, "intent"), vs)
+    policy_agent = create_policy_agent(
+        _agent_model(model, "policy"), vs, compact=(POLICY_PROMPT_MODE == "compact")
+    )
+    sim_agent = create_sim_summary_agent(_agent_model(model, "sim_summary"))
+
+    resumed = checkpoint is not None and checkpoint.resumed
+    if resumed:
+        if checkpoint.get("finished"):
+            print(f"[Checkpoint] {intent_id} 已经跑完，直接返回检查点中的结果")
+            return checkpoint.get("result")
+        operator_text = checkpoint.get("operator_text") or operator_text
 
     # 3) 运营输入意图
-    print("请输入运营层意图（中文），例如：")
-    print("在保证 5% UE 吞吐不低于 2 Mbps 的前提下，尽量提高总吞吐，对能耗不太敏感。\n")
-    operator_text = input("运营意图：").strip()
+    if operator_text is None:
+        print("请输入运营层意图（中文），例如：")
+        print("在保证 5% UE 吞吐不低于 2 Mbps 的前提下，尽量提高总吞吐，对能耗不太敏感。\n")
+        operator_text = input("运营意图：").strip()
     if not operator_text:
         operator_text = "在保证 5% UE 吞吐不低于 2 Mbps 的前提下，尽量提高总吞吐，对能耗不太敏感。"
 
-    # 4) Intent Agent：把自然语言意图转成 intent_json
-    intent_json = translate_intent(intent_agent, operator_text, intent_id="intent_001")
-    print("\n=== Intent JSON ===")
-    print(intent_json)
-
-    # 5) 初始化策略：建议和 Matlab 侧默认策略一致
+    # 4) 初始化策略：建议和 Matlab 侧默认策略一致
     last_policy_ids: Dict[str, str] = {
         "nonRT": "nonrt_baseline",
         "nearRT": "nearrt_macro_only",
@@ -195,9 +467,46 @@ def main():
     }
     next_policy_ids: Dict[str, str] = dict(last_policy_ids)
 
-    # 6) 多轮闭环控制
-    for round_idx in range(MAX_ROUNDS):
-        print(f"\n================ Round {round_idx} ================")
+    spec: Optional[SpeculativeSimulator] = None
+    if PIPELINE_MODE:
+        if sim_pool is None:
+            print("[Main] PIPELINE_MODE 需要常驻仿真池（SIM_POOL_WORKERS > 0），本次按串行模式运行。")
+        else:
+            spec = SpeculativeSimulator(sim_pool)
+
+    intent_json: Dict[str, Any] = {}
+    tracker: Optional[ConvergenceTracker] = None
+    rounds_trace = []
+    final_stop_reason = "max_rounds"
+    t_loop = time.time()
+    start_round = 0
+
+    if resumed:
+        # 恢复会话 history、已完成轮次的策略 / trace，并用已存的仿真结果重放 gap 跟踪器
+        intent_json = checkpoint.get("intent_json") or {}
+        for name, sess in (("intent", intent_agent), ("policy", policy_agent), ("sim", sim_agent)):
+            checkpoint.restore_session(name, sess)
+        loop_state = checkpoint.get("loop") or {}
+        start_round = loop_state.get("completed_rounds", 0)
+        if start_round > 0:
+            last_policy_ids = dict(loop_state["last_policy_ids"])
+            next_policy_ids = dict(loop_state["next_policy_ids"])
+            rounds_trace = list(loop_state["rounds_trace"])
+            tracker = ConvergenceTracker(intent_json, patience=CONVERGENCE_PATIENCE)
+            for idx in range(start_round):
+                tracker.update(idx, checkpoint.get_stage(idx, "simulate"))
+        print(f"[Checkpoint] 从 {intent_id} 的 round {start_round} 继续（{checkpoint.path}）")
+    elif checkpoint is not None:
+        checkpoint.set(intent_id=intent_id, operator_text=operator_text)
+
+    # 5) 多轮闭环控制
+    #    每一轮表示成一个小 DAG，互不依赖的阶段并发执行：
+    #    - round 0 的基线仿真不依赖 intent_json，与意图翻译同时进行；
+    #    - 投机预仿真与 summary / policy agent 同时进行。
+    for round_idx in range(start_round, max_rounds):
+        print(f"\n================ {intent_id} Round {round_idx} ================")
+        t_round = time.time()
+        sim_round = sim_round_base + round_idx
 
         if round_idx == 0:
             # 第一轮：prev 和 curr 一样，相当于“基线”场景
@@ -213,32 +522,156 @@ def main():
         print("  prev_policies_for_sim =", prev_policies_for_sim)
         print("  curr_policies_for_sim =", curr_policies_for_sim)
 
-        # 6.1 调 Matlab 跑 two-phase 仿真（只关心第二段的 KPI）
-        sim_result = run_matlab_two_phase_filemode(
-            round_idx=round_idx,
-            intent_desc=operator_text,
-            prev_policies=prev_policies_for_sim,
-            curr_policies=curr_policies_for_sim,
+        def _intent(r: Dict[str, Any]) -> Dict[str, Any]:
+            return r.get("translate_intent", intent_json)
+
+        def _simulate(r: Dict[str, Any]) -> Dict[str, Any]:
+            # 调 Matlab 跑 two-phase 仿真（只关心第二段的 KPI）
+            if spec is not None:
+                return spec.resolve(
+                    sim_round, operator_text, prev_policies_for_sim, curr_policies_for_sim
+                ).result()
+            return run_simulation_round(
+                sim_pool,
+                round_idx=sim_round,
+                intent_desc=operator_text,
+                prev_policies=prev_policies_for_sim,
+                curr_policies=curr_policies_for_sim,
+            )
+
+        def _speculate(r: Dict[str, Any]) -> None:
+            # 流水线：LLM 思考的同时，先把下一轮的候选组合丢进仿真池
+            candidates = propose_candidates(
+                curr_policies_for_sim,
+                _intent(r),
+                k=SPECULATIVE_CANDIDATES,
+                sweep_cache_path=SWEEP_CACHE_PATH,
+            )
+            spec.speculate(sim_round + 1, operator_text, curr_policies_for_sim, candidates)
+
+        def _gaps(r: Dict[str, Any]):
+            # 数值 gap：sim_result.kpi vs intent_json 的目标，顺便判断是否可以提前结束
+            nonlocal tracker
+            if tracker is None:
+                tracker = ConvergenceTracker(_intent(r), patience=CONVERGENCE_PATIENCE)
+            tracker.update(round_idx, r["simulate"])
+            return tracker.should_stop()
+
+        def _select(r: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            # 已经收敛就不再调用 policy agent，省掉一次 LLM
+            stop, _ = r["gaps"]
+            if EARLY_STOP and stop:
+                return None
+            # Policy Selection Agent：基于 intent_json + summary_text + 数值 gap 表决策下一轮策略
+            return select_policy(
+                policy_agent,
+                intent_json=_intent(r),
+                summary_text=r["summarize"],
+                last_policy_ids=curr_policies_for_sim,
+                policy_library=DEFAULT_POLICY_LIBRARY,
+                gap_table=tracker.gap_table(),
+                stream=STRUCTURED_STREAM,
+                kpi=r["simulate"].get("kpi"),
+            )
+
+        def _staged(stage: str, fn, session_name: Optional[str] = None, session=None):
+            # 检查点里已有该阶段的结果就直接复用；否则执行，并连同改动过的会话一起落盘
+            def run(r: Dict[str, Any]) -> Any:
+                if checkpoint is not None and checkpoint.has_stage(round_idx, stage):
+                    print(f"[Checkpoint] 复用 round {round_idx} 的 {stage} 结果")
+                    return checkpoint.get_stage(round_idx, stage)
+                value = fn(r)
+                if checkpoint is not None:
+                    sessions = {session_name: session} if session_name else None
+                    checkpoint.put_stage(round_idx, stage, value, sessions=sessions)
+                return value
+            return run
+
+        graph = TaskGraph(f"{intent_id}_round_{round_idx}")
+        intent_deps = []
+        if round_idx == 0:
+            # Intent Agent：把自然语言意图转成 intent_json
+            graph.add(
+                "translate_intent",
+                _staged(
+                    "translate_intent",
+                    lambda r: translate_intent(
+                        intent_agent, operator_text, intent_id=intent_id, stream=STRUCTURED_STREAM
+                    ),
+                    "intent",
+                    intent_agent,
+                ),
+            )
+            intent_deps = ["translate_intent"]
+        graph.add("simulate", _staged("simulate", _simulate))
+        if spec is not None and round_idx < max_rounds - 1:
+            graph.add("speculate", _speculate, deps=["simulate"] + intent_deps)
+        # 把整个 sim_result 丢给 Summary Agent，让它写自然语言总结
+        graph.add(
+            "summarize",
+            _staged(
+                "summarize",
+                lambda r: summarize_simulation(sim_agent, r["simulate"], mode=SUMMARY_MODE),
+                "sim",
+                sim_agent,
+            ),
+            deps=["simulate"],
+        )
+        graph.add("gaps", _gaps, deps=["simulate"] + intent_deps)
+        graph.add(
+            "select_policy",
+            _staged("select_policy", _select, "policy", policy_agent),
+            deps=["simulate", "summarize", "gaps"] + intent_deps,
         )
 
-        print("[Main] 当前轮 sim_result.kpi =", sim_result.get("kpi", {}))
+        results = graph.run()
+
+        if round_idx == 0:
+            intent_json = results["translate_intent"]
+            print("\n=== Intent JSON ===")
+            print(intent_json)
+            if checkpoint is not None:
+                checkpoint.set(intent_json=intent_json)
 
-        # 6.2 把整个 sim_result 丢给 Summary Agent，让它写自然语言总结
-        summary_text = summarize_simulation(sim_agent, sim_result)
+        sim_result = results["simulate"]
+        summary_text = results["summarize"]
+        policy_decision = results["select_policy"]
+
+        print("[Main] 当前轮 sim_result.kpi =", sim_result.get("kpi", {}))
         print("\n[Simulation Report 摘要]")
         print(summary_text[:500], "...\n")  # 只打印前 500 字
 
         # 当前轮结束后，second-phase 实际使用的策略就是 curr_policies_for_sim
         last_policy_ids = dict(curr_policies_for_sim)
 
-        # 6.3 Policy Selection Agent：基于 intent_json + summary_text + last_policy_ids 决策下一轮策略
-        policy_decision = select_policy(
-            policy_agent,
-            intent_json=intent_json,
-            summary_text=summary_text,
-            last_policy_ids=last_policy_ids,
-            policy_library=DEFAULT_POLICY_LIBRARY,
-        )
+        print("[Main] KPI gap 表：")
+        print(tracker.gap_table())
+
+        stop, stop_reason = results["gaps"]
+        rounds_trace.append({
+            "round_idx": round_idx,
+            "prev_policies": prev_policies_for_sim,
+            "curr_policies": curr_policies_for_sim,
+            "kpi": sim_result.get("kpi", {}),
+            "decision": policy_decision,
+            "stop_reason": stop_reason if (EARLY_STOP and stop) else "",
+            "stage_s": {name: round(node.duration, 3) for name, node in graph.nodes.items()},
+            "round_s": round(time.time() - t_round, 3),
+        })
+        if EXPERIMENT_LOG_ENABLED:
+            log_experiment_round(
+                intent_id, round_idx, operator_text,
+                prev_policies_for_sim, curr_policies_for_sim, sim_result, policy_decision,
+            )
+        if EARLY_STOP and stop:
+            final_stop_reason = stop_reason
+            graph.log_critical_path()
+            if stop_reason == "targets_met":
+                print("\n[Main] 意图指标已全部达标，提前结束闭环。")
+            else:
+                print(f"\n[Main] 连续 {CONVERGENCE_PATIENCE} 轮 KPI gap 没有明显改善，提前结束闭环。")
+            break
+
         print("[Main] Policy decision:", policy_decision)
 
         selected = policy_decision.get("selected_policies") or {}
@@ -255,11 +688,39 @@ def main():
         status = policy_decision.get("status", "ok")
         gap_summary = policy_decision.get("gap_summary", {})
         print("[Main] status =", status, ", gap_summary =", gap_summary)
-
-        if round_idx == MAX_ROUNDS - 1:
+        if checkpoint is not None:
+            checkpoint.set(loop={
+                "completed_rounds": round_idx + 1,
+                "last_policy_ids": last_policy_ids,
+                "next_policy_ids": next_policy_ids,
+                "rounds_trace": rounds_trace,
+            })
+        graph.log_critical_path()
+        print(f"[Main] 本轮耗时 {time.time() - t_round:.1f}s（仿真 {graph.nodes['simulate'].duration:.1f}s）")
+
+        if round_idx == max_rounds - 1:
             print("\n[Main] 已达到最大轮数，结束闭环。")
 
+    if spec is not None:
+        spec.discard()
+        print("[Main] 投机预仿真统计：", spec.stats)
+    if STRUCTURED_STREAM:
+        print("[Main] 流式提前结束统计：", STREAM_SAVINGS.summary())
+
     print("\n[Main] 所有轮次结束。")
+    result = {
+        "intent_id": intent_id,
+        "operator_text": operator_text,
+        "intent_json": intent_json,
+        "rounds": rounds_trace,
+        "stop_reason": final_stop_reason,
+        "final_policies": last_policy_ids,
+        "gap_trajectory": tracker.trajectory() if tracker is not None else [],
+        "wall_s": round(time.time() - t_loop, 3),
+    }
+    if checkpoint is not None:
+        checkpoint.set(finished=True, result=result)
+    return result
 
 
 if __name__ == "__main__":
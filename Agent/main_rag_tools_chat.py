@@ -1,5 +1,6 @@
 # main_rag_tools_chat.py
 from ollama_client import OllamaChatModel, Message
+from chat_memory import ConversationMemory, attach_memory
 from chat_session import ToolRAGChatSession
 from vectorstore import SimpleVectorStore
 from kb_loader import load_knowledge_from_folder
@@ -46,6 +47,8 @@ def main():
             ),
         )
     )
+    # 长对话：最近 4 轮原样保留，更早的轮次后台折叠成摘要
+    attach_memory(session, ConversationMemory(model, token_budget=6000, keep_turns=4))
 
     print("已连接到模型（RAG + 本地工具）。输入 exit / quit 退出。\n")
 
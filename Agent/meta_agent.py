@@ -3,11 +3,17 @@
 
 import json
 from typing import Dict, Any
+from chat_memory import ConversationMemory, attach_memory
 from chat_session import ToolRAGChatSession
 from ollama_client import OllamaChatModel, Message
+from retrieval_query import meta_query
 from vectorstore import SimpleVectorStore
 
 
+# 只检索带这些标签的知识库文档（标签见 kb_loader.derive_tags）
+META_RETRIEVAL_TAGS = ("policy", "kpi", "experiment")
+
+
 META_SYSTEM_PROMPT = """
 你是 O-RAN 非实时 RIC 中的元认知 rAPP。
 
@@ -60,8 +66,11 @@ META_SYSTEM_PROMPT = """
 
 
 def create_meta_agent(model: OllamaChatModel, retriever: SimpleVectorStore) -> ToolRAGChatSession:
-    sess = ToolRAGChatSession(model=model, retriever=retriever, k=5)
+    sess = ToolRAGChatSession(
+        model=model, retriever=retriever, k=5, label="meta", retrieval_filter=META_RETRIEVAL_TAGS
+    )
     sess.history.append(Message(role="system", content=META_SYSTEM_PROMPT))
+    attach_memory(sess, ConversationMemory(model, keep_turns=2, label="meta_memory"))
     return sess
 
 
@@ -85,5 +94,5 @@ def meta_optimize_intent(
         f"{payload_str}\n\n"
         "请按你的 system 提示，调用合适的工具，给出高层策略优化建议。"
     )
-    reply = meta_agent.ask(user_prompt)
+    reply = meta_agent.ask(user_prompt, retrieval_query=meta_query(intent_json, policy_decision))
     return reply
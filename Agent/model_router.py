@@ -0,0 +1,189 @@
+# model_router.py
+# 按 agent 分配模型：每个 rAPP（intent / policy / sim_summary / meta / web_chat ...）走自己的路由，
+# 路由决定用哪个模型、带哪些 Ollama options（num_ctx / num_predict / temperature）、最多占几个并发槽位。
+# 不需要 20B 模型的任务（仿真报告、对话摘要）可以交给小模型，大模型的槽位留给 policy / meta。
+#
+# 路由表（dict，通常写在主程序配置区）：
+#   {
+#       "default":     {"model": "gpt-oss:20b", "slots": 2},
+#       "policy":      {"model": "gpt-oss:20b", "slots": 2, "options": {"temperature": 0.0, "num_ctx": 8192}},
+#       "sim_summary": {"model": "qwen2.5:3b", "slots": 4, "options": {"num_predict": 800}, "fallback": "policy"},
+#   }
+# - slots：该路由同时在飞的请求数上限（None / 0 表示不限）；
+# - fallback：主路由槽位占满且排队数达到 max_queue（默认 0）时，若备用路由还有空位，本次调用改走备用路由；
+# - base_url / timeout：可选，默认用 ModelRouter 的参数；
+# - hedge：可选，对冲请求参数（HedgePolicy 的字段，True 表示默认参数），首 token 太慢时向另一个实例 / 槽位
+#   再发一份（见 hedging.py）；
+# - ModelRouter(backends=BackendPool(...)) 时所有路由共享同一个多实例后端池（见 backend_pool.py）。
+#
+# 用法：
+#   router = ModelRouter(MODEL_ROUTES, base_url=OLLAMA_BASE_URL)
+#   intent_agent = create_intent_agent(router.for_agent("intent"), vs)   # 接口与 OllamaChatModel 相同
+#   print(router.format_summary())
+
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
+
+from hedging import HedgePolicy
+from llm_metrics import Histogram, MetricsRegistry, REGISTRY
+from ollama_client import OllamaChatModel, Message, ToolCall
+
+
+DEFAULT_ROUTE = "default"
+
+
+class _Route:
+    def __init__(self, name: str, model: OllamaChatModel, fallback: Optional[str], max_queue: int):
+        self.name = name
+        self.model = model
+        self.fallback = fallback
+        self.max_queue = max_queue
+        self.latency = Histogram()   # 含排队等待的端到端耗时
+        self.stats = {"calls": 0, "served": 0, "fallback_out": 0, "fallback_in": 0, "errors": 0}
+
+
+class RoutedChatModel:
+    """
+    某个 agent 看到的“模型”：chat / chat_stream / chat_with_tools 与 OllamaChatModel 接口一致，
+    每次调用由 ModelRouter 决定实际使用的后端模型。
+    """
+
+    def __init__(self, router: "ModelRouter", route: str):
+        self.router = router
+        self.route = route
+
+    @property
+    def model_name(self) -> str:
+        return self.router.routes[self.route].model.model_name
+
+    @property
+    def metrics(self) -> MetricsRegistry:
+        return self.router.metrics
+
+    def chat(
+        self, messages: List[Message], format=None, label: str = "", affinity_key: Optional[str] = None
+    ) -> Message:
+        return self.router.call(
+            self.route, "chat", messages, format=format, label=label, affinity_key=affinity_key
+        )
+
+    def chat_stream(
+        self, messages: List[Message], format=None, on_delta=None, label: str = "",
+        affinity_key: Optional[str] = None,
+    ) -> Tuple[Message, Dict[str, Any]]:
+        return self.router.call(
+            self.route, "chat_stream", messages, format=format, on_delta=on_delta, label=label,
+            affinity_key=affinity_key,
+        )
+
+    def chat_with_tools(
+        self, messages: List[Message], tools: List[Dict[str, Any]], tool_choice: Any = "auto", label: str = "",
+        affinity_key: Optional[str] = None,
+    ) -> Tuple[Message, List[ToolCall]]:
+        return self.router.call(
+            self.route, "chat_with_tools", messages, tools=tools, tool_choice=tool_choice, label=label,
+            affinity_key=affinity_key,
+        )
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        routes: Dict[str, Dict[str, Any]],
+        base_url: str = "http://127.0.0.1:11434",
+        timeout: int = 600,
+        metrics: Optional[MetricsRegistry] = None,
+        backends: Optional[Any] = None,
+    ):
+        self.metrics = metrics if metrics is not None else REGISTRY
+        self.backends = backends
+        self._lock = threading.Lock()
+        self.routes: Dict[str, _Route] = {}
+        for name, cfg in routes.items():
+            model = OllamaChatModel(
+                model_name=cfg["model"],
+                base_url=cfg.get("base_url", base_url),
+                timeout=cfg.get("timeout", timeout),
+                metrics=self.metrics,
+                max_concurrency=cfg.get("slots") or None,
+                options=cfg.get("options"),
+                backends=None if "base_url" in cfg else backends,
+                hedge=HedgePolicy.from_config(cfg.get("hedge")),
+            )
+            self.routes[name] = _Route(name, model, cfg.get("fallback"), int(cfg.get("max_queue", 0)))
+        for route in self.routes.values():
+            if route.fallback is not None and (route.fallback not in self.routes or route.fallback == route.name):
+                raise ValueError(f"路由 {route.name} 的 fallback 无效：{route.fallback!r}")
+
+    def for_agent(self, agent: str) -> RoutedChatModel:
+        """
+        取某个 agent 的模型；路由表里没有这个 agent 时用 "default" 路由。
+        """
+        if agent in self.routes:
+            return RoutedChatModel(self, agent)
+        if DEFAULT_ROUTE in self.routes:
+            return RoutedChatModel(self, DEFAULT_ROUTE)
+        raise KeyError(f"路由表里既没有 {agent!r} 也没有 {DEFAULT_ROUTE!r}")
+
+    def _pick(self, route: _Route) -> _Route:
+        if route.fallback is None or not route.model.saturated(route.max_queue):
+            return route
+        fb = self.routes[route.fallback]
+        if fb.model.saturated(fb.max_queue):
+            return route   # 两边都满：在主路由排队
+        return fb
+
+    def call(self, route_name: str, method: str, *args: Any, **kwargs: Any) -> Any:
+        route = self.routes[route_name]
+        target = self._pick(route)
+        with self._lock:
+            route.stats["calls"] += 1
+            target.stats["served"] += 1
+            if target is not route:
+                route.stats["fallback_out"] += 1
+                target.stats["fallback_in"] += 1
+        t0 = time.time()
+        try:
+            return getattr(target.model, method)(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                target.stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                target.latency.observe(time.time() - t0)
+
+    # ==== 统计 ====
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {
+                name: {
+                    "model": r.model.model_name,
+                    "slots": r.model.max_concurrency,
+                    "outstanding": r.model.outstanding,
+                    "fallback": r.fallback,
+                    **r.stats,
+                    "latency_s": r.latency.snapshot(),
+                }
+                for name, r in self.routes.items()
+            }
+        for name, r in self.routes.items():
+            if r.model.hedge_stats is not None:
+                out[name]["hedge"] = r.model.hedge_stats.snapshot()
+        return out
+
+    def format_summary(self) -> str:
+        lines = []
+        for name, s in self.snapshot().items():
+            lat = s["latency_s"]
+            line = (
+                f"[Route {name}] model={s['model']} slots={s['slots']} calls={s['calls']} "
+                f"served={s['served']} fallback out/in={s['fallback_out']}/{s['fallback_in']} "
+                f"errors={s['errors']} | latency p50={lat['p50']:.2f}s p95={lat['p95']:.2f}s p99={lat['p99']:.2f}s"
+            )
+            if "hedge" in s:
+                line += " | " + self.routes[name].model.hedge_stats.format_summary()
+            lines.append(line)
+        return "\n".join(lines)
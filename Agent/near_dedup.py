@@ -0,0 +1,197 @@
+# near_dedup.py
+# 知识库 chunk 的近重复检测（MinHash + LSH），在 load_knowledge_from_folder 里建索引之前执行。
+# 同一份笔记的多个修订版、以及 split_text_into_chunks 的重叠拼接会产生大量几乎相同的 chunk，
+# 它们在检索时挤占 top-k 名额，同一段话在 RAG prompt 里重复出现好几次。
+#
+# - 特征：归一化（小写、合并空白）后的字符 5-gram 集合，中英文通用；
+# - MinHash：num_perm 个乘法-移位哈希（(a * x + b) 的高 32 位）取最小值，按文档批量用 NumPy 计算；
+# - LSH：签名切成 bands 段（每段 rows 行），任意一段完全相同即成为候选对；
+#   rows 取“相似度恰好等于阈值的两个 chunk 至少有 99% 概率成为候选”的最大值；
+# - 候选对再用精确 Jaccard 复核（>= threshold 才合并），用并查集聚类；
+# - 每个簇保留最长的 chunk（同长取先加载的），其余成员的 id / 来源记进它的 metadata：
+#   merged_ids、merged_sources（不含它自己的来源）、near_duplicates（合并掉的个数）；
+#   tags 取整个簇的并集（同一段内容既在 intent/ 又在 policy/ 目录下时两边的检索都能命中）。
+#
+# 用法：
+#   kept, stats = dedup_near_duplicates(docs, threshold=0.85)
+#   print(stats.format_summary())
+
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+import re
+import time
+
+import numpy as np
+
+from llm_metrics import estimate_tokens
+from vectorstore import Document
+
+
+DEFAULT_THRESHOLD = 0.85
+DEFAULT_NUM_PERM = 128
+SHINGLE_CHARS = 5
+
+_SPACE_RE = re.compile(r"\s+")
+_BLOCK_SHINGLES = 1 << 14     # 每批最多处理多少个 shingle（批内矩阵为 shingle 数 x num_perm）
+
+
+@dataclass
+class DedupStats:
+    threshold: float
+    chunks_before: int = 0
+    chunks_after: int = 0
+    clusters: int = 0              # 至少两个成员的簇个数
+    chars_before: int = 0
+    chars_after: int = 0
+    tokens_before: int = 0         # llm_metrics.estimate_tokens 的估算值
+    tokens_after: int = 0
+    candidate_pairs: int = 0       # LSH 候选对（复核前）
+    elapsed_s: float = 0.0
+
+    @property
+    def removed(self) -> int:
+        return self.chunks_before - self.chunks_after
+
+    def format_summary(self) -> str:
+        def pct(before: int, after: int) -> str:
+            return f"{(before - after) / before:.1%}" if before else "0.0%"
+
+        return (
+            f"[KB] 近重复去重（Jaccard >= {self.threshold:g}）：chunk {self.chunks_before} -> {self.chunks_after}"
+            f"（-{pct(self.chunks_before, self.chunks_after)}，{self.clusters} 个簇），"
+            f"索引文本 {self.chars_before} -> {self.chars_after} 字符，"
+            f"≈{self.tokens_before} -> {self.tokens_after} tokens（-{pct(self.tokens_before, self.tokens_after)}），"
+            f"耗时 {self.elapsed_s:.2f}s"
+        )
+
+
+def _shingles(text: str) -> np.ndarray:
+    """
+    归一化文本的字符 5-gram 哈希集合（uint64，去重、排序）。短于 5 个字符时整段算一个 shingle。
+    """
+    norm = _SPACE_RE.sub(" ", text.lower()).strip()
+    cp = np.frombuffer(norm.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if not len(cp):
+        return np.zeros(1, dtype=np.uint64)
+    k = min(SHINGLE_CHARS, len(cp))
+    n = len(cp) - k + 1
+    h = np.zeros(n, dtype=np.uint64)
+    for i in range(k):
+        h = h * np.uint64(0x100000001B3) + cp[i:i + n]
+    h ^= h >> np.uint64(29)
+    return np.unique(h)
+
+
+def _lsh_shape(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    (bands, rows)：rows 越大候选越少，取满足 P(相似度 = threshold 时成为候选) >= 0.99 的最大 rows。
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if 1.0 - (1.0 - threshold ** rows) ** bands >= 0.99:
+            best = (bands, rows)
+    return best
+
+
+def minhash_signatures(shingle_sets: List[np.ndarray], num_perm: int = DEFAULT_NUM_PERM, seed: int = 1) -> np.ndarray:
+    """
+    shape (文档数, num_perm) 的 uint32 签名矩阵；第 j 个哈希为 (a_j * x + b_j) mod 2^64 的高 32 位（a_j 为奇数），
+    a、b 由 seed 决定。
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    sig = np.empty((len(shingle_sets), num_perm), dtype=np.uint32)
+    start = 0
+    while start < len(shingle_sets):
+        # 一批文档的 shingle 拼在一起算，再按文档边界 reduceat 取最小值
+        end, total = start, 0
+        while end < len(shingle_sets) and (end == start or total + len(shingle_sets[end]) <= _BLOCK_SHINGLES):
+            total += len(shingle_sets[end])
+            end += 1
+        block = shingle_sets[start:end]
+        x = np.concatenate(block)[None, :]
+        hashed = ((a[:, None] * x + b[:, None]) >> np.uint64(32)).astype(np.uint32)   # (num_perm, shingle 数)
+        offsets = np.cumsum([0] + [len(s) for s in block[:-1]])
+        sig[start:end] = np.minimum.reduceat(hashed, offsets, axis=1).T
+        start = end
+    return sig
+
+
+def _jaccard(x: np.ndarray, y: np.ndarray) -> float:
+    inter = len(np.intersect1d(x, y, assume_unique=True))
+    return inter / (len(x) + len(y) - inter)
+
+
+def dedup_near_duplicates(
+    docs: List[Document],
+    threshold: float = DEFAULT_THRESHOLD,
+    num_perm: int = DEFAULT_NUM_PERM,
+) -> Tuple[List[Document], DedupStats]:
+    """
+    返回（去重后的文档列表，统计）。保留的文档保持原有顺序；被合并的信息写进代表文档的 metadata（原地修改）。
+    """
+    t0 = time.perf_counter()
+    stats = DedupStats(threshold=threshold, chunks_before=len(docs))
+    stats.chars_before = sum(len(d.text) for d in docs)
+    stats.tokens_before = sum(estimate_tokens(d.text) for d in docs)
+
+    parent = list(range(len(docs)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if len(docs) > 1:
+        shingle_sets = [_shingles(d.text) for d in docs]
+        sig = minhash_signatures(shingle_sets, num_perm)
+        bands, rows = _lsh_shape(num_perm, threshold)
+        checked = set()
+        for band in range(bands):
+            buckets: Dict[bytes, List[int]] = {}
+            for i, row in enumerate(sig[:, band * rows:(band + 1) * rows]):
+                buckets.setdefault(row.tobytes(), []).append(i)
+            for members in buckets.values():
+                # 大桶（大量完全相同的 chunk）只和桶里第一个比较，避免 O(n^2) 复核
+                head = members[0]
+                for i in members[1:]:
+                    if (head, i) in checked:
+                        continue
+                    checked.add((head, i))
+                    if find(head) != find(i) and _jaccard(shingle_sets[head], shingle_sets[i]) >= threshold:
+                        parent[find(i)] = find(head)
+        stats.candidate_pairs = len(checked)
+
+    clusters: Dict[int, List[int]] = {}
+    for i in range(len(docs)):
+        clusters.setdefault(find(i), []).append(i)
+
+    keep = set()
+    for members in clusters.values():
+        rep = max(members, key=lambda i: (len(docs[i].text), -i))
+        keep.add(rep)
+        if len(members) == 1:
+            continue
+        stats.clusters += 1
+        doc = docs[rep]
+        meta = doc.metadata if doc.metadata is not None else {}
+        own_source = meta.get("source")
+        others = [docs[i] for i in members if i != rep]
+        sources = [(d.metadata or {}).get("source") for d in others]
+        meta["merged_ids"] = [d.id for d in others]
+        meta["merged_sources"] = sorted({s for s in sources if s and s != own_source})
+        meta["near_duplicates"] = len(others)
+        tags = {t for d in [doc] + others for t in (d.metadata or {}).get("tags") or []}
+        if tags:
+            meta["tags"] = sorted(tags)
+        doc.metadata = meta
+
+    kept = [d for i, d in enumerate(docs) if i in keep]
+    stats.chunks_after = len(kept)
+    stats.chars_after = sum(len(d.text) for d in kept)
+    stats.tokens_after = sum(estimate_tokens(d.text) for d in kept)
+    stats.elapsed_s = time.perf_counter() - t0
+    return kept, stats
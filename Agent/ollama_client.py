@@ -1,8 +1,23 @@
 # ollama_client.py
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional, Union, Callable, Iterator
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import queue
+import socket
+import threading
+import time
+
+from backend_pool import RequestCancelled, is_backend_failure
+from hedging import HedgePolicy, HedgeStats
+from llm_metrics import MetricsRegistry, REGISTRY, make_record
+from single_flight import SingleFlight, request_key
+
+
+# 进程内所有 OllamaChatModel 共享：同时在飞的相同非流式 /api/chat 请求只发一次（见 single_flight.py）
+CHAT_SINGLE_FLIGHT = SingleFlight()
 
 
 @dataclass
@@ -18,19 +33,418 @@ class ToolCall:
     arguments: Dict[str, Any]
 
 
+class _Attempt:
+    """
+    对冲模式下的一次流式 /api/chat 请求（在自己的线程里跑）。
+    role: "primary" 原始请求 | "hedge" 对冲请求 | "retry" 原始请求失败后换实例重试
+    """
+
+    def __init__(self, role: str):
+        self.role = role
+        self.url: Optional[str] = None
+        self.t_start = time.time()
+        self.first_at: Optional[float] = None
+        self.beaten_at: Optional[float] = None   # 被对冲请求抢先时，赢家的首 token 时刻
+        self.error: Optional[BaseException] = None
+        self.cancel = threading.Event()
+        # 本次请求独占的 session / 连接 / 响应：输掉比赛时由 abort() 直接断开
+        self.session = requests.Session()
+        adapter = _AttemptAdapter(self)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.conn: Optional[Any] = None
+        self.resp: Optional[requests.Response] = None
+
+    def abort(self) -> None:
+        """
+        置取消标志并 shutdown 底层 socket：阻塞在等响应头（requests.post）或 iter_lines 里的线程立即返回，
+        随即归还模型槽位和后端租约，Ollama 也会检测到断开而停止生成。
+        """
+        self.cancel.set()
+        sock = getattr(self.conn, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _AttemptAdapter(HTTPAdapter):
+    """
+    记下 _Attempt 正在使用的 urllib3 连接：响应头还没回来时还没有 response 对象，只能直接断开连接。
+    每个 _Attempt 一个 session / adapter，改的是它自己的连接池实例。
+    """
+
+    def __init__(self, att: _Attempt):
+        super(_AttemptAdapter, self).__init__()
+        self._att = att
+
+    def get_connection_with_tls_context(self, *args, **kwargs):
+        pool = super(_AttemptAdapter, self).get_connection_with_tls_context(*args, **kwargs)
+        get_conn = pool._get_conn
+        att = self._att
+
+        def _get_conn(timeout=None):
+            conn = get_conn(timeout)
+            att.conn = conn
+            if att.cancel.is_set():
+                raise RequestCancelled()
+            return conn
+
+        pool._get_conn = _get_conn
+        return pool
+
+
 class OllamaChatModel:
     def __init__(
         self,
         model_name: str,
         base_url: str = "http://127.0.0.1:11434",
         timeout: int = 600,
+        metrics: Optional[MetricsRegistry] = None,
+        max_concurrency: Optional[int] = None,
+        options: Optional[Dict[str, Any]] = None,
+        backends: Optional[Any] = None,
+        hedge: Optional[HedgePolicy] = None,
+        coalesce: bool = True,
     ):
         self.model_name = model_name
         self.base_url = base_url.rstrip("/")
+        # backend_pool.BackendPool：多个 Ollama 实例时每个请求从池子里挑 base_url（此时忽略 base_url）
+        self.backends = backends
         self.timeout = timeout
+        # 每次调用的耗时分解 / token 数都记到这里（默认是 llm_metrics.REGISTRY）
+        self.metrics = metrics if metrics is not None else REGISTRY
+        # 多个闭环共享一个客户端时，限制同时在飞的请求数（对应 Ollama 的并行槽位 OLLAMA_NUM_PARALLEL）
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        # 在等槽位 + 正在执行的请求数（model_router 据此判断是否饱和）
+        self._outstanding = 0
+        self._outstanding_lock = threading.Lock()
+        # Ollama 的生成参数（num_ctx / num_predict / temperature ...），每次请求都带上
+        self.options = dict(options) if options else None
+        # 对冲请求（见 hedging.py）：首 token 超过截止时间时向另一个后端 / 槽位再发一份，先出首 token 的胜出
+        self.hedge = hedge
+        self.hedge_stats = HedgeStats(hedge) if hedge is not None else None
+        # 相同请求合并：temperature > 0 且需要多个独立采样的调用方应传 coalesce=False
+        self.single_flight = CHAT_SINGLE_FLIGHT if coalesce else None
+
+    @property
+    def outstanding(self) -> int:
+        return self._outstanding
+
+    def saturated(self, max_queue: int = 0) -> bool:
+        """
+        所有槽位都占满、且排队的请求数已达 max_queue 时返回 True（不限并发时永远 False）。
+        """
+        if not self.max_concurrency:
+            return False
+        return self._outstanding >= self.max_concurrency + max_queue
+
+    def _acquire_slot(self, blocking: bool = True) -> bool:
+        with self._outstanding_lock:
+            self._outstanding += 1
+        if self._slots is not None and not self._slots.acquire(blocking):
+            with self._outstanding_lock:
+                self._outstanding -= 1
+            return False
+        return True
+
+    def _release_slot(self) -> None:
+        if self._slots is not None:
+            self._slots.release()
+        with self._outstanding_lock:
+            self._outstanding -= 1
+
+    @contextmanager
+    def _base_url_for(self, affinity_key: Optional[str], exclude: Optional[str] = None) -> Iterator[str]:
+        if self.backends is None:
+            yield self.base_url
+            return
+        with self.backends.lease(affinity_key, self.backends.find(exclude)) as backend:
+            yield backend.url
+
+    def _apply_options(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if self.options:
+            payload["options"] = dict(self.options)
+        return payload
+
+    # ==== 流式响应的行来源 ====
+    # 调用方已经占好一个槽位，由返回的生成器负责归还（对冲模式下交给原始请求的线程归还）
+
+    def _plain_lines(self, payload: Dict[str, Any], affinity_key: Optional[str]) -> Iterator[Dict[str, Any]]:
+        try:
+            with self._base_url_for(affinity_key) as base_url:
+                resp = requests.post(
+                    f"{base_url}/api/chat",
+                    json=payload,
+                    timeout=self.timeout,
+                    stream=True,
+                )
+                try:
+                    resp.raise_for_status()
+                    for line in resp.iter_lines():
+                        if not line:
+                            continue
+                        try:
+                            yield json.loads(line)
+                        except GeneratorExit:
+                            # 调用方提前结束（on_delta 中止 / 已读到 done 块）：按成功归还后端
+                            return
+                finally:
+                    resp.close()
+        finally:
+            self._release_slot()
+
+    def _run_attempt(
+        self,
+        att: _Attempt,
+        payload: Dict[str, Any],
+        affinity_key: Optional[str],
+        exclude: Optional[str],
+        out: "queue.Queue",
+    ) -> None:
+        try:
+            with self._base_url_for(affinity_key, exclude=exclude) as base_url:
+                att.url = base_url
+                try:
+                    att.resp = resp = att.session.post(
+                        f"{base_url}/api/chat",
+                        json=payload,
+                        timeout=self.timeout,
+                        stream=True,
+                    )
+                    try:
+                        resp.raise_for_status()
+                        for line in resp.iter_lines():
+                            if not line:
+                                continue
+                            if att.first_at is None:
+                                att.first_at = time.time()
+                                self.hedge_stats.observe_ttft(att.first_at - att.t_start)
+                            if att.cancel.is_set():
+                                raise RequestCancelled()
+                            data = json.loads(line)
+                            out.put((att, "line", data))
+                            if data.get("done"):
+                                break
+                    finally:
+                        resp.close()
+                except Exception as e:
+                    # abort() 断开连接导致的读错误按取消处理：不算后端失败
+                    if att.cancel.is_set() and not isinstance(e, RequestCancelled):
+                        raise RequestCancelled() from e
+                    raise
+            out.put((att, "end", None))
+        except RequestCancelled:
+            pass
+        except Exception as e:
+            out.put((att, "error", e))
+        finally:
+            att.session.close()
+            self._release_slot()
+            if att.beaten_at is not None:
+                # 没等到首 token 就断开的，按断开时刻算（节省时间的下限）
+                self.hedge_stats.observe_saved((att.first_at or time.time()) - att.beaten_at)
+
+    def _hedged_lines(self, payload: Dict[str, Any], affinity_key: Optional[str]) -> Iterator[Dict[str, Any]]:
+        """
+        原始请求在首 token 截止时间内没有输出时，非阻塞地再占一个槽位发对冲请求（多实例时发到另一个实例，
+        占不到槽位或超出对冲预算就继续等原始请求）；先出首 token 的请求胜出，其余的立即断开（abort）。
+        原始请求连接失败 / 5xx 且没有其他请求在跑时，换一个实例重试一次（与非对冲模式一致）。
+        """
+        stats = self.hedge_stats
+        out: "queue.Queue" = queue.Queue()
+        attempts: List[_Attempt] = []
+
+        def launch(role: str, exclude: Optional[str]) -> _Attempt:
+            att = _Attempt(role)
+            attempts.append(att)
+            threading.Thread(
+                target=self._run_attempt,
+                args=(att, payload, affinity_key, exclude, out),
+                name=f"ollama_{role}",
+                daemon=True,
+            ).start()
+            return att
+
+        stats.begin_call()
+        primary = launch("primary", None)
+        deadline = primary.t_start + stats.delay()
+        can_hedge = True
+        can_retry = self.backends is not None and len(self.backends.backends) > 1
+        winner: Optional[_Attempt] = None
+        first: Optional[Dict[str, Any]] = None
+        try:
+            while winner is None:
+                try:
+                    att, kind, item = out.get(timeout=max(0.0, deadline - time.time()) if can_hedge else None)
+                except queue.Empty:
+                    can_hedge = False
+                    if not self._acquire_slot(blocking=False):
+                        stats.incr("slot_skips")
+                    elif not stats.try_hedge():
+                        self._release_slot()
+                    else:
+                        launch("hedge", primary.url)
+                    continue
+                if kind == "line":
+                    winner, first = att, item
+                elif kind == "end":
+                    winner = att
+                else:
+                    att.error = item
+                    if any(a.error is None for a in attempts):
+                        continue   # 另一个请求还在跑
+                    if not can_retry or not is_backend_failure(item):
+                        raise item
+                    can_retry = can_hedge = False
+                    stats.incr("retries")
+                    print(f"[Ollama] {att.url} 请求失败，换一个实例重试：{item}")
+                    self._acquire_slot()
+                    launch("retry", att.url)
+
+            if winner.role == "hedge":
+                stats.incr("hedge_wins")
+                if primary.first_at is None and primary.error is None:
+                    stats.incr("stalls")
+                    primary.beaten_at = winner.first_at or time.time()
+                    if self.backends is not None:
+                        self.backends.report_stall(primary.url)
+            for a in attempts:
+                if a is not winner:
+                    a.abort()
+
+            if first is None:
+                return
+            yield first
+            if first.get("done"):
+                return
+            while True:
+                att, kind, item = out.get()
+                if att is not winner:
+                    continue
+                if kind == "error":
+                    raise item
+                if kind == "end":
+                    return
+                yield item
+                if item.get("done"):
+                    return
+        finally:
+            # 调用方提前结束（on_delta 中止）时赢家也立即断开
+            for a in attempts:
+                a.abort()
+
+    # 对冲模式下的非流式调用：内部改用流式请求（才能知道首 token 时刻），再拼回非流式响应的结构
+    def _post_chat_hedged(
+        self,
+        payload: Dict[str, Any],
+        messages: List[Message],
+        label: str,
+        kind: str,
+        affinity_key: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        payload = dict(payload, stream=True)
+        parts: List[str] = []
+        tool_calls: List[Dict[str, Any]] = []
+        final: Dict[str, Any] = {}
+        self._acquire_slot()
+        t_start = time.time()
+        lines = self._hedged_lines(payload, affinity_key)
+        try:
+            for data in lines:
+                msg = data.get("message") or {}
+                if msg.get("content"):
+                    parts.append(msg["content"])
+                tool_calls.extend(msg.get("tool_calls") or [])
+                if data.get("done"):
+                    final = data
+                    break
+        except Exception as e:
+            self.metrics.record(make_record(label, self.model_name, kind, t_start, messages, "", error=e))
+            raise
+        finally:
+            lines.close()
+        data = dict(final)
+        data["message"] = {"role": "assistant", "content": "".join(parts)}
+        if tool_calls:
+            data["message"]["tool_calls"] = tool_calls
+        self.metrics.record(make_record(
+            label, self.model_name, kind, t_start, messages, data["message"]["content"], data
+        ))
+        return data
+
+    # 非流式 /api/chat 的统一出口：相同请求合并 + 发请求 + 记录指标（失败的调用也记一条）
+    # 被合并的调用不占槽位、不单独记指标（只有真正发出去的那次记一条），计数见 CHAT_SINGLE_FLIGHT.snapshot()
+    def _post_chat(
+        self,
+        payload: Dict[str, Any],
+        messages: List[Message],
+        label: str,
+        kind: str,
+        affinity_key: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        if self.single_flight is None:
+            return self._post_chat_once(payload, messages, label, kind, affinity_key)
+        target = self.base_url if self.backends is None else [b.url for b in self.backends.backends]
+        return self.single_flight.do(
+            request_key("chat", target, payload),
+            lambda: self._post_chat_once(payload, messages, label, kind, affinity_key),
+        )
+
+    def _post_chat_once(
+        self,
+        payload: Dict[str, Any],
+        messages: List[Message],
+        label: str,
+        kind: str,
+        affinity_key: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        if self.hedge is not None:
+            return self._post_chat_hedged(payload, messages, label, kind, affinity_key)
+        # 多实例时：连接失败 / 超时 / 5xx 换一个实例重试一次
+        attempts = 2 if self.backends is not None and len(self.backends.backends) > 1 else 1
+        self._acquire_slot()
+        t_start = time.time()
+        try:
+            failed_url = None
+            for attempt in range(attempts):
+                try:
+                    with self._base_url_for(affinity_key, exclude=failed_url) as base_url:
+                        resp = requests.post(
+                            f"{base_url}/api/chat",
+                            json=payload,
+                            timeout=self.timeout,
+                        )
+                        resp.raise_for_status()
+                        data = resp.json()
+                    break
+                except Exception as e:
+                    if attempt + 1 >= attempts or not is_backend_failure(e):
+                        raise
+                    failed_url = base_url
+                    print(f"[Ollama] {base_url} 请求失败，换一个实例重试：{e}")
+        except Exception as e:
+            self.metrics.record(make_record(label, self.model_name, kind, t_start, messages, "", error=e))
+            raise
+        finally:
+            self._release_slot()
+        completion = (data.get("message") or {}).get("content", "") or ""
+        self.metrics.record(make_record(label, self.model_name, kind, t_start, messages, completion, data))
+        return data
 
     # 普通聊天（不带工具），给纯 RAG 用
-    def chat(self, messages: List[Message]) -> Message:
+    # format: None | "json" | JSON schema dict，对应 Ollama /api/chat 的 format 参数（结构化输出）
+    # label: 调用方标签（intent / policy / web_chat ...），只用于指标聚合
+    # affinity_key: 会话标识，配合 backends 让同一会话尽量落到同一个 Ollama 实例（复用 KV cache）
+    def chat(
+        self,
+        messages: List[Message],
+        format: Optional[Union[str, Dict[str, Any]]] = None,
+        label: str = "",
+        affinity_key: Optional[str] = None,
+    ) -> Message:
         payload = {
             "model": self.model_name,
             "messages": [
@@ -38,24 +452,85 @@ class OllamaChatModel:
             ],
             "stream": False,
         }
+        if format is not None:
+            payload["format"] = format
+        self._apply_options(payload)
 
-        resp = requests.post(
-            f"{self.base_url}/api/chat",
-            json=payload,
-            timeout=self.timeout,
-        )
-        resp.raise_for_status()
-        data = resp.json()
+        data = self._post_chat(payload, messages, label, "chat", affinity_key)
 
         content = data.get("message", {}).get("content", "")
         return Message(role="assistant", content=content)
 
+    # 流式聊天：逐块读取 /api/chat 的 NDJSON 输出，每收到一段 content 就回调 on_delta；
+    # on_delta 返回 True 时立即关闭连接（Ollama 检测到断开会停止生成），用于结构化输出提前结束。
+    # 返回 (Message, stats)，stats: {"chunks": 收到的内容块数（约等于 token 数）,
+    #                              "eval_count": 自然结束时 Ollama 报告的生成 token 数，否则 None,
+    #                              "aborted": 是否被 on_delta 提前中止}
+    # 流式调用不做相同请求合并：每个调用方要各自的增量回调和中止时机
+    def chat_stream(
+        self,
+        messages: List[Message],
+        format: Optional[Union[str, Dict[str, Any]]] = None,
+        on_delta: Optional[Callable[[str], bool]] = None,
+        label: str = "",
+        affinity_key: Optional[str] = None,
+    ) -> Tuple[Message, Dict[str, Any]]:
+        payload = {
+            "model": self.model_name,
+            "messages": [
+                {"role": m.role, "content": m.content} for m in messages
+            ],
+            "stream": True,
+        }
+        if format is not None:
+            payload["format"] = format
+        self._apply_options(payload)
+
+        parts: List[str] = []
+        stats: Dict[str, Any] = {"chunks": 0, "eval_count": None, "aborted": False}
+        final: Dict[str, Any] = {}
+        error: Optional[BaseException] = None
+        self._acquire_slot()
+        t_start = time.time()
+        if self.hedge is not None:
+            lines = self._hedged_lines(payload, affinity_key)
+        else:
+            lines = self._plain_lines(payload, affinity_key)
+        try:
+            for data in lines:
+                delta = (data.get("message") or {}).get("content", "")
+                if delta:
+                    parts.append(delta)
+                    stats["chunks"] += 1
+                    if on_delta is not None and on_delta(delta):
+                        stats["aborted"] = True
+                        break
+                if data.get("done"):
+                    stats["eval_count"] = data.get("eval_count")
+                    final = data
+                    break
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            lines.close()
+            # 提前中止时拿不到 done 块里的时间分解，只记录墙钟和已收到的 token 数
+            if not final and stats["chunks"]:
+                final = {"eval_count": stats["chunks"]}
+            self.metrics.record(make_record(
+                label, self.model_name, "chat_stream", t_start, messages, "".join(parts), final, error
+            ))
+
+        return Message(role="assistant", content="".join(parts)), stats
+
     # 带 tools 的聊天
     def chat_with_tools(
         self,
         messages: List[Message],
         tools: List[Dict[str, Any]],
         tool_choice: Any = "auto",  # "auto" | "none" | {...}
+        label: str = "",
+        affinity_key: Optional[str] = None,
     ) -> Tuple[Message, List[ToolCall]]:
         payload = {
             "model": self.model_name,
@@ -67,14 +542,9 @@ class OllamaChatModel:
         }
         if tool_choice is not None:
             payload["tool_choice"] = tool_choice
+        self._apply_options(payload)
 
-        resp = requests.post(
-            f"{self.base_url}/api/chat",
-            json=payload,
-            timeout=self.timeout,
-        )
-        resp.raise_for_status()
-        data = resp.json()
+        data = self._post_chat(payload, messages, label, "chat_with_tools", affinity_key)
 
         msg = data.get("message", {}) or {}
         assistant_msg = Message(
@@ -2,11 +2,14 @@
 # Policy Selection Agent：Intent JSON + 上一轮仿真总结 -> 策略库中选择 + 是否需要 meta（目前不启用 meta）
 
 import json
-from typing import Dict, Any
+from collections import deque
+from typing import Dict, Any, List, Optional, Callable, Sequence, Union
 from chat_session import RAGChatSession
+from llm_metrics import estimate_messages_tokens
 from ollama_client import OllamaChatModel, Message
 from vectorstore import SimpleVectorStore
-from intent_agent import extract_json_block
+from structured_output import ask_structured
+from retrieval_query import policy_query
 
 
 # ==== 策略库：要和 Matlab 侧 setupRicPoliciesTwoPhase 里的 ID 对齐 ====
@@ -83,10 +86,12 @@ POLICY_SYSTEM_PROMPT = """
 - intent_json：包含 objective / kpi_targets / constraints / traffic_focus 等；
 - summary_text：上一轮由 simulation summary rAPP 生成的自然语言实验报告，其中已经描述了本轮仿真的 KPI、问题小区 / UE 等信息；
 - last_policy_ids：上一轮实际使用的策略组合（nonRT / nearRT / beam 的策略 id），对应本轮 summary_text 中的结果；
-- policy_library：策略库 JSON（nonRT / nearRT / beam 三类）。
+- policy_library：策略库 JSON（nonRT / nearRT / beam 三类）；
+- kpi_gap_table（可选）：由程序计算的数值 gap 表，每行为 kpi|current|target|gap|met|delta，
+  gap >= 0 表示达标，delta 是相对上一轮的变化量。
 
 【你的任务】：
-1. 仔细阅读 summary_text，从中尽量提取关键 KPI 信息：
+1. 如果提供了 kpi_gap_table，直接以其中的数值为准；否则仔细阅读 summary_text，从中尽量提取关键 KPI 信息：
    - 总吞吐（sum throughput）
    - 5% UE 吞吐（ue_tput_5p）
    - 能耗 / 小小区 sleep 比例等
@@ -125,48 +130,252 @@ POLICY_SYSTEM_PROMPT = """
 """
 
 
-def create_policy_agent(model: OllamaChatModel, retriever: SimpleVectorStore) -> RAGChatSession:
+# 紧凑模式：策略库只在 system 前缀里给一次，之后每轮只发增量信息
+POLICY_COMPACT_ADDENDUM = """
+【紧凑输入模式（覆盖上面的【输入】说明）】：
+策略库已在本条 system 消息末尾给出（policy_library），用户消息中不再重复，按 id 引用即可。
+每轮用户消息是一个紧凑 JSON，字段为：
+- intent：intent_json；
+- last：本轮仿真实际使用的策略组合（即 last_policy_ids）；
+- kpi：本轮 KPI，格式 {名称: [当前值, 相对上一轮的变化量]}，第一轮没有变化量；
+- gaps（可选）：kpi_gap_table，含义同上；
+- log：更早轮次的决策记录（只保留最近几轮），每条为 [轮次, nonRT, nearRT, beam, status, {关键 KPI}]；
+- summary（可选）：没有 kpi 时才提供的仿真报告摘要。
+历史轮次不会再出现在对话中，请只依据 log 了解之前试过哪些组合及其效果。
+
+policy_library:
+"""
+
+# 紧凑模式下 decision log 保留的轮数、每条记录里保留的 KPI
+COMPACT_LOG_ENTRIES = 4
+COMPACT_LOG_KPIS = ("sum_tput_Mbps", "ue_tput_5p", "estimated_energy_W")
+COMPACT_SUMMARY_MAX_CHARS = 800
+
+# 只检索带这些标签的知识库文档（标签见 kb_loader.derive_tags）
+POLICY_RETRIEVAL_TAGS = ("policy", "kpi")
+
+_COMPACT_SEPARATORS = (",", ":")
+
+
+POLICY_LAYERS = ("nonRT", "nearRT", "beam")
+
+
+def build_policy_decision_schema(policy_library: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    policy decision 的 JSON schema：selected_policies 每一层都限定为策略库里已有的 id。
+    """
+    return {
+        "type": "object",
+        "properties": {
+            "intent_id": {"type": "string"},
+            "selected_policies": {
+                "type": "object",
+                "properties": {
+                    layer: {"type": "string", "enum": [p["id"] for p in policy_library[layer]]}
+                    for layer in POLICY_LAYERS
+                },
+                "required": list(POLICY_LAYERS),
+            },
+            "status": {"type": "string", "enum": ["ok", "need_meta"]},
+            "gap_summary": {"type": "object"},
+            "reason": {"type": "string"},
+        },
+        "required": ["selected_policies", "status", "reason"],
+    }
+
+
+class PolicyRoundLog:
+    """
+    紧凑模式下跨轮次的状态：上一轮 KPI（用于算增量）+ 固定长度的决策记录。
+    """
+
+    def __init__(self, max_entries: int = COMPACT_LOG_ENTRIES):
+        self.entries: deque = deque(maxlen=max_entries)
+        self.prev_kpi: Optional[Dict[str, Any]] = None
+        self.rounds = 0
+
+    def kpi_delta(self, kpi: Dict[str, Any]) -> Dict[str, List[float]]:
+        out = {}
+        for name, value in kpi.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or name == "time_window_s":
+                continue
+            prev = (self.prev_kpi or {}).get(name)
+            if isinstance(prev, (int, float)) and not isinstance(prev, bool):
+                out[name] = [round(value, 3), round(value - prev, 3)]
+            else:
+                out[name] = [round(value, 3)]
+        return out
+
+    def record(self, policy_ids: Dict[str, str], kpi: Optional[Dict[str, Any]], status: str) -> None:
+        kpi = kpi or {}
+        self.entries.append([
+            self.rounds,
+            *(policy_ids.get(layer, "") for layer in POLICY_LAYERS),
+            status,
+            {k: round(kpi[k], 3) for k in COMPACT_LOG_KPIS if isinstance(kpi.get(k), (int, float))},
+        ])
+        if kpi:
+            self.prev_kpi = dict(kpi)
+        self.rounds += 1
+
+
+class CompactPolicySession(RAGChatSession):
+    """
+    紧凑模式的 Policy Agent 会话：
+    - system 前缀（prompt + 策略库）固定不变，只发一次，便于 Ollama 复用前缀的 KV cache；
+    - 每次 ask 前把 history 截回前缀，旧轮次只以 round_log 的形式出现在新一轮的用户消息里，
+      prompt 长度不再随轮数线性增长。
+    """
+
+    def __init__(
+        self,
+        model: OllamaChatModel,
+        retriever: SimpleVectorStore,
+        k: int = 4,
+        label: str = "",
+        max_log_entries: int = COMPACT_LOG_ENTRIES,
+        retrieval_filter: Optional[Sequence[str]] = None,
+    ):
+        super(CompactPolicySession, self).__init__(
+            model=model, retriever=retriever, k=k, label=label, retrieval_filter=retrieval_filter
+        )
+        self.round_log = PolicyRoundLog(max_log_entries)
+        self.prefix_len = 0
+
+    def ask(
+        self,
+        user_input: str,
+        format: Optional[Union[str, Dict[str, Any]]] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        retrieval_query: Optional[str] = None,
+    ) -> str:
+        del self.history[self.prefix_len:]
+        return super(CompactPolicySession, self).ask(
+            user_input, format=format, stop_when=stop_when, retrieval_query=retrieval_query
+        )
+
+
+def create_policy_agent(
+    model: OllamaChatModel,
+    retriever: SimpleVectorStore,
+    compact: bool = False,
+    policy_library: Optional[Dict[str, Any]] = None,
+) -> RAGChatSession:
     """
     创建带 RAG 的 Policy Agent 会话，并注入 system prompt。
+    compact=True 时返回 CompactPolicySession：策略库写进 system 前缀，之后每轮只发增量。
     """
-    sess = RAGChatSession(model=model, retriever=retriever, k=3)
-    sess.history.append(Message(role="system", content=POLICY_SYSTEM_PROMPT))
+    if not compact:
+        sess = RAGChatSession(
+            model=model, retriever=retriever, k=3, label="policy", retrieval_filter=POLICY_RETRIEVAL_TAGS
+        )
+        sess.history.append(Message(role="system", content=POLICY_SYSTEM_PROMPT))
+        return sess
+
+    if policy_library is None:
+        policy_library = DEFAULT_POLICY_LIBRARY
+    library_str = json.dumps(
+        {layer: {p["id"]: p["desc"] for p in policy_library[layer]} for layer in POLICY_LAYERS},
+        ensure_ascii=False,
+        separators=_COMPACT_SEPARATORS,
+    )
+    sess = CompactPolicySession(
+        model=model, retriever=retriever, k=3, label="policy", retrieval_filter=POLICY_RETRIEVAL_TAGS
+    )
+    sess.history.append(
+        Message(role="system", content=POLICY_SYSTEM_PROMPT + POLICY_COMPACT_ADDENDUM + library_str)
+    )
+    sess.prefix_len = len(sess.history)
     return sess
 
 
+def build_compact_policy_prompt(
+    round_log: PolicyRoundLog,
+    intent_json: Dict[str, Any],
+    summary_text: str,
+    last_policy_ids: Dict[str, str],
+    kpi: Optional[Dict[str, Any]] = None,
+    gap_table: Optional[str] = None,
+) -> str:
+    payload: Dict[str, Any] = {
+        "intent": intent_json,
+        "last": last_policy_ids,
+    }
+    if kpi:
+        payload["kpi"] = round_log.kpi_delta(kpi)
+    else:
+        payload["summary"] = summary_text[:COMPACT_SUMMARY_MAX_CHARS]
+    if gap_table:
+        payload["gaps"] = gap_table
+    payload["log"] = list(round_log.entries)
+    payload_str = json.dumps(payload, ensure_ascii=False, separators=_COMPACT_SEPARATORS)
+    return f"本轮输入：{payload_str}\n只输出一个 JSON 对象。"
+
+
 def select_policy(
     policy_agent: RAGChatSession,
     intent_json: Dict[str, Any],
     summary_text: str,
     last_policy_ids: Dict[str, str],
     policy_library: Dict[str, Any] | None = None,
+    gap_table: Optional[str] = None,
+    use_schema: bool = True,
+    stream: bool = False,
+    kpi: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     """
     调用 Policy Agent：根据意图 + 上一轮 summary 文本 + 上一轮策略组合，
     从策略库中选择下一轮策略组合，并给出 gap_summary / status / reason。
 
-    注意：这里不再显式传入结构化 KPI，而是完全依赖 summary_text 中的描述。
+    gap_table：kpi_gap.ConvergenceTracker 生成的数值 gap 表（可选），
+    提供时 policy agent 不必再从 summary_text 里定性推断 KPI 差距。
+
+    use_schema=True 时用策略库生成的 schema 约束输出（策略 id 只能取库里的值），
+    校验失败时做一次定向修复而不是直接抛异常。
+    stream=True 时流式接收，JSON 对象完整后立即中止生成（不再等模型输出后续解释文字）。
+
+    policy_agent 是 CompactPolicySession 时走紧凑编码：kpi（本轮 sim_result["kpi"]）换算成相对
+    上一轮的增量，summary_text 只在没有 kpi 时截断后发送，更早的轮次折叠进 decision log。
     """
     if policy_library is None:
         policy_library = DEFAULT_POLICY_LIBRARY
 
-    payload = {
-        "intent_json": intent_json,
-        "summary_text": summary_text,
-        "last_policy_ids": last_policy_ids,
-        "policy_library": policy_library,
-    }
-    payload_str = json.dumps(payload, ensure_ascii=False, indent=2)
+    compact = isinstance(policy_agent, CompactPolicySession)
+    if compact:
+        user_prompt = build_compact_policy_prompt(
+            policy_agent.round_log, intent_json, summary_text, last_policy_ids, kpi, gap_table
+        )
+    else:
+        payload = {
+            "intent_json": intent_json,
+            "summary_text": summary_text,
+            "last_policy_ids": last_policy_ids,
+            "policy_library": policy_library,
+        }
+        if gap_table:
+            payload["kpi_gap_table"] = gap_table
+        payload_str = json.dumps(payload, ensure_ascii=False, indent=2)
 
-    user_prompt = (
-        "下面是本轮策略决策所需的全部输入(JSON)：\n"
-        f"{payload_str}\n\n"
-        "请按照 system 提示，只输出一个 JSON 对象。"
+        user_prompt = (
+            "下面是本轮策略决策所需的全部输入(JSON)：\n"
+            f"{payload_str}\n\n"
+            "请按照 system 提示，只输出一个 JSON 对象。"
+        )
+
+    schema = build_policy_decision_schema(policy_library)
+    data = ask_structured(
+        policy_agent, user_prompt, schema, use_schema=use_schema, stream=stream,
+        retrieval_query=policy_query(intent_json, last_policy_ids, kpi),
     )
 
-    reply = policy_agent.ask(user_prompt)
-    raw_json = extract_json_block(reply)
-    data = json.loads(raw_json)
+    # 本轮实际发给模型的 prompt（不含模型回复）的估算 token 数
+    sent_tokens = estimate_messages_tokens(policy_agent.history[:-1])
+    print(
+        f"[Policy] 本轮 prompt ≈ {sent_tokens} tokens"
+        f"（{len(policy_agent.history) - 1} 条消息，{'紧凑' if compact else '完整'}编码）"
+    )
+    if compact:
+        policy_agent.round_log.record(last_policy_ids, kpi, data.get("status", "ok"))
 
     # 补上 intent_id，方便后续 trace
     if "intent_id" not in data or not data.get("intent_id"):
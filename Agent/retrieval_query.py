@@ -0,0 +1,67 @@
+# retrieval_query.py
+# 把 agent 的结构化输入蒸馏成一条简短的检索 query。
+# select_policy / meta_optimize_intent 的用户消息是几 KB 的 JSON，直接拿来检索又慢又几乎全是噪声；
+# 真正决定该看哪些资料的只有：优化目标、业务类型、没达标的 KPI、当前策略 id。
+# query 只由这些离散字段组成（不含 KPI 数值），相邻轮次往往完全相同，配合 SimpleVectorStore 的 query 缓存，
+# 每轮的检索开销接近于零。
+
+from typing import Any, Dict, List, Optional
+
+from kpi_gap import compute_kpi_gaps, parse_intent_targets
+
+
+MAX_QUERY_CHARS = 300
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value if v not in (None, "")]
+    return [str(value)]
+
+
+def intent_kpis(intent_json: Dict[str, Any], kpi: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    有本轮 KPI 时返回未达标的 KPI 字段名，否则返回意图里设了目标的 KPI 字段名（去重、保持顺序）。
+    """
+    if kpi:
+        names = [g.kpi for g in compute_kpi_gaps({"kpi": kpi}, intent_json) if not g.met and not g.soft]
+    else:
+        names = [field for _, field, _, _ in parse_intent_targets(intent_json)]
+    return list(dict.fromkeys(names))
+
+
+def distill_query(
+    intent_json: Dict[str, Any],
+    policy_ids: Optional[Dict[str, str]] = None,
+    kpi: Optional[Dict[str, Any]] = None,
+    extra: Optional[str] = None,
+) -> str:
+    """
+    objective + traffic_focus + 未达标（或目标）KPI + 当前策略 id [+ extra]，拼成一行，截断到 MAX_QUERY_CHARS。
+    """
+    parts: List[str] = []
+    parts += _as_list(intent_json.get("objective"))
+    parts += _as_list(intent_json.get("traffic_focus"))
+    parts += intent_kpis(intent_json, kpi)
+    parts += [pid for pid in (policy_ids or {}).values() if pid]
+    if extra:
+        parts.append(extra)
+    return " ".join(parts)[:MAX_QUERY_CHARS]
+
+
+def policy_query(
+    intent_json: Dict[str, Any],
+    last_policy_ids: Dict[str, str],
+    kpi: Optional[Dict[str, Any]] = None,
+) -> str:
+    return distill_query(intent_json, last_policy_ids, kpi)
+
+
+def meta_query(intent_json: Dict[str, Any], policy_decision: Dict[str, Any]) -> str:
+    return distill_query(
+        intent_json,
+        policy_decision.get("selected_policies") or {},
+        extra=str(policy_decision.get("gap_summary") or "")[:120],
+    )
@@ -0,0 +1,257 @@
+# sim_cache.py
+# 仿真结果的内容寻址缓存：同样的控制输入 + 同一版仿真代码 + 同一 seed，只仿真一次。
+#
+# 目录结构：
+#   <root>/objects/<key[:2]>/<key>.json   单次仿真结果（sim_result）
+#   <root>/index.json                     key -> {size, created, last_access, hits}
+#
+# 最近访问时间记在对象文件的 mtime 上（get 命中时 os.utime，多进程之间天然共享），
+# index.json 只是统计快照：命中时不立即重写，最多每 SIM_CACHE_INDEX_SAVE_S 秒落盘一次；
+# 淘汰 / 保存前先和磁盘上的对象文件、其它进程写的 index.json 合并，不会丢掉别人新加的条目。
+#
+# key = sha256(规范化后的控制 JSON + 仿真代码版本)，其中规范化会去掉 round_idx / result_dir
+# 这类“只影响文件名、不影响仿真”的字段，seed 则保留在 key 里。
+
+from typing import Dict, Any, Optional, Tuple
+import argparse
+import atexit
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+# ==== 配置 ====
+
+SIM_CACHE_DIR = r"D:/oran_logs/sim_cache"
+SIM_CACHE_MAX_BYTES = 512 * 1024 * 1024   # 超过后按最久未访问淘汰
+SIM_CACHE_INDEX_SAVE_S = 5.0              # 命中统计最多每隔这么久写一次 index.json
+
+# 这些控制字段不影响仿真结果，不参与 key
+_VOLATILE_CONTROL_FIELDS = ("round_idx", "result_dir")
+
+
+# ==== key 计算 ====
+
+_code_version_memo: Dict[str, Tuple[Tuple, str]] = {}
+
+
+def compute_sim_code_version(work_dir: str, pattern: str = "*.m") -> str:
+    """
+    仿真代码版本 = 工程目录下所有匹配 pattern 的文件（默认 .m）内容的 sha256。
+    以 (文件名, mtime, size) 做 memo，文件没变时不重复读盘。
+    """
+    paths = sorted(glob.glob(os.path.join(work_dir, pattern)))
+    stamp = tuple(
+        (os.path.basename(p), os.path.getmtime(p), os.path.getsize(p)) for p in paths
+    )
+    memo_key = os.path.join(work_dir, pattern)
+    memo = _code_version_memo.get(memo_key)
+    if memo is not None and memo[0] == stamp:
+        return memo[1]
+
+    h = hashlib.sha256()
+    for p in paths:
+        h.update(os.path.basename(p).encode("utf-8"))
+        with open(p, "rb") as f:
+            h.update(f.read())
+    version = h.hexdigest()
+    _code_version_memo[memo_key] = (stamp, version)
+    return version
+
+
+def make_cache_key(control: Dict[str, Any], code_version: str) -> str:
+    """
+    控制 JSON 规范化（去掉无关字段、key 排序、无空白）后与代码版本一起做 sha256。
+    """
+    canonical = {k: v for k, v in control.items() if k not in _VOLATILE_CONTROL_FIELDS}
+    canonical.setdefault("seed", None)
+    blob = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    h = hashlib.sha256()
+    h.update(code_version.encode("utf-8"))
+    h.update(b"\n")
+    h.update(blob.encode("utf-8"))
+    return h.hexdigest()
+
+
+# ==== 缓存本体 ====
+
+class SimResultCache:
+    """
+    结果对象按 key 存成独立文件（写一次、不再修改），index.json 只做访问统计和淘汰用。
+
+    index 丢了或者和对象文件对不上都不要紧：get() 直接看对象文件是否存在，
+    加载时会把 index 里没有的对象补登记进去。
+    """
+
+    def __init__(
+        self,
+        root: str = SIM_CACHE_DIR,
+        max_bytes: int = SIM_CACHE_MAX_BYTES,
+        index_save_s: float = SIM_CACHE_INDEX_SAVE_S,
+    ):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.index_save_s = index_save_s
+        self.index_path = os.path.join(root, "index.json")
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self.index: Dict[str, Dict[str, Any]] = {}
+        self._merge_disk_locked()
+        # 退出前把攒着的命中统计写掉
+        atexit.register(self.flush)
+
+    def _object_path(self, key: str) -> str:
+        return os.path.join(self.root, "objects", key[:2], key + ".json")
+
+    def _read_index_file(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.isfile(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _merge_disk_locked(self) -> None:
+        """
+        以对象文件为准刷新内存 index：补登记其它进程新写的对象、剔除已被删掉的对象，
+        last_access 取 index 记录与对象 mtime 的较新者，hits 取内存与 index.json 的较大者。
+        """
+        on_disk = {}
+        for p in glob.glob(os.path.join(self.root, "objects", "*", "*.json")):
+            on_disk[os.path.splitext(os.path.basename(p))[0]] = p
+        saved = self._read_index_file()
+
+        for key in list(self.index):
+            if key not in on_disk:
+                del self.index[key]
+        for key, p in on_disk.items():
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue   # 刚被其它进程淘汰
+            entry = self.index.get(key)
+            if entry is None:
+                entry = dict(saved.get(key) or {"created": st.st_mtime, "hits": 0})
+                self.index[key] = entry
+            else:
+                entry["hits"] = max(entry.get("hits", 0), (saved.get(key) or {}).get("hits", 0))
+            entry["size"] = st.st_size
+            entry["last_access"] = max(entry.get("last_access", 0.0), st.st_mtime)
+
+    def _save_index(self) -> None:
+        # 调用方持有 _lock
+        tmp = self.index_path + ".tmp.%d" % os.getpid()
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+        self._dirty = False
+        self._saved_at = time.time()
+
+    def flush(self) -> None:
+        """
+        把攒着的命中统计合并进 index.json（没有变化时什么都不做）。
+        """
+        with self._lock:
+            if self._dirty:
+                self._merge_disk_locked()
+                self._save_index()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._object_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+
+        now = time.time()
+        try:
+            os.utime(path, (now, now))   # 最近访问时间记在 mtime 上，其它进程淘汰时也能看到
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            entry = self.index.setdefault(
+                key, {"size": os.path.getsize(path), "created": now, "hits": 0}
+            )
+            entry["last_access"] = now
+            entry["hits"] = entry.get("hits", 0) + 1
+            self._dirty = True
+            if now - self._saved_at >= self.index_save_s:
+                self._merge_disk_locked()
+                self._save_index()
+        return result
+
+    def put(self, key: str, sim_result: Dict[str, Any]) -> None:
+        path = self._object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(sim_result, ensure_ascii=False).encode("utf-8")
+
+        # 先写临时文件再 rename，其它进程不会读到半个对象
+        tmp = path + ".tmp.%d" % os.getpid()
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            now = time.time()
+            self.index[key] = {"size": len(data), "created": now, "last_access": now, "hits": 0}
+            self._merge_disk_locked()
+            self._evict_locked()
+            self._save_index()
+
+    def total_bytes(self) -> int:
+        return sum(int(e.get("size", 0)) for e in self.index.values())
+
+    def _evict_locked(self) -> None:
+        # 调用方持有 _lock，并且已经 _merge_disk_locked()，total 包含其它进程写入的对象
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self.index, key=lambda k: self.index[k].get("last_access", 0.0)):
+            if total <= self.max_bytes:
+                break
+            total -= int(self.index[key].get("size", 0))
+            del self.index[key]
+            try:
+                os.remove(self._object_path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.index),
+            "total_bytes": self.total_bytes(),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看 / 清理仿真结果缓存")
+    parser.add_argument("--root", default=SIM_CACHE_DIR)
+    parser.add_argument("--max-bytes", type=int, default=SIM_CACHE_MAX_BYTES)
+    parser.add_argument("--evict", action="store_true", help="按 --max-bytes 立即执行一次淘汰")
+    args = parser.parse_args()
+
+    cache = SimResultCache(args.root, max_bytes=args.max_bytes)
+    if args.evict:
+        with cache._lock:
+            cache._merge_disk_locked()
+            cache._evict_locked()
+            cache._save_index()
+    print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
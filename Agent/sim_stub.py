@@ -0,0 +1,147 @@
+# sim_stub.py
+# Python 版“替身”仿真器：不依赖 Matlab，按策略组合 + seed 生成结构与 Matlab 一致的 sim_result
+#
+# 用途：
+# - sweep / 流水线 / 压测等场景下，在没有 Matlab 的机器上也能跑通整个闭环；
+# - 结果是确定性的：同样的 (prev_policy, curr_policy, seed) 一定得到同样的 KPI。
+#
+# 注意：这里的 KPI 只是“看起来合理”的近似模型，不代表真实物理层仿真结果。
+
+from typing import Dict, Any, List
+import random
+
+
+# 每个策略对 KPI 的大致影响（乘性因子 / 加性偏移），数值是拍脑袋的经验值
+_NONRT_EFFECTS: Dict[str, Dict[str, float]] = {
+    "nonrt_baseline":      {"tput": 1.00, "energy": 1.00, "sleep": 0.00},
+    "nonrt_throughput_v1": {"tput": 1.12, "energy": 1.15, "sleep": 0.00},
+    "nonrt_energy_simple": {"tput": 0.88, "energy": 0.72, "sleep": 0.55},
+    "nonrt_balanced_v1":   {"tput": 1.04, "energy": 0.90, "sleep": 0.25},
+}
+
+_NEARRT_EFFECTS: Dict[str, Dict[str, float]] = {
+    "nearrt_macro_only":     {"tput": 0.90, "tail": 0.80, "offload": 0.05},
+    "nearrt_throughput_v1":  {"tput": 1.15, "tail": 0.95, "offload": 0.60},
+    "nearrt_tail_aware_v1":  {"tput": 1.02, "tail": 1.35, "offload": 0.40},
+    "nearrt_smallcell_bias": {"tput": 1.08, "tail": 1.15, "offload": 0.70},
+}
+
+_BEAM_EFFECTS: Dict[str, Dict[str, float]] = {
+    "beam_default":     {"tput": 1.00, "tail": 1.00},
+    "beam_round_robin": {"tput": 0.97, "tail": 1.05},
+    "beam_geometry_8":  {"tput": 1.05, "tail": 1.03},
+    "beam_geometry_16": {"tput": 1.09, "tail": 1.06},
+}
+
+_SERVICES = ["Video", "Gaming", "Voice", "URLLC"]
+
+NUM_UES = 10
+NUM_CELLS = 3
+
+
+def _effect(table: Dict[str, Dict[str, float]], policy_id: str, default_id: str) -> Dict[str, float]:
+    return table.get(policy_id) or table[default_id]
+
+
+def run_stub_simulation(
+    round_idx: int,
+    intent_desc: str,
+    prev_policies: Dict[str, str],
+    curr_policies: Dict[str, str],
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    生成一次 two-phase 仿真的结构化结果（字段与 oranSim_run_two_phase_10s.m 输出一致）。
+
+    prev_policies 只影响第二阶段开头的“惯性”（切换越多，KPI 越有一点损失），
+    KPI 主要由 curr_policies 决定。
+    """
+    nonrt = _effect(_NONRT_EFFECTS, curr_policies.get("nonRT", ""), "nonrt_baseline")
+    nearrt = _effect(_NEARRT_EFFECTS, curr_policies.get("nearRT", ""), "nearrt_macro_only")
+    beam = _effect(_BEAM_EFFECTS, curr_policies.get("beam", ""), "beam_default")
+
+    # 策略切换的代价：每换一层策略，吞吐掉一点
+    switches = sum(
+        1 for layer in ("nonRT", "nearRT", "beam")
+        if prev_policies.get(layer) != curr_policies.get(layer)
+    )
+    switch_penalty = 1.0 - 0.02 * switches
+
+    # seed 同时决定拓扑 / 业务分配和 KPI 抖动，与策略组合无关
+    rng = random.Random(int(seed))
+
+    tput_factor = nonrt["tput"] * nearrt["tput"] * beam["tput"] * switch_penalty
+    tail_factor = nearrt["tail"] * beam["tail"]
+
+    ues: List[Dict[str, Any]] = []
+    for ue_id in range(1, NUM_UES + 1):
+        base = rng.uniform(1.0, 12.0)
+        service = _SERVICES[(ue_id - 1) % len(_SERVICES)]
+        # 远端 UE 更依赖 tail-aware / offload 策略
+        is_edge = base < 3.0
+        tput = base * tput_factor * (tail_factor if is_edge else 1.0)
+        tput *= rng.uniform(0.95, 1.05)
+        offloaded = rng.random() < nearrt["offload"] * (1.0 - nonrt["sleep"] * 0.5)
+        serving_cell = rng.choice([2, 3]) if offloaded else 1
+        ues.append({
+            "ue_id": ue_id,
+            "tput_Mbps": round(tput, 4),
+            "delay_ms": round(rng.uniform(5.0, 15.0) * (1.6 if is_edge else 1.0), 3),
+            "serving_cell": serving_cell,
+            "energyEff_MbpsPerPower": 0.0,
+            "service": service,
+        })
+
+    sorted_tput = sorted(u["tput_Mbps"] for u in ues)
+
+    def _pct(p: float) -> float:
+        idx = min(len(sorted_tput) - 1, max(0, int(round(p * (len(sorted_tput) - 1)))))
+        return sorted_tput[idx]
+
+    sleep_ratio = min(0.9, nonrt["sleep"] * rng.uniform(0.9, 1.1))
+
+    cells: List[Dict[str, Any]] = []
+    for cell_id in range(1, NUM_CELLS + 1):
+        served = [u for u in ues if u["serving_cell"] == cell_id]
+        cell_tput = sum(u["tput_Mbps"] for u in served)
+        if cell_id == 1:
+            power = 1.0
+            cell_sleep = 0.0
+        else:
+            cell_sleep = sleep_ratio
+            power = 0.1 + 0.4 * (1.0 - cell_sleep)
+        for u in served:
+            u["energyEff_MbpsPerPower"] = round(u["tput_Mbps"] / power, 4)
+        cells.append({
+            "cell_id": cell_id,
+            "role": "macro" if cell_id == 1 else "small",
+            "tput_Mbps": round(cell_tput, 4),
+            "delay_ms": round(sum(u["delay_ms"] for u in served) / len(served), 3) if served else 5.0,
+            "power_W": round(power, 4),
+            "load_ratio": round(len(served) / NUM_UES, 3),
+            "energyEff_MbpsPerPower": round(cell_tput / power, 4),
+        })
+
+    energy_w = 400.0 * nonrt["energy"] + sum(200.0 * c["power_W"] for c in cells[1:])
+
+    return {
+        "exp_id": "exp_round_%d" % int(round_idx),
+        "intent_desc": intent_desc,
+        "policy_ids": {
+            "nonRT": curr_policies.get("nonRT", ""),
+            "nearRT": curr_policies.get("nearRT", ""),
+            "beam": curr_policies.get("beam", ""),
+        },
+        "kpi": {
+            "sum_tput_Mbps": round(sum(sorted_tput), 4),
+            "ue_tput_5p": round(_pct(0.05), 4),
+            "ue_tput_50p": round(_pct(0.50), 4),
+            "ue_tput_95p": round(_pct(0.95), 4),
+            "estimated_energy_W": round(energy_w, 3),
+            "sleep_ratio_small_cells": round(sleep_ratio, 4),
+            "time_window_s": [1.0, 2.0],
+        },
+        "cells": cells,
+        "ues": ues,
+        "bad_ues": [],
+    }
@@ -2,9 +2,22 @@
 # Simulation Summary Agent：结构化仿真结果 -> 自然语言实验报告
 
 import json
-from typing import Dict, Any
+import re
+from typing import Dict, Any, List, Optional
+from chat_memory import ConversationMemory, attach_memory
 from chat_session import ChatSession
 from ollama_client import OllamaChatModel, Message
+from policy_agent import DEFAULT_POLICY_LIBRARY
+
+
+# 报告生成模式：
+# - "template"：完全由模板渲染，不调用 LLM（毫秒级）；
+# - "hybrid"：模板渲染，只让 LLM 给“问题 UE”写一句诊断；
+# - "llm"：整份报告交给 LLM 生成（原始行为）。
+SUMMARY_MODES = ("template", "hybrid", "llm")
+
+# 没有 bad_ues 字段时，从 ues 中挑吞吐最低的几个作为问题 UE
+MAX_BAD_UES = 3
 
 
 SIM_SUMMARY_SYSTEM_PROMPT = """
@@ -53,15 +66,198 @@ Intent: <意图自然语言>
 
 
 def create_sim_summary_agent(model: OllamaChatModel) -> ChatSession:
-    sess = ChatSession(model=model)
+    sess = ChatSession(model=model, label="sim_summary")
     sess.history.append(Message(role="system", content=SIM_SUMMARY_SYSTEM_PROMPT))
-    return sess
+    # 每轮报告相互独立：只保留最近一轮，旧轮次直接丢弃，不需要摘要
+    return attach_memory(sess, ConversationMemory(keep_turns=1, summarize=False))
+
+
+BAD_UE_DIAGNOSIS_PROMPT = """
+你是 O-RAN 仿真平台中的 simulation summary rAPP，现在只需要诊断若干表现较差的 UE。
+输入 JSON 包含 policy_ids、小区级 KPI（cells）和问题 UE 列表（bad_ues）。
+请对每个问题 UE 输出一行，格式严格为：
+UE <ue_id>: <问题 + 可能原因 + 改进建议，一句话>
+不要输出其它内容。
+"""
+
+
+def _fmt(value: Any, digits: int = 2) -> str:
+    if isinstance(value, (int, float)):
+        return f"{value:.{digits}f}"
+    return "N/A" if value is None else str(value)
+
+
+def _policy_desc(layer: str, policy_id: str) -> str:
+    for p in DEFAULT_POLICY_LIBRARY.get(layer, []):
+        if p["id"] == policy_id:
+            return p["desc"]
+    return "（策略库中无此 id 的描述）"
 
 
-def summarize_simulation(sim_agent: ChatSession, sim_result: Dict[str, Any]) -> str:
+def select_bad_ues(sim_result: Dict[str, Any], max_ues: int = MAX_BAD_UES) -> List[Dict[str, Any]]:
+    """
+    优先使用 sim_result["bad_ues"]；Matlab 侧目前给的是空数组，这时按吞吐从低到高挑 max_ues 个。
+    """
+    bad_ues = sim_result.get("bad_ues") or []
+    if bad_ues:
+        return list(bad_ues)[:max_ues]
+    ues = [u for u in (sim_result.get("ues") or []) if isinstance(u.get("tput_Mbps"), (int, float))]
+    ues.sort(key=lambda u: u["tput_Mbps"])
+    return ues[:max_ues]
+
+
+def _rule_based_diagnosis(ue: Dict[str, Any], sim_result: Dict[str, Any]) -> str:
+    kpi = sim_result.get("kpi", {}) or {}
+    median = kpi.get("ue_tput_50p")
+    tput = ue.get("tput_Mbps")
+    delay = ue.get("delay_ms")
+    serving = ue.get("serving_cell")
+
+    problems = []
+    if isinstance(tput, (int, float)) and isinstance(median, (int, float)) and tput < 0.5 * median:
+        problems.append("吞吐明显低于中位数")
+    if isinstance(delay, (int, float)) and delay > 20.0:
+        problems.append("时延偏高")
+    if not problems:
+        problems.append("吞吐处于尾部")
+
+    if serving == 1:
+        hint = "由宏小区服务，宏小区负载较高时可尝试 tail-aware / smallcell-bias 类 near-RT 策略 offload 到小小区"
+    else:
+        hint = "由小小区服务，可检查该小区是否频繁 sleep，或换用更精细的 beam 策略"
+    return "、".join(problems) + "；" + hint
+
+
+def render_summary_report(
+    sim_result: Dict[str, Any],
+    bad_ue_diagnosis: Optional[Dict[int, str]] = None,
+) -> str:
+    """
+    不调用 LLM，按 SIM_SUMMARY_SYSTEM_PROMPT 规定的格式直接渲染实验报告。
+    bad_ue_diagnosis: {ue_id: 诊断文本}，缺省时用规则生成的提示。
+    """
+    exp_id = sim_result.get("exp_id", "?")
+    kpi = sim_result.get("kpi", {}) or {}
+    cells = sim_result.get("cells") or []
+    ues = sim_result.get("ues") or []
+    policy_ids = sim_result.get("policy_ids", {}) or {}
+    bad_ue_diagnosis = bad_ue_diagnosis or {}
+
+    num_macro = sum(1 for c in cells if c.get("role") == "macro")
+    num_small = len(cells) - num_macro
+    services: Dict[str, int] = {}
+    for u in ues:
+        svc = u.get("service") or "Unknown"
+        services[svc] = services.get(svc, 0) + 1
+    window = kpi.get("time_window_s") or []
+
+    lines = [f"===== Experiment {exp_id} =====", f"Intent: {sim_result.get('intent_desc', '')}", ""]
+
+    lines.append("[场景总结]")
+    lines.append(f"- 拓扑：{num_macro} 个宏小区 + {num_small} 个小小区，共 {len(cells)} 个小区；")
+    lines.append(f"- 物理 UE 数：{len(ues)}；")
+    if services:
+        dist = " / ".join(f"{k} {v}" for k, v in sorted(services.items()))
+        lines.append(f"- 业务类型分布：{dist}；")
+    if len(window) == 2:
+        lines.append(f"- KPI 统计窗口：{_fmt(window[0], 1)}–{_fmt(window[1], 1)} s（two-phase 仿真第二阶段）。")
+    lines.append("")
+
+    lines.append("[控制策略总结]")
+    for layer, title in (
+        ("nonRT", "[non-RT RIC: Cell Sleeping]"),
+        ("nearRT", "[near-RT RIC: Traffic Steering]"),
+        ("beam", "[Beam RIC: Beamforming]"),
+    ):
+        pid = policy_ids.get(layer, "")
+        lines.append(title)
+        lines.append(f"- 策略 id: {pid or 'N/A'} —— {_policy_desc(layer, pid)}")
+    lines.append("")
+
+    lines.append("[KPI 总体]")
+    lines.append(f"- 总吞吐：{_fmt(kpi.get('sum_tput_Mbps'))} Mbps")
+    lines.append(
+        "- UE 吞吐分布（5% / 50% / 95%）："
+        f"{_fmt(kpi.get('ue_tput_5p'), 3)} / {_fmt(kpi.get('ue_tput_50p'), 3)} / {_fmt(kpi.get('ue_tput_95p'), 3)} Mbps"
+    )
+    lines.append(f"- 估算能耗：{_fmt(kpi.get('estimated_energy_W'), 1)} W")
+    lines.append(f"- 小小区 sleep 比例：{_fmt(kpi.get('sleep_ratio_small_cells'))}")
+    lines.append("")
+
+    lines.append("[小区级 KPI]")
+    for c in cells:
+        parts = [
+            f"吞吐 {_fmt(c.get('tput_Mbps'))} Mbps",
+            f"时延 {_fmt(c.get('delay_ms'), 1)} ms",
+            f"功率 {_fmt(c.get('power_W'))}",
+        ]
+        if "load_ratio" in c:
+            parts.append(f"负载 {_fmt(c.get('load_ratio'))}")
+        if "sleep_ratio" in c:
+            parts.append(f"sleep 比例 {_fmt(c.get('sleep_ratio'))}")
+        lines.append(f"- 小区 {c.get('cell_id')}（{c.get('role', '')}）: " + "，".join(parts))
+    lines.append("")
+
+    lines.append("[问题 UE（表现较差的 UE 提示）]")
+    bad_ues = select_bad_ues(sim_result)
+    if not bad_ues:
+        lines.append("- 无")
+    for u in bad_ues:
+        ue_id = u.get("ue_id")
+        diag = bad_ue_diagnosis.get(ue_id) or _rule_based_diagnosis(u, sim_result)
+        lines.append(
+            f"- UE {ue_id}（{u.get('service', 'Unknown')}，服务小区 {u.get('serving_cell', '?')}）: "
+            f"吞吐 {_fmt(u.get('tput_Mbps'), 3)} Mbps，时延 {_fmt(u.get('delay_ms'), 1)} ms —— {diag}"
+        )
+    lines.append("")
+    lines.append(f"===== End of Experiment {exp_id} =====")
+    return "\n".join(lines)
+
+
+def _diagnose_bad_ues(sim_agent: ChatSession, sim_result: Dict[str, Any]) -> Dict[int, str]:
+    """
+    hybrid 模式：只把问题 UE 相关的少量字段交给 LLM，解析 “UE <id>: ...” 行。
+    不写入 sim_agent.history，避免每轮累积上下文。
+    """
+    bad_ues = select_bad_ues(sim_result)
+    if not bad_ues:
+        return {}
+    payload = {
+        "policy_ids": sim_result.get("policy_ids", {}),
+        "cells": sim_result.get("cells", []),
+        "bad_ues": bad_ues,
+    }
+    messages = [
+        Message(role="system", content=BAD_UE_DIAGNOSIS_PROMPT),
+        Message(role="user", content=json.dumps(payload, ensure_ascii=False, separators=(",", ":"))),
+    ]
+    reply = sim_agent.model.chat(messages, label=sim_agent.label, affinity_key=sim_agent.affinity_key).content
+
+    diagnosis: Dict[int, str] = {}
+    for line in reply.splitlines():
+        m = re.match(r"^\s*[-*]?\s*UE\s*(\d+)\s*[:：]\s*(.+)$", line)
+        if m:
+            diagnosis[int(m.group(1))] = m.group(2).strip()
+    return diagnosis
+
+
+def summarize_simulation(
+    sim_agent: ChatSession,
+    sim_result: Dict[str, Any],
+    mode: str = "llm",
+) -> str:
     """
     sim_result: 一次仿真的结构化结果 dict（由 Matlab 或 Python 构造）
+    mode: "template" / "hybrid" / "llm"，见 SUMMARY_MODES
     """
+    if mode not in SUMMARY_MODES:
+        raise ValueError(f"未知的 summary 模式: {mode}（可选: {SUMMARY_MODES}）")
+
+    if mode == "template":
+        return render_summary_report(sim_result)
+    if mode == "hybrid":
+        return render_summary_report(sim_result, _diagnose_bad_ues(sim_agent, sim_result))
+
     sim_str = json.dumps(sim_result, ensure_ascii=False, indent=2)
     user_prompt = (
         "下面是本次实验的结构化结果(JSON)：\n"
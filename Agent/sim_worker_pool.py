@@ -0,0 +1,550 @@
+# sim_worker_pool.py
+# 常驻仿真 worker 池：N 个长期存活的仿真进程（Matlab 或 Python 替身），
+# 通过队列派发控制任务、异步收集结果，启动开销每个 worker 只付一次。
+#
+# 通信方式沿用 file mode 的思路，每个 worker 一个 mailbox 目录：
+#   <pool_dir>/worker_<i>/inbox/job_<id>.json    控制 JSON（同 oranSim_driver_from_json 的输入）
+#   <pool_dir>/worker_<i>/outbox/job_<id>.done   {"ok": true, "result_path": ...} / {"ok": false, "error": ...}
+#   <pool_dir>/worker_<i>/heartbeat              worker 空闲轮询时、以及每个任务写 .done 之前刷新
+#   <pool_dir>/worker_<i>/stop                   通知 worker 退出
+#
+# Matlab worker 跑的是 oranSim_worker_loop.m；Python 替身 worker 就是本文件的 --serve 模式。
+#
+# 用法示例：
+#   pool = SimWorkerPool(num_workers=2, backend="stub")
+#   pool.start()
+#   fut = pool.submit(0, "意图", prev, curr)
+#   sim_result = fut.result()
+#   pool.shutdown()
+
+from typing import Dict, Any, List, Optional
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+import argparse
+import itertools
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from sim_cache import SimResultCache, compute_sim_code_version, make_cache_key
+
+
+# ==== 配置 ====
+
+SIM_POOL_DIR = r"D:/oran_logs/sim_pool"
+SIM_JOB_TIMEOUT_S = 900.0         # 单个仿真任务的超时
+SIM_STARTUP_TIMEOUT_S = 300.0     # worker 启动后第一次心跳的等待上限（Matlab 启动较慢）
+SIM_HEARTBEAT_STALE_S = 30.0      # 空闲 worker 心跳超过这个时间没刷新，就认为已卡死
+SIM_JOB_MAX_RETRIES = 1           # worker 崩溃时任务自动重试的次数
+
+_POLL_INTERVAL_S = 0.05
+
+
+class SimWorkerError(RuntimeError):
+    pass
+
+
+@dataclass
+class _SimJob:
+    job_id: str
+    control: Dict[str, Any]
+    future: Future
+    cache_key: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    attempts: int = 0
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(p / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _write_json_atomic(path: str, obj: Dict[str, Any]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+# ==== 单个 worker（子进程 + mailbox） ====
+
+class _SimWorker:
+    def __init__(self, pool: "SimWorkerPool", index: int):
+        self.pool = pool
+        self.index = index
+        self.mailbox = os.path.join(pool.pool_dir, f"worker_{index}")
+        self.inbox = os.path.join(self.mailbox, "inbox")
+        self.outbox = os.path.join(self.mailbox, "outbox")
+        self.results = os.path.join(self.mailbox, "results")
+        self.proc: Optional[subprocess.Popen] = None
+        self._log_file = None
+        self._last_done_at = 0.0    # 最近一次拿到 .done 的时间，健康检查时与心跳取较新者
+
+    def _command(self) -> List[str]:
+        if self.pool.backend == "stub":
+            return [sys.executable, os.path.abspath(__file__), "--serve", self.mailbox]
+
+        work_dir_m = self.pool.matlab_work_dir.replace("\\", "/")
+        mailbox_m = self.mailbox.replace("\\", "/")
+        matlab_code = f"cd('{work_dir_m}'); oranSim_worker_loop('{mailbox_m}');"
+        return [self.pool.matlab_exe_path, "-batch", matlab_code]
+
+    def start(self) -> None:
+        # 清掉上一个进程留下的状态，避免把旧心跳 / 旧 .done 当成新的
+        shutil.rmtree(self.mailbox, ignore_errors=True)
+        self._last_done_at = 0.0
+        for d in (self.inbox, self.outbox, self.results):
+            os.makedirs(d, exist_ok=True)
+
+        self._log_file = open(os.path.join(self.mailbox, "worker.log"), "a", encoding="utf-8")
+        self.proc = subprocess.Popen(
+            self._command(),
+            stdout=self._log_file,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+
+        deadline = time.time() + self.pool.startup_timeout_s
+        while time.time() < deadline:
+            if not self.alive():
+                raise SimWorkerError(f"worker {self.index} 启动后立即退出，详见 {self.mailbox}/worker.log")
+            if os.path.isfile(os.path.join(self.mailbox, "heartbeat")):
+                return
+            time.sleep(_POLL_INTERVAL_S)
+        raise SimWorkerError(f"worker {self.index} 在 {self.pool.startup_timeout_s}s 内没有心跳")
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def healthy(self) -> bool:
+        """
+        健康检查：进程还在，且心跳没有过期。
+        Matlab 单线程，跑仿真期间不会刷新心跳，所以只在 worker 空闲时检查；
+        最近一次 .done 也算作一次心跳，长任务刚结束、立刻派下一个任务时不会被误判为卡死。
+        """
+        if not self.alive():
+            return False
+        try:
+            beat = os.path.getmtime(os.path.join(self.mailbox, "heartbeat"))
+        except OSError:
+            return False
+        return time.time() - max(beat, self._last_done_at) <= self.pool.heartbeat_stale_s
+
+    def stop(self, grace_s: float = 5.0) -> None:
+        if self.proc is None:
+            return
+        try:
+            open(os.path.join(self.mailbox, "stop"), "w").close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=grace_s)
+        except subprocess.TimeoutExpired:
+            self.kill()
+        self._close_log()
+
+    def kill(self) -> None:
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                pass
+        self._close_log()
+
+    def _close_log(self) -> None:
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def run_job(self, job: _SimJob, timeout_s: float) -> Dict[str, Any]:
+        """
+        把任务写进 inbox，等待 outbox 里出现对应的 .done。
+        - 超时：抛 TimeoutError（由调用方重启 worker）；
+        - 进程中途退出：抛 SimWorkerError（由调用方重启并按需重试）。
+        """
+        control = dict(job.control)
+        control["result_dir"] = self.results.replace("\\", "/")
+        job_path = os.path.join(self.inbox, f"job_{job.job_id}.json")
+        done_path = os.path.join(self.outbox, f"job_{job.job_id}.done")
+        _write_json_atomic(job_path, control)
+
+        deadline = time.time() + timeout_s
+        while True:
+            if os.path.isfile(done_path):
+                self._last_done_at = time.time()
+                break
+            if not self.alive():
+                raise SimWorkerError(f"worker {self.index} 在执行任务 {job.job_id} 时退出")
+            if time.time() > deadline:
+                raise TimeoutError(f"仿真任务 {job.job_id} 超过 {timeout_s}s 未完成")
+            time.sleep(_POLL_INTERVAL_S)
+
+        with open(done_path, "r", encoding="utf-8") as f:
+            status = json.load(f)
+        os.remove(done_path)
+
+        if not status.get("ok"):
+            raise RuntimeError(f"仿真任务 {job.job_id} 失败: {status.get('error')}")
+
+        result_path = status["result_path"]
+        with open(result_path, "r", encoding="utf-8") as f:
+            sim_result = json.load(f)
+        os.remove(result_path)
+        return sim_result
+
+
+# ==== worker 池 ====
+
+class SimWorkerPool:
+    """
+    - submit() 立刻返回 concurrent.futures.Future，结果在后台 worker 线程里填充；
+    - 每个 worker 配一个派发线程：从共享队列取任务 -> 健康检查 -> 执行 -> 回填 future；
+    - worker 崩溃 / 卡死 / 任务超时都会自动重启该 worker；
+    - 排队中的任务可以用 future.cancel() 取消（已经在跑的任务会跑完，但结果会被丢弃）。
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 2,
+        backend: str = "stub",
+        pool_dir: str = SIM_POOL_DIR,
+        matlab_exe_path: str = "",
+        matlab_work_dir: str = "",
+        job_timeout_s: float = SIM_JOB_TIMEOUT_S,
+        startup_timeout_s: float = SIM_STARTUP_TIMEOUT_S,
+        heartbeat_stale_s: float = SIM_HEARTBEAT_STALE_S,
+        max_retries: int = SIM_JOB_MAX_RETRIES,
+        cache: Optional[SimResultCache] = None,
+    ):
+        if backend not in ("stub", "matlab"):
+            raise ValueError(f"未知的仿真后端: {backend}（可选: stub / matlab）")
+        if backend == "matlab" and not os.path.isfile(matlab_exe_path):
+            raise FileNotFoundError(f"MATLAB_EXE_PATH 不存在，请检查路径: {matlab_exe_path}")
+
+        self.num_workers = max(1, int(num_workers))
+        self.backend = backend
+        self.pool_dir = pool_dir
+        self.matlab_exe_path = matlab_exe_path
+        self.matlab_work_dir = matlab_work_dir
+        self.job_timeout_s = job_timeout_s
+        self.startup_timeout_s = startup_timeout_s
+        self.heartbeat_stale_s = heartbeat_stale_s
+        self.max_retries = max_retries
+        self.cache = cache
+
+        self._queue: "queue.Queue[Optional[_SimJob]]" = queue.Queue()
+        self._workers: List[_SimWorker] = []
+        self._threads: List[threading.Thread] = []
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._started = False
+
+        # 指标
+        self._busy = 0
+        self._counters: Dict[str, int] = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "timeouts": 0,
+            "restarts": 0,
+            "retries": 0,
+            "cache_hits": 0,
+        }
+        self._queue_wait_s: List[float] = []
+        self._run_s: List[float] = []
+        self._startup_s: List[float] = []
+
+    # ---- 生命周期 ----
+
+    def start(self) -> "SimWorkerPool":
+        if self._started:
+            return self
+        os.makedirs(self.pool_dir, exist_ok=True)
+        for i in range(self.num_workers):
+            worker = _SimWorker(self, i)
+            self._start_worker(worker)
+            self._workers.append(worker)
+            t = threading.Thread(target=self._dispatch_loop, args=(worker,), daemon=True)
+            t.start()
+            self._threads.append(t)
+        self._started = True
+        print(f"[SimPool] 已启动 {self.num_workers} 个 {self.backend} worker，目录: {self.pool_dir}")
+        return self
+
+    def shutdown(self, cancel_pending: bool = True) -> None:
+        """
+        幂等：重复调用（例如 with 块里手动 shutdown 之后再走 __exit__）直接返回。
+        之后可以再次 start()，会重新拉起一组 worker。
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+            workers, self._workers = self._workers, []
+            self._started = False
+        if not threads and not workers:
+            return
+        if cancel_pending:
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None and job.future.cancel():
+                    self._bump("cancelled")
+        for _ in threads:
+            self._queue.put(None)
+        for t in threads:
+            t.join()
+        for w in workers:
+            w.stop()
+        print("[SimPool] 所有 worker 已退出。")
+
+    def __enter__(self) -> "SimWorkerPool":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.shutdown()
+
+    # ---- 提交任务 ----
+
+    def submit(
+        self,
+        round_idx: int,
+        intent_desc: str,
+        prev_policies: Dict[str, str],
+        curr_policies: Dict[str, str],
+        seed: Optional[int] = None,
+    ) -> Future:
+        """
+        提交一次 two-phase 仿真，立刻返回 Future；future.result() 即 sim_result。
+        控制 JSON 的字段与 run_matlab_two_phase_filemode 完全一致。
+        """
+        if not self._started:
+            raise SimWorkerError("SimWorkerPool 尚未 start()")
+
+        control: Dict[str, Any] = {
+            "round_idx": float(round_idx),
+            "intent_desc": intent_desc,
+            "prev_policy": prev_policies,
+            "curr_policy": curr_policies,
+        }
+        if seed is not None:
+            control["seed"] = float(seed)
+
+        fut: Future = Future()
+        self._bump("submitted")
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = make_cache_key(control, self._code_version())
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                cached["exp_id"] = f"exp_round_{round_idx}"
+                self._bump("cache_hits")
+                fut.set_result(cached)
+                return fut
+
+        job = _SimJob(
+            job_id="%06d" % next(self._ids),
+            control=control,
+            future=fut,
+            cache_key=cache_key,
+        )
+        self._queue.put(job)
+        return fut
+
+    def simulate(
+        self,
+        round_idx: int,
+        intent_desc: str,
+        prev_policies: Dict[str, str],
+        curr_policies: Dict[str, str],
+        seed: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        同步版本，签名与 run_matlab_two_phase_filemode 一致，可直接替换。
+        """
+        return self.submit(round_idx, intent_desc, prev_policies, curr_policies, seed=seed).result()
+
+    def _code_version(self) -> str:
+        if self.backend == "stub":
+            return compute_sim_code_version(os.path.dirname(os.path.abspath(__file__)), "sim_stub.py")
+        return compute_sim_code_version(self.matlab_work_dir)
+
+    # ---- 派发线程 ----
+
+    def _start_worker(self, worker: _SimWorker) -> None:
+        t0 = time.time()
+        worker.start()
+        with self._lock:
+            self._startup_s.append(time.time() - t0)
+
+    def _restart_worker(self, worker: _SimWorker, reason: str) -> None:
+        print(f"[SimPool] 重启 worker {worker.index}：{reason}")
+        worker.kill()
+        self._bump("restarts")
+        self._start_worker(worker)
+
+    def _dispatch_loop(self, worker: _SimWorker) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if not job.future.set_running_or_notify_cancel():
+                self._bump("cancelled")
+                continue
+
+            with self._lock:
+                self._busy += 1
+                self._queue_wait_s.append(time.time() - job.submitted_at)
+            try:
+                self._run_with_retries(worker, job)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def _run_with_retries(self, worker: _SimWorker, job: _SimJob) -> None:
+        while True:
+            job.attempts += 1
+            try:
+                if not worker.healthy():
+                    self._restart_worker(worker, "健康检查未通过")
+                t0 = time.time()
+                sim_result = worker.run_job(job, self.job_timeout_s)
+            except TimeoutError as e:
+                self._bump("timeouts")
+                self._bump("failed")
+                self._safe_restart(worker, "任务超时")
+                job.future.set_exception(e)
+                return
+            except SimWorkerError as e:
+                self._safe_restart(worker, str(e))
+                if job.attempts <= self.max_retries:
+                    self._bump("retries")
+                    continue
+                self._bump("failed")
+                job.future.set_exception(e)
+                return
+            except Exception as e:
+                self._bump("failed")
+                job.future.set_exception(e)
+                return
+
+            with self._lock:
+                self._run_s.append(time.time() - t0)
+                self._counters["completed"] += 1
+            if self.cache is not None and job.cache_key is not None:
+                self.cache.put(job.cache_key, sim_result)
+            job.future.set_result(sim_result)
+            return
+
+    def _safe_restart(self, worker: _SimWorker, reason: str) -> None:
+        try:
+            self._restart_worker(worker, reason)
+        except Exception as e:
+            # 重启失败时保持进程为死状态，下一个任务的健康检查会再试一次
+            print(f"[SimPool] worker {worker.index} 重启失败：{e}")
+
+    def _bump(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    # ---- 指标 ----
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            queue_wait = list(self._queue_wait_s)
+            run = list(self._run_s)
+            startup = list(self._startup_s)
+            counters = dict(self._counters)
+            busy = self._busy
+        return {
+            "backend": self.backend,
+            "workers": self.num_workers,
+            "workers_alive": sum(1 for w in self._workers if w.alive()),
+            "busy_workers": busy,
+            "queue_depth": self._queue.qsize(),
+            **counters,
+            "queue_wait_s": {
+                "p50": round(_percentile(queue_wait, 50), 3),
+                "p95": round(_percentile(queue_wait, 95), 3),
+            },
+            "run_s": {
+                "p50": round(_percentile(run, 50), 3),
+                "p95": round(_percentile(run, 95), 3),
+                "max": round(max(run), 3) if run else 0.0,
+            },
+            "startup_s_total": round(sum(startup), 3),
+        }
+
+
+# ==== Python 替身 worker（--serve 模式） ====
+
+def serve_stub_worker(mailbox: str) -> None:
+    """
+    oranSim_worker_loop.m 的 Python 版本：轮询 inbox，用 sim_stub 仿真，写结果和 .done。
+    """
+    from sim_stub import run_stub_simulation
+
+    inbox = os.path.join(mailbox, "inbox")
+    outbox = os.path.join(mailbox, "outbox")
+    os.makedirs(inbox, exist_ok=True)
+    os.makedirs(outbox, exist_ok=True)
+    heartbeat = os.path.join(mailbox, "heartbeat")
+
+    while not os.path.exists(os.path.join(mailbox, "stop")):
+        with open(heartbeat, "w") as f:
+            f.write(str(time.time()))
+
+        jobs = sorted(n for n in os.listdir(inbox) if n.startswith("job_") and n.endswith(".json"))
+        if not jobs:
+            time.sleep(_POLL_INTERVAL_S)
+            continue
+
+        name = jobs[0]
+        job_path = os.path.join(inbox, name)
+        done_path = os.path.join(outbox, os.path.splitext(name)[0] + ".done")
+        try:
+            with open(job_path, "r", encoding="utf-8") as f:
+                ctrl = json.load(f)
+            round_idx = int(ctrl["round_idx"])
+            sim_result = run_stub_simulation(
+                round_idx,
+                ctrl.get("intent_desc", ""),
+                ctrl["prev_policy"],
+                ctrl["curr_policy"],
+                seed=int(ctrl.get("seed") or 0),
+            )
+            result_path = os.path.join(ctrl["result_dir"], f"res_round_{round_idx}.json")
+            _write_json_atomic(result_path, sim_result)
+            status = {"ok": True, "result_path": result_path}
+        except Exception as e:
+            status = {"ok": False, "error": str(e)}
+        os.remove(job_path)
+        with open(heartbeat, "w") as f:
+            f.write(str(time.time()))
+        _write_json_atomic(done_path, status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="仿真 worker 池 / Python 替身 worker")
+    parser.add_argument("--serve", metavar="MAILBOX", help="以 Python 替身 worker 身份运行")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_stub_worker(args.serve)
+        return
+    parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# single_flight.py
+# 相同请求的合并（single-flight）：多个线程同时发出“规范化后完全相同”的请求时，只有第一个（leader）
+# 真正发给 Ollama，其余的（follower）等它完成后拿同一份结果；leader 抛出的异常也原样抛给所有 follower。
+# 典型场景：campaign 并发跑多个意图时的相同 prompt、多个网页用户同时问同一个常见问题、重复 chunk 的 embedding。
+#
+# - 只合并“同时在飞”的请求，不缓存结果：leader 返回后下一个相同请求会重新计算，可以和任意缓存策略叠加；
+# - 结果对象在所有调用方之间共享，调用方不要原地修改；
+# - 请求 key 用 request_key(...)：对 payload 做排序后的 JSON 序列化再取 sha256。
+#
+# 用法：
+#   sf = SingleFlight()
+#   data = sf.do(request_key("chat", base_url, payload), lambda: post(payload))
+#   print(sf.snapshot())   # calls / leaders / coalesced / errors / in_flight
+
+from typing import Any, Callable, Dict, Optional
+import hashlib
+import json
+import threading
+
+
+def request_key(*parts: Any) -> str:
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.stats = {"calls": 0, "leaders": 0, "coalesced": 0, "errors": 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.stats["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self.stats["coalesced"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.stats["leaders"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self.stats["errors"] += 1
+            raise
+        finally:
+            # 先从表里摘掉再唤醒：之后到达的相同请求会重新发起，而不是拿到已经返回的旧结果
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.stats["calls"] or 1
+            return {
+                **self.stats,
+                "in_flight": len(self._calls),
+                "coalesce_rate": round(self.stats["coalesced"] / calls, 4),
+            }
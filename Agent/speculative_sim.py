@@ -0,0 +1,185 @@
+# speculative_sim.py
+# 投机预仿真：在 summary / policy agent 思考的同时，先把“下一轮最可能被选中”的策略组合丢进仿真池。
+# policy agent 给出决策后：
+#   - 命中已完成 / 正在跑的投机任务 -> 直接用它的结果；
+#   - 没命中 -> 正常提交一次仿真；
+#   其余投机任务一律取消（排队中的直接取消，已在跑的结果仍会进缓存，不算完全浪费）。
+#
+# 候选来源（按优先级合并去重）：
+#   1) repeat：保持当前组合不变（policy agent 最常见的选择）；
+#   2) sweep：sweep_runner 产出的 KPI 表里，从当前组合切过去、按意图目标打分最高的组合；
+#   3) neighbor：只换一层策略的“邻居”组合，按意图关键字给一个静态先验。
+
+from typing import Dict, Any, List, Optional, Tuple
+from concurrent.futures import Future
+import os
+
+from policy_agent import DEFAULT_POLICY_LIBRARY
+from sim_worker_pool import SimWorkerPool
+from sweep_runner import SweepResultCache, POLICY_LAYERS
+
+
+PolicyKey = Tuple[str, str, str]
+
+
+def _policy_key(policy_ids: Dict[str, str]) -> PolicyKey:
+    return tuple(policy_ids.get(layer, "") for layer in POLICY_LAYERS)  # type: ignore[return-value]
+
+
+def _objective_score(kpi: Dict[str, Any], intent_json: Dict[str, Any]) -> float:
+    """
+    按意图目标给一组 KPI 打分（越大越好），只用于候选排序，不要求精确。
+    """
+    objective = str(intent_json.get("objective", "")).lower()
+    sum_tput = float(kpi.get("sum_tput_Mbps") or 0.0)
+    tput_5p = float(kpi.get("ue_tput_5p") or 0.0)
+    energy = float(kpi.get("estimated_energy_W") or 0.0)
+
+    if "energy" in objective:
+        return -energy + 2.0 * sum_tput
+    if "tail" in objective or "5p" in objective:
+        return 10.0 * tput_5p + 0.1 * sum_tput
+    return sum_tput + 5.0 * tput_5p
+
+
+# neighbor 候选的静态先验：意图关键字 -> 每层偏好的策略 id
+_KEYWORD_PRIORS: List[Tuple[Tuple[str, ...], Dict[str, str]]] = [
+    (("tail", "5p"), {"nearRT": "nearrt_tail_aware_v1", "beam": "beam_geometry_16"}),
+    (("energy",), {"nonRT": "nonrt_energy_simple", "nearRT": "nearrt_smallcell_bias"}),
+    (("throughput",), {"nonRT": "nonrt_throughput_v1", "nearRT": "nearrt_throughput_v1"}),
+]
+
+
+def propose_candidates(
+    last_policy_ids: Dict[str, str],
+    intent_json: Dict[str, Any],
+    k: int = 3,
+    sweep_cache_path: Optional[str] = None,
+    policy_library: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, str]]:
+    """
+    给出下一轮最可能被选中的 k 个策略组合（第一个总是“保持不变”）。
+    """
+    if policy_library is None:
+        policy_library = DEFAULT_POLICY_LIBRARY
+
+    ordered: List[Dict[str, str]] = [dict(last_policy_ids)]
+
+    # sweep KPI 表：只看“从当前组合切过去”的格子
+    if sweep_cache_path and os.path.isfile(sweep_cache_path):
+        last_key = _policy_key(last_policy_ids)
+        scored = []
+        for rec in SweepResultCache(sweep_cache_path).records.values():
+            if _policy_key(rec.get("prev_policy", {})) != last_key:
+                continue
+            scored.append((_objective_score(rec.get("kpi", {}), intent_json), rec["curr_policy"]))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        ordered.extend(dict(curr) for _, curr in scored)
+
+    # 单层邻居：按关键字先验排序
+    text = (str(intent_json.get("objective", "")) + " " + " ".join(intent_json.get("traffic_focus") or [])).lower()
+    preferred: Dict[str, str] = {}
+    for keywords, prefs in _KEYWORD_PRIORS:
+        if any(kw in text for kw in keywords):
+            for layer, pid in prefs.items():
+                preferred.setdefault(layer, pid)
+
+    neighbors = []
+    for layer in POLICY_LAYERS:
+        for p in policy_library[layer]:
+            if p["id"] == last_policy_ids.get(layer):
+                continue
+            cand = dict(last_policy_ids)
+            cand[layer] = p["id"]
+            neighbors.append((0 if preferred.get(layer) == p["id"] else 1, cand))
+    neighbors.sort(key=lambda x: x[0])
+    ordered.extend(cand for _, cand in neighbors)
+
+    out: List[Dict[str, str]] = []
+    seen = set()
+    for cand in ordered:
+        key = _policy_key(cand)
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append(cand)
+        if len(out) >= k:
+            break
+    return out
+
+
+class SpeculativeSimulator:
+    """
+    管理“某一轮”的一组投机仿真任务。用法：
+        spec.speculate(round_idx, intent_desc, prev, candidates)   # LLM 开始思考前
+        ... summary / policy agent ...
+        sim_result = spec.resolve(round_idx, intent_desc, prev, chosen).result()
+    """
+
+    def __init__(self, sim_pool: SimWorkerPool):
+        self.sim_pool = sim_pool
+        self._round_idx: Optional[int] = None
+        self._prev_key: Optional[PolicyKey] = None
+        self._inflight: Dict[PolicyKey, Future] = {}
+        self.stats: Dict[str, int] = {
+            "speculated": 0,
+            "hits": 0,
+            "misses": 0,
+            "cancelled": 0,
+            "wasted": 0,
+        }
+
+    def speculate(
+        self,
+        round_idx: int,
+        intent_desc: str,
+        prev_policies: Dict[str, str],
+        candidates: List[Dict[str, str]],
+    ) -> None:
+        self.discard()
+        self._round_idx = round_idx
+        self._prev_key = _policy_key(prev_policies)
+        for cand in candidates:
+            key = _policy_key(cand)
+            if key in self._inflight:
+                continue
+            self._inflight[key] = self.sim_pool.submit(round_idx, intent_desc, prev_policies, cand)
+            self.stats["speculated"] += 1
+        print(f"[Speculate] round {round_idx} 预先提交 {len(self._inflight)} 个候选组合")
+
+    def resolve(
+        self,
+        round_idx: int,
+        intent_desc: str,
+        prev_policies: Dict[str, str],
+        curr_policies: Dict[str, str],
+    ) -> Future:
+        """
+        返回本轮实际策略组合对应的 future；其余投机任务被取消。
+        """
+        fut = None
+        if self._round_idx == round_idx and self._prev_key == _policy_key(prev_policies):
+            fut = self._inflight.pop(_policy_key(curr_policies), None)
+
+        if fut is not None and not fut.cancelled():
+            self.stats["hits"] += 1
+            state = "已完成" if fut.done() else "仍在运行"
+            print(f"[Speculate] 命中投机任务（{state}）：{curr_policies}")
+        else:
+            self.stats["misses"] += 1
+            print(f"[Speculate] 未命中，正常提交仿真：{curr_policies}")
+            fut = self.sim_pool.submit(round_idx, intent_desc, prev_policies, curr_policies)
+
+        self.discard()
+        return fut
+
+    def discard(self) -> None:
+        for f in self._inflight.values():
+            if f.cancel():
+                self.stats["cancelled"] += 1
+            else:
+                # 已经开始跑了：结果仍会写入仿真缓存，但本轮用不上
+                self.stats["wasted"] += 1
+        self._inflight.clear()
+        self._round_idx = None
+        self._prev_key = None
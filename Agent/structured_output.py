@@ -0,0 +1,298 @@
+# structured_output.py
+# 结构化输出：JSON 提取 + 轻量 JSON-schema 校验 + 一次定向修复调用。
+#
+# 配合 OllamaChatModel.chat(format=schema) 使用：
+# - Ollama 的 format 参数已经能把大部分回复约束成合法 JSON；
+# - 这里再按 schema 校验字段 / 类型 / 枚举（例如策略 id 必须在策略库里）；
+# - 校验失败时只追加一次“修复”请求，把具体错误告诉模型，而不是整轮重跑。
+# - stream=True 时流式接收回复，增量扫描到第一个完整的顶层 JSON 对象就中止生成，
+#   决策延迟只取决于 JSON 本身的长度，而不是模型在 JSON 之后还想说多少。
+
+from typing import Any, Callable, Dict, List, Optional
+import json
+import threading
+
+from chat_session import ChatSession
+from ollama_client import Message
+
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def extract_json_block(text: str) -> str:
+    """
+    从模型回复中粗暴提取第一个 {...} JSON 块。
+    """
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end == -1 or end <= start:
+        raise ValueError("No JSON object found in text")
+    return text[start : end + 1]
+
+
+def _type_ok(value: Any, expected: str) -> bool:
+    if expected == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if expected == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    py_type = _JSON_TYPES.get(expected)
+    return py_type is None or isinstance(value, py_type)
+
+
+def validate_json(data: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """
+    只实现我们用到的 JSON-schema 子集：type / properties / required / enum / items。
+    返回错误列表（空列表表示通过）。
+    """
+    errors: List[str] = []
+
+    expected = schema.get("type")
+    if expected is not None:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_type_ok(data, t) for t in types):
+            errors.append(f"{path}: 期望类型 {expected}，实际为 {type(data).__name__}")
+            return errors
+
+    if "enum" in schema and data not in schema["enum"]:
+        errors.append(f"{path}: 取值 {data!r} 不在允许范围 {schema['enum']} 内")
+
+    if isinstance(data, dict):
+        for key in schema.get("required", []):
+            if key not in data:
+                errors.append(f"{path}: 缺少必填字段 {key}")
+        for key, sub in (schema.get("properties") or {}).items():
+            if key in data:
+                errors.extend(validate_json(data[key], sub, f"{path}.{key}"))
+
+    if isinstance(data, list) and "items" in schema:
+        for i, item in enumerate(data):
+            errors.extend(validate_json(item, schema["items"], f"{path}[{i}]"))
+
+    return errors
+
+
+def parse_and_validate(
+    text: str,
+    schema: Dict[str, Any],
+    extra_check: Optional[Callable[[Dict[str, Any]], List[str]]] = None,
+) -> Dict[str, Any]:
+    """
+    提取 + 解析 + 校验；任何一步失败都抛 ValueError，错误信息可以直接喂给修复请求。
+    """
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        # 回复前后夹带了说明文字：从第一个 { 开始解码一个完整对象，忽略其后的内容
+        start = text.find("{")
+        if start == -1:
+            raise ValueError("No JSON object found in text")
+        try:
+            data, _ = json.JSONDecoder().raw_decode(text, start)
+        except json.JSONDecodeError:
+            data = json.loads(extract_json_block(text))
+    errors = validate_json(data, schema)
+    if extra_check is not None and not errors:
+        errors = extra_check(data)
+    if errors:
+        raise ValueError("; ".join(errors))
+    return data
+
+
+class JsonStreamScanner:
+    """
+    增量 JSON 扫描器：逐段 feed 模型输出，跟踪花括号深度，并正确跳过字符串里的
+    括号和转义字符。第一个顶层 {...} 闭合时 feed 返回 True，object_text 即该对象。
+    对象之前的说明文字会被忽略。
+    """
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._len = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    @property
+    def object_text(self) -> str:
+        if self.start is None:
+            return ""
+        return self.text[self.start : self.end]
+
+    def feed(self, delta: str) -> bool:
+        if self.complete:
+            return True
+        # 只扫描新到的这一段，避免每次 feed 都重新拼接 / 扫描整段文本
+        base = self._len
+        self._parts.append(delta)
+        self._len += len(delta)
+        for j, ch in enumerate(delta):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if self.start is None:
+                if ch == "{":
+                    self.start = base + j
+                    self._depth = 1
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = base + j + 1
+                    return True
+        return False
+
+
+class StreamSavings:
+    """
+    流式提前结束的统计：已接收的 token 数、被中止的次数，以及估计节省的 token 数。
+    节省量按“自然结束的流式回复的平均长度 - 中止时已接收的长度”估计；
+    还没有自然结束的样本时只统计次数，不给估计值。
+    线程安全：campaign 并发跑多个意图、对冲 / 多实例客户端都会从多个线程调用 record。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.aborted = 0
+        self.tokens_received = 0
+        self.tokens_saved_est = 0
+        self._full_lengths: List[int] = []
+
+    def _mean_full_length(self) -> Optional[float]:
+        # 调用方持有 _lock
+        if not self._full_lengths:
+            return None
+        return sum(self._full_lengths) / len(self._full_lengths)
+
+    def record(self, stats: Dict[str, Any]) -> Optional[int]:
+        """
+        记录一次流式调用，返回本次估计节省的 token 数（无法估计时为 None）。
+        """
+        received = int(stats.get("chunks") or 0)
+        with self._lock:
+            self.calls += 1
+            self.tokens_received += received
+            if not stats.get("aborted"):
+                self._full_lengths.append(int(stats.get("eval_count") or received))
+                return 0
+            self.aborted += 1
+            mean = self._mean_full_length()
+            if mean is None:
+                return None
+            saved = max(0, int(round(mean)) - received)
+            self.tokens_saved_est += saved
+            return saved
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "aborted": self.aborted,
+                "tokens_received": self.tokens_received,
+                "tokens_saved_est": self.tokens_saved_est,
+            }
+
+
+STREAM_SAVINGS = StreamSavings()
+
+
+def _ask_streaming(session: ChatSession, user_prompt: str, fmt, **ask_kwargs) -> str:
+    """
+    流式发出请求，拿到完整的顶层 JSON 对象后立即中止，并把 history 里那条回复
+    截成对象本身（去掉对象前后的说明文字）。
+    """
+    scanner = JsonStreamScanner()
+    reply = session.ask(user_prompt, format=fmt, stop_when=scanner.feed, **ask_kwargs)
+    stats = session.last_stream_stats
+    saved = STREAM_SAVINGS.record(stats)
+    if stats.get("aborted"):
+        saved_text = "未知（暂无完整回复样本）" if saved is None else f"~{saved}"
+        print(
+            f"[Structured] JSON 已完整，提前结束生成：已接收 {stats.get('chunks', 0)} tokens，"
+            f"估计节省 {saved_text} tokens"
+        )
+
+    if scanner.complete:
+        reply = scanner.object_text
+        if session.history and session.history[-1].role == "assistant":
+            session.history[-1] = Message(role="assistant", content=reply)
+    return reply
+
+
+REPAIR_PROMPT = (
+    "你上一条回复不是符合要求的 JSON，问题如下：\n{errors}\n\n"
+    "请只输出修正后的完整 JSON 对象，不要输出任何其它内容。"
+)
+
+
+def ask_structured(
+    session: ChatSession,
+    user_prompt: str,
+    schema: Dict[str, Any],
+    extra_check: Optional[Callable[[Dict[str, Any]], List[str]]] = None,
+    use_schema: bool = True,
+    stream: bool = False,
+    retrieval_query: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    用 session.ask 发出请求（use_schema=True 时带 format=schema），解析并校验回复。
+    retrieval_query 不为 None 时传给 RAG 会话作为检索 query（不用整段 user_prompt 检索）。
+    stream=True 时流式接收，第一个顶层 JSON 对象闭合后立即中止生成。
+    失败时做一次定向修复：把错误列表发回给模型（同样带 format），成功后用修复结果
+    替换 history 里那条坏回复，保证后续轮次看到的是干净的 JSON。
+    修复后仍然失败则抛 ValueError。
+    """
+    fmt = schema if use_schema else None
+    # 普通 ChatSession.ask 没有 retrieval_query 参数，只在需要时才传
+    ask_kwargs = {} if retrieval_query is None else {"retrieval_query": retrieval_query}
+    if stream:
+        reply = _ask_streaming(session, user_prompt, fmt, **ask_kwargs)
+    else:
+        reply = session.ask(user_prompt, format=fmt, **ask_kwargs)
+    try:
+        return parse_and_validate(reply, schema, extra_check)
+    except ValueError as e:
+        first_error = str(e)
+
+    print(f"[Structured] 回复校验失败，发起一次修复请求：{first_error}")
+    repair_messages = list(session.history) + [
+        Message(role="user", content=REPAIR_PROMPT.format(errors=first_error)),
+    ]
+    repaired = session.model.chat(
+        repair_messages, format=fmt, label=session.label, affinity_key=session.affinity_key
+    ).content
+    try:
+        data = parse_and_validate(repaired, schema, extra_check)
+    except ValueError as e:
+        raise ValueError(f"结构化输出修复失败：{e}（首次错误：{first_error}）") from e
+
+    if session.history and session.history[-1].role == "assistant":
+        session.history[-1] = Message(
+            role="assistant", content=json.dumps(data, ensure_ascii=False)
+        )
+    return data
@@ -0,0 +1,359 @@
+# sweep_runner.py
+# 策略组合 sweep：在进程池里并行评估 (prev_policy, curr_policy, seed) 网格，
+# 结果写入按 key 索引的 JSONL 缓存，重复的格子不会被重新仿真，中断后可以续跑。
+#
+# 用法示例：
+#   python sweep_runner.py --backend stub --workers 8 --seeds 0 1 2
+#   python sweep_runner.py --backend matlab --workers 2 --cache D:/oran_logs/sweep_results.jsonl
+
+from typing import Dict, Any, List, Optional, Callable, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+import argparse
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+
+from policy_agent import DEFAULT_POLICY_LIBRARY
+
+
+# ==== 配置 ====
+
+SWEEP_CACHE_PATH = r"D:/oran_logs/sweep_results.jsonl"
+SWEEP_WORKERS = 4
+
+# sweep 里每个格子都要一个独立的 round_idx（Matlab 侧按 round_idx 命名控制 / 结果文件）。
+# 每次 sweep 先在 SWEEP_SLOT_DIR 下原子地占一个槽位（mkdir slot_<n>），
+# round_idx = SWEEP_ROUND_OFFSET + 槽位 * SWEEP_ROUND_STRIDE + 格子序号：
+# 并发的多个 sweep（包括不同进程）各用一段，不会互相覆盖 control_round_* / res_round_*，
+# 也避开闭环实验的 round 0/1/2 和 campaign（CAMPAIGN_ROUND_OFFSET=20000 起）。
+# round_idx 仍然是整数（Matlab 侧用 double），所以“前缀”编码在数值的高位里。
+SWEEP_ROUND_OFFSET = 1000000
+SWEEP_ROUND_STRIDE = 100000
+SWEEP_MAX_SLOTS = 1000
+SWEEP_SLOT_DIR = r"D:/oran_logs/sweep_slots"
+
+BASELINE_POLICY_IDS: Dict[str, str] = {
+    "nonRT": "nonrt_baseline",
+    "nearRT": "nearrt_macro_only",
+    "beam": "beam_default",
+}
+
+POLICY_LAYERS = ("nonRT", "nearRT", "beam")
+
+
+# ==== 网格定义 ====
+
+@dataclass(frozen=True)
+class SweepCell:
+    prev_policy: Tuple[str, str, str]   # (nonRT, nearRT, beam)
+    curr_policy: Tuple[str, str, str]
+    seed: int
+
+    @property
+    def key(self) -> str:
+        return "|".join(
+            [",".join(self.prev_policy), ",".join(self.curr_policy), str(self.seed)]
+        )
+
+    def prev_dict(self) -> Dict[str, str]:
+        return dict(zip(POLICY_LAYERS, self.prev_policy))
+
+    def curr_dict(self) -> Dict[str, str]:
+        return dict(zip(POLICY_LAYERS, self.curr_policy))
+
+
+def _as_tuple(policy_ids: Dict[str, str]) -> Tuple[str, str, str]:
+    return tuple(policy_ids[layer] for layer in POLICY_LAYERS)  # type: ignore[return-value]
+
+
+def all_policy_combinations(policy_library: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
+    """
+    策略库中所有 nonRT × nearRT × beam 组合（默认库为 4 × 4 × 4 = 64 种）。
+    """
+    if policy_library is None:
+        policy_library = DEFAULT_POLICY_LIBRARY
+    ids_per_layer = [[p["id"] for p in policy_library[layer]] for layer in POLICY_LAYERS]
+    return [dict(zip(POLICY_LAYERS, combo)) for combo in itertools.product(*ids_per_layer)]
+
+
+def build_sweep_grid(
+    curr_policies: List[Dict[str, str]],
+    prev_policies: Optional[List[Dict[str, str]]] = None,
+    seeds: Optional[List[int]] = None,
+) -> List[SweepCell]:
+    """
+    构造 (prev, curr, seed) 网格。
+    - prev_policies 默认只有基线组合（相当于“从基线切到 curr”）；
+    - seeds 默认 [0]。
+    """
+    if prev_policies is None:
+        prev_policies = [BASELINE_POLICY_IDS]
+    if seeds is None:
+        seeds = [0]
+
+    cells = []
+    for prev, curr, seed in itertools.product(prev_policies, curr_policies, seeds):
+        cells.append(SweepCell(_as_tuple(prev), _as_tuple(curr), int(seed)))
+    return cells
+
+
+# ==== 仿真后端（可插拔） ====
+
+def _run_stub_backend(round_idx, intent_desc, prev_policies, curr_policies, seed):
+    from sim_stub import run_stub_simulation
+    return run_stub_simulation(round_idx, intent_desc, prev_policies, curr_policies, seed=seed)
+
+
+def _run_matlab_backend(round_idx, intent_desc, prev_policies, curr_policies, seed):
+    from main_oran_agents_matlab_nometa import run_matlab_two_phase_filemode
+    return run_matlab_two_phase_filemode(
+        round_idx=round_idx,
+        intent_desc=intent_desc,
+        prev_policies=prev_policies,
+        curr_policies=curr_policies,
+        seed=seed,
+    )
+
+
+# 后端按名字注册：进程池里只传名字，子进程自己查表，避免 pickle 闭包的问题
+SIM_BACKENDS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    "stub": _run_stub_backend,
+    "matlab": _run_matlab_backend,
+}
+
+
+def _simulate_cell(backend: str, round_idx: int, intent_desc: str, cell: SweepCell) -> Dict[str, Any]:
+    """
+    在子进程中执行：跑一个格子，返回可以直接写入缓存的记录。
+    """
+    fn = SIM_BACKENDS[backend]
+    t0 = time.time()
+    sim_result = fn(round_idx, intent_desc, cell.prev_dict(), cell.curr_dict(), cell.seed)
+    return {
+        "key": cell.key,
+        "backend": backend,
+        "prev_policy": cell.prev_dict(),
+        "curr_policy": cell.curr_dict(),
+        "seed": cell.seed,
+        "kpi": sim_result.get("kpi", {}),
+        "cells": sim_result.get("cells", []),
+        "elapsed_s": round(time.time() - t0, 3),
+    }
+
+
+# ==== 结果缓存（JSONL，按 key 索引） ====
+
+class SweepResultCache:
+    """
+    一行一个格子的结果；启动时全量读入内存建立 key -> record 索引。
+    - 同一个 key 只会被仿真一次；
+    - 每完成一个格子就追加写一行，进程被杀掉也只丢正在跑的格子，下次自动续跑。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    # 上次被打断时可能写了半行，跳过即可
+                    continue
+                if rec.get("key"):
+                    self.records[rec["key"]] = rec
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.records.get(key)
+
+    def put(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self.records[record["key"]] = record
+            parent = os.path.dirname(self.path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+# ==== sweep 槽位（并发 sweep 之间隔离 round_idx） ====
+
+def claim_sweep_slot(slot_dir: str = SWEEP_SLOT_DIR) -> int:
+    """
+    占一个空闲槽位并返回其编号；os.mkdir 是原子的，多个进程同时 claim 也只有一个能拿到同一个槽位。
+    进程被杀掉时槽位目录会残留，之后的 sweep 会跳过它（手动清空 slot_dir 即可回收）。
+    """
+    os.makedirs(slot_dir, exist_ok=True)
+    for slot in range(SWEEP_MAX_SLOTS):
+        path = os.path.join(slot_dir, f"slot_{slot}")
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            continue
+        with open(os.path.join(path, "owner.json"), "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "started_at": time.time()}, f)
+        return slot
+    raise RuntimeError(f"sweep 槽位已用完（{SWEEP_MAX_SLOTS} 个），请清理残留目录: {slot_dir}")
+
+
+def release_sweep_slot(slot: int, slot_dir: str = SWEEP_SLOT_DIR) -> None:
+    shutil.rmtree(os.path.join(slot_dir, f"slot_{slot}"), ignore_errors=True)
+
+
+# ==== sweep 主逻辑 ====
+
+def run_sweep(
+    cells: List[SweepCell],
+    backend: str = "stub",
+    workers: int = SWEEP_WORKERS,
+    cache_path: str = SWEEP_CACHE_PATH,
+    intent_desc: str = "",
+    progress: Optional[Callable[[str], None]] = print,
+    slot_dir: str = SWEEP_SLOT_DIR,
+) -> List[Dict[str, Any]]:
+    """
+    并行评估一组格子，返回与 cells 一一对应的结果记录（失败的格子为 None）。
+
+    - 已在缓存中的格子直接复用，不提交到进程池；
+    - 失败的格子不会写入缓存，下次运行会重新尝试；
+    - 有格子要仿真时先在 slot_dir 占一个槽位，本次 sweep 的 round_idx 都落在该槽位的区间里，
+      结果记录带上 sweep_id（sweep_<槽位>）和 round_idx，方便对回 Matlab 的结果文件。
+    """
+    if backend not in SIM_BACKENDS:
+        raise ValueError(f"未知的仿真后端: {backend}（可选: {list(SIM_BACKENDS)}）")
+    if len(cells) > SWEEP_ROUND_STRIDE:
+        raise ValueError(f"单次 sweep 最多 {SWEEP_ROUND_STRIDE} 个格子，当前 {len(cells)} 个，请拆分")
+
+    cache = SweepResultCache(cache_path)
+    results: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    pending: List[Tuple[int, SweepCell]] = []
+    seen = set()
+    for idx, cell in enumerate(cells):
+        hit = cache.get(cell.key)
+        if hit is not None:
+            results[cell.key] = hit
+        elif cell.key not in seen:
+            seen.add(cell.key)
+            pending.append((idx, cell))
+
+    total = len(set(c.key for c in cells))
+    cached = total - len(pending)
+    done = cached
+    failed = 0
+
+    def _report(msg: str) -> None:
+        if progress is not None:
+            progress(msg)
+
+    _report(f"[Sweep] 共 {total} 个格子，缓存命中 {cached} 个，待仿真 {len(pending)} 个（backend={backend}, workers={workers}）")
+
+    t_start = time.time()
+    if pending:
+        slot = claim_sweep_slot(slot_dir)
+        sweep_id = f"sweep_{slot}"
+        round_base = SWEEP_ROUND_OFFSET + slot * SWEEP_ROUND_STRIDE
+        _report(f"[Sweep] {sweep_id}：round_idx {round_base} ~ {round_base + len(cells) - 1}")
+        try:
+            with ProcessPoolExecutor(max_workers=max(1, int(workers))) as pool:
+                futures = {
+                    pool.submit(_simulate_cell, backend, round_base + idx, intent_desc, cell): (idx, cell)
+                    for idx, cell in pending
+                }
+                for fut in as_completed(futures):
+                    idx, cell = futures[fut]
+                    try:
+                        rec = fut.result()
+                    except Exception as e:
+                        failed += 1
+                        results[cell.key] = None
+                        _report(f"[Sweep] 格子失败 {cell.key}: {e}")
+                    else:
+                        rec["sweep_id"] = sweep_id
+                        rec["round_idx"] = round_base + idx
+                        cache.put(rec)
+                        results[cell.key] = rec
+                    done += 1
+
+                    finished_new = done - cached
+                    elapsed = time.time() - t_start
+                    eta = elapsed / finished_new * (total - done) if finished_new else 0.0
+                    _report(f"[Sweep] {done}/{total} 完成（失败 {failed}），已用 {elapsed:.1f}s，预计剩余 {eta:.1f}s")
+        finally:
+            release_sweep_slot(slot, slot_dir)
+
+    return [results.get(c.key) for c in cells]
+
+
+def format_kpi_table(records: List[Optional[Dict[str, Any]]]) -> str:
+    """
+    把 sweep 结果整理成一张按 5% UE 吞吐降序排列的文本 KPI 表。
+    """
+    rows = [r for r in records if r]
+    rows.sort(key=lambda r: (r.get("kpi", {}).get("ue_tput_5p") or 0.0), reverse=True)
+
+    header = "%-22s %-24s %-18s %5s %10s %10s %10s %7s" % (
+        "nonRT", "nearRT", "beam", "seed", "sum_Mbps", "5p_Mbps", "energy_W", "sleep",
+    )
+    lines = [header, "-" * len(header)]
+    for r in rows:
+        curr = r["curr_policy"]
+        kpi = r.get("kpi", {})
+        lines.append("%-22s %-24s %-18s %5d %10.2f %10.3f %10.1f %7.2f" % (
+            curr["nonRT"], curr["nearRT"], curr["beam"], r["seed"],
+            kpi.get("sum_tput_Mbps") or 0.0,
+            kpi.get("ue_tput_5p") or 0.0,
+            kpi.get("estimated_energy_W") or 0.0,
+            kpi.get("sleep_ratio_small_cells") or 0.0,
+        ))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并行 sweep 策略库中的所有策略组合")
+    parser.add_argument("--backend", default="stub", choices=sorted(SIM_BACKENDS))
+    parser.add_argument("--workers", type=int, default=SWEEP_WORKERS)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--cache", default=SWEEP_CACHE_PATH)
+    parser.add_argument("--slot-dir", default=SWEEP_SLOT_DIR, help="并发 sweep 共用的槽位目录")
+    parser.add_argument("--intent", default="", help="写入仿真结果的 intent_desc")
+    parser.add_argument(
+        "--all-prev",
+        action="store_true",
+        help="prev 也取遍所有组合（默认只从基线组合切换过去）",
+    )
+    args = parser.parse_args()
+
+    combos = all_policy_combinations()
+    cells = build_sweep_grid(
+        curr_policies=combos,
+        prev_policies=combos if args.all_prev else None,
+        seeds=args.seeds,
+    )
+    records = run_sweep(
+        cells,
+        backend=args.backend,
+        workers=args.workers,
+        cache_path=args.cache,
+        intent_desc=args.intent,
+        slot_dir=args.slot_dir,
+    )
+    print()
+    print(format_kpi_table(records))
+
+
+if __name__ == "__main__":
+    main()
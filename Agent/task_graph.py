@@ -0,0 +1,126 @@
+# task_graph.py
+# 极简任务依赖图：把闭环里的各个阶段（意图翻译 / 仿真 / 总结 / 策略选择 / 投机预仿真）表示成 DAG，
+# 没有依赖关系的节点并发执行，跑完后打印关键路径，方便看清楚每一轮时间到底花在哪。
+#
+# 用法：
+#   g = TaskGraph("round_0")
+#   g.add("translate_intent", lambda r: translate_intent(...))
+#   g.add("simulate", lambda r: run_simulation_round(...))
+#   g.add("summarize", lambda r: summarize_simulation(sim_agent, r["simulate"]), deps=["simulate"])
+#   results = g.run()
+#   g.log_critical_path()
+
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+import time
+
+
+@dataclass
+class TaskNode:
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]
+    deps: List[str] = field(default_factory=list)
+    start: Optional[float] = None
+    end: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+
+class TaskGraph:
+    """
+    - 每个节点的 fn 接收一个 dict：{依赖节点名: 依赖节点的返回值}；
+    - run() 返回 {节点名: 返回值}；任一节点抛异常时，不再启动新节点，等已启动的跑完后抛出该异常；
+    - 关键路径：从最后结束的节点开始，沿“最晚结束的那个依赖”一路往回找。
+    """
+
+    def __init__(self, name: str, max_workers: int = 4):
+        self.name = name
+        self.max_workers = max_workers
+        self.nodes: Dict[str, TaskNode] = {}
+        self.results: Dict[str, Any] = {}
+        self.t0: Optional[float] = None
+        self.t1: Optional[float] = None
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[[Dict[str, Any]], Any],
+        deps: Sequence[str] = (),
+    ) -> "TaskGraph":
+        if name in self.nodes:
+            raise ValueError(f"重复的任务名: {name}")
+        for d in deps:
+            if d not in self.nodes:
+                raise ValueError(f"任务 {name} 依赖的 {d} 尚未定义（请按拓扑顺序 add）")
+        self.nodes[name] = TaskNode(name=name, fn=fn, deps=list(deps))
+        return self
+
+    def _run_node(self, node: TaskNode) -> Any:
+        node.start = time.time()
+        try:
+            return node.fn({d: self.results[d] for d in node.deps})
+        finally:
+            node.end = time.time()
+
+    def run(self) -> Dict[str, Any]:
+        self.t0 = time.time()
+        pending = dict(self.nodes)
+        running = {}
+        error: Optional[BaseException] = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                if error is None:
+                    ready = [n for n in pending.values() if all(d in self.results for d in n.deps)]
+                    for node in ready:
+                        del pending[node.name]
+                        running[pool.submit(self._run_node, node)] = node
+                if not running:
+                    break
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    node = running.pop(fut)
+                    try:
+                        self.results[node.name] = fut.result()
+                    except BaseException as e:
+                        if error is None:
+                            error = e
+
+        self.t1 = time.time()
+        if error is not None:
+            raise error
+        return self.results
+
+    # ==== 关键路径 ====
+
+    def critical_path(self) -> List[TaskNode]:
+        finished = [n for n in self.nodes.values() if n.end is not None]
+        if not finished:
+            return []
+        node = max(finished, key=lambda n: n.end)
+        path = [node]
+        while node.deps:
+            node = max((self.nodes[d] for d in node.deps), key=lambda n: n.end or 0.0)
+            path.append(node)
+        path.reverse()
+        return path
+
+    def format_critical_path(self) -> str:
+        path = self.critical_path()
+        if not path or self.t0 is None or self.t1 is None:
+            return f"[TaskGraph {self.name}] 尚未运行"
+        chain = " -> ".join(f"{n.name} {n.duration:.1f}s" for n in path)
+        serial = sum(n.duration for n in self.nodes.values())
+        return (
+            f"[TaskGraph {self.name}] 关键路径: {chain}；"
+            f"墙钟 {self.t1 - self.t0:.1f}s，串行合计 {serial:.1f}s"
+        )
+
+    def log_critical_path(self) -> None:
+        print(self.format_critical_path())
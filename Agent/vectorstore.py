@@ -1,8 +1,85 @@
 # vectorstore.py
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 import requests
 import math
+import threading
+
+from single_flight import SingleFlight, request_key
+
+
+# 进程内所有 SimpleVectorStore 共享：同时在飞的相同 embedding 请求只发一次（见 single_flight.py）
+EMBED_SINGLE_FLIGHT = SingleFlight()
+
+# embed_model 取这个名字（或 "local-tfidf:<dim>"）时用本地 CPU 向量化，不访问 embedding 服务
+LOCAL_EMBED_MODEL = "local-tfidf"
+
+
+def is_local_embed_model(name: str) -> bool:
+    return name.split(":", 1)[0] == LOCAL_EMBED_MODEL
+
+
+def normalize_filter(filter: Optional[Union[str, Iterable[str]]]) -> Optional[Tuple[str, ...]]:
+    """
+    检索过滤条件 -> 排序去重后的标签元组（命中任意一个标签即可）；None / 空表示不过滤。
+    """
+    if filter is None:
+        return None
+    tags = [filter] if isinstance(filter, str) else list(filter)
+    tags = sorted({t.strip().lower() for t in tags if t and t.strip()})
+    return tuple(tags) or None
+
+
+def doc_tags(doc: "Document") -> List[str]:
+    return list((doc.metadata or {}).get("tags") or [])
+
+
+def normalize_query(text: str) -> str:
+    """
+    查询缓存的 key：小写 + 合并空白。
+    """
+    return " ".join(text.lower().split())
+
+
+class QueryCache:
+    """
+    检索 query 的 LRU 缓存：key 为 (索引版本, 归一化后的 query)，值为 query 向量和各个 (过滤条件, k) 的检索结果（文档下标）。
+    索引版本 = 已建索引的文档数，加入新文档后旧条目自然不再命中。线程安全。
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "vector_hits": 0, "misses": 0}
+
+    def get(self, key: Tuple[int, str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Tuple[int, str], entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(self.stats.values()) or 1
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "hit_rate": round((self.stats["hits"] + self.stats["vector_hits"]) / total, 4),
+            }
 
 
 @dataclass
@@ -14,16 +91,16 @@ class Document:
 
 class SimpleVectorStore:
     """
-    一个极简的“向量库”实现。
+    一个极简的“向量库”实现，三种模式：
 
-    当前模式（根据你的需求）：
-    - docs: 直接保存从 txt 切出来的 chunks；
-    - embeddings: 可以为空，不强制使用；
-    - similarity_search(): 不做 embedding / 相似度计算，直接返回前 k 个文档。
+    - embed_model="local-tfidf"（或 "local-tfidf:<dim>"）：本地 CPU 哈希 TF-IDF 向量化（见 local_embedder.py），
+      add_documents 批量建索引，检索完全离线，不访问 /api/embed；
+    - 其它 embed_model：add_documents 对每个文档调用 Ollama /api/embed，检索时对 query 也做一次 embedding；
+    - 直接给 vs.docs 赋值、不建索引：similarity_search 直接返回前 k 个文档（旧行为）。
 
-    这样：
-    - 所有 RAGChatSession 仍然能拿到知识库文本作为上下文；
-    - 完全不会调用 /api/embed，不会再出现 500。
+    文档可以带标签（metadata["tags"]，由 kb_loader 按目录 / 文件名 / front-matter 生成）。
+    similarity_search(filter=...) 只在带这些标签（任意一个）的文档里检索：
+    每个标签的文档下标在加入文档时就记录好，本地索引还会缓存每种过滤条件的子矩阵，先过滤再打分。
     """
 
     def __init__(
@@ -31,24 +108,56 @@ class SimpleVectorStore:
         embed_model: str = "nomic-embed-text",
         base_url: str = "http://127.0.0.1:11434",
         timeout: float = 30.0,
+        backends: Optional[Any] = None,
+        query_cache_size: int = 256,
     ) -> None:
         self.embed_model = embed_model
         self.base_url = base_url.rstrip("/")
         self.timeout = timeout
+        # backend_pool.BackendPool：多个 Ollama 实例时 embedding 请求也分摊到各实例
+        self.backends = backends
 
         # 文本与向量
         self.docs: List[Document] = []
         self.embeddings: List[List[float]] = []
 
-    # ==== 下面这两个函数暂时不会用到，但保留以防以后要恢复“真 RAG” ====
+        # 相邻轮次的检索 query 几乎相同：缓存 query 向量和检索结果
+        self.query_cache = QueryCache(query_cache_size)
+
+        # 标签分区：标签 -> 文档下标（升序）；_tagged 之前的文档都已登记
+        self._tag_rows: Dict[str, List[int]] = {}
+        self._tagged = 0
+        # 过滤条件 -> (登记时的文档数, 文档下标)；本地索引里同名分区已 set_partition
+        self._partitions: Dict[Tuple[str, ...], Tuple[int, List[int]]] = {}
+        self._tag_lock = threading.Lock()
+
+        # 本地向量化时的索引（按需导入，只有用到时才需要 numpy）
+        self._local = None
+        if is_local_embed_model(embed_model):
+            from local_embedder import LocalTfidfIndex, embedder_from_model_name
+            self._local = LocalTfidfIndex(embedder_from_model_name(embed_model))
+
+    # ==== Ollama embedding ====
 
     def _embed(self, text: str) -> List[float]:
         """
-        嵌入接口（当前模式不会被调用，只是保留以备将来需要）。
-
-        支持 /api/embed 和旧版 /api/embeddings，两种都尝试。
+        通过 Ollama 做 embedding，支持 /api/embed 和旧版 /api/embeddings，两种都尝试。
+        同时在飞的相同文本（同一模型 / 服务）只请求一次。
         """
-        url = f"{self.base_url}/api/embed"
+        target = self.base_url if self.backends is None else [b.url for b in self.backends.backends]
+        return EMBED_SINGLE_FLIGHT.do(
+            request_key("embed", target, self.embed_model, text),
+            lambda: self._embed_once(text),
+        )
+
+    def _embed_once(self, text: str) -> List[float]:
+        if self.backends is not None:
+            with self.backends.lease() as backend:
+                return self._embed_at(backend.url, text)
+        return self._embed_at(self.base_url, text)
+
+    def _embed_at(self, base_url: str, text: str) -> List[float]:
+        url = f"{base_url}/api/embed"
         payload = {"model": self.embed_model, "input": text}
 
         resp = requests.post(url, json=payload, timeout=self.timeout)
@@ -57,7 +166,7 @@ class SimpleVectorStore:
         except requests.HTTPError as e:
             # 如果是 404，尝试旧版 embeddings 接口
             if resp.status_code == 404:
-                url2 = f"{self.base_url}/api/embeddings"
+                url2 = f"{base_url}/api/embeddings"
                 payload2 = {"model": self.embed_model, "prompt": text}
                 resp2 = requests.post(url2, json=payload2, timeout=self.timeout)
                 resp2.raise_for_status()
@@ -100,30 +209,124 @@ class SimpleVectorStore:
 
     def add_documents(self, docs: List[Document]) -> None:
         """
-        旧模式：会对每个文档做 embedding 再存。
-
-        当前工程里我们 **不会调用这个函数**（build_vector_store 会直接赋值 docs），
-        保留只是为了以后如果你想恢复“真向量检索”时方便。
+        加入文档并建索引：本地模式整批向量化；Ollama 模式对每个文档做一次 embedding。
         """
+        if self._local is not None:
+            self._local.add([d.text for d in docs])
+            self.docs.extend(docs)
+            return
         for d in docs:
             emb = self._embed(d.text)
             self.docs.append(d)
             self.embeddings.append(emb)
 
-    # ==== 检索接口（核心修改点） ====
+    # ==== 标签分区 ====
+
+    def _index_tags(self) -> int:
+        # 调用方持有 _tag_lock：补登记新加入（或直接赋值）的文档的标签，返回当前文档数
+        n = len(self.docs)
+        if n < self._tagged:
+            # docs 被整体替换过：从头重新登记
+            self._tag_rows.clear()
+            self._partitions.clear()
+            self._tagged = 0
+        for i in range(self._tagged, n):
+            for tag in {t.lower() for t in doc_tags(self.docs[i])}:
+                self._tag_rows.setdefault(tag.lower(), []).append(i)
+        self._tagged = n
+        return n
+
+    def _rows_for(self, tags: Tuple[str, ...]) -> List[int]:
+        """
+        带任意一个 tags 标签的文档下标（升序），按文档数缓存。
+        """
+        with self._tag_lock:
+            n = self._index_tags()
+            cached = self._partitions.get(tags)
+            if cached is not None and cached[0] == n:
+                return cached[1]
+            if len(tags) == 1:
+                rows = list(self._tag_rows.get(tags[0], []))
+            else:
+                rows = sorted({i for t in tags for i in self._tag_rows.get(t, [])})
+            self._partitions[tags] = (n, rows)
+            if self._local is not None:
+                self._local.set_partition("|".join(tags), rows)
+            return rows
 
-    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+    def has_tags(self, filter: Optional[Union[str, Iterable[str]]]) -> bool:
         """
-        当前模式：不做任何 embedding / 相似度计算，直接返回前 k 个文档。
+        是否有文档带 filter 中的任意一个标签（filter 为空时恒为 True）。
+        """
+        tags = normalize_filter(filter)
+        return tags is None or bool(self._rows_for(tags))
+
+    def tag_counts(self) -> Dict[str, int]:
+        with self._tag_lock:
+            self._index_tags()
+            return {t: len(rows) for t, rows in sorted(self._tag_rows.items())}
+
+    # ==== 检索接口 ====
 
-        因为：
-        - 你现在知识库里只有一个 txt（被切成若干 chunks）；
-        - 这些文档对所有 agent 都有用；
-        - 做“检索 + embedding”没啥意义，还容易触发 /api/embed 500。
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Union[str, Iterable[str]]] = None,
+    ) -> List[Document]:
+        """
+        返回与 query 最相似的 k 个文档。
+        filter：标签或标签列表，只在带其中任意一个标签的文档里检索（没有匹配的文档时返回空列表）。
+        相同（归一化后）的 query 命中 LRU 缓存时不再做 embedding / 打分。
+        没有建索引（直接给 docs 赋值）时返回前 k 个；Ollama embedding 失败时也退化为前 k 个。
         """
         if not self.docs:
             return []
 
+        tags = normalize_filter(filter)
+        rows = None if tags is None else self._rows_for(tags)
+        candidates = range(len(self.docs)) if rows is None else rows
+        if not candidates:
+            return []
+
         k = max(1, int(k))
-        k = min(k, len(self.docs))
-        return self.docs[:k]
+        k = min(k, len(candidates))
+
+        local = self._local is not None and len(self._local) == len(self.docs)
+        if not local and not (self.embeddings and len(self.embeddings) == len(self.docs)):
+            return [self.docs[i] for i in candidates[:k]]
+
+        key = (len(self.docs), normalize_query(query))
+        top_key = (tags, k)
+        entry = self.query_cache.get(key)
+        if entry is not None and top_key in entry["top"]:
+            self.query_cache.count("hits")
+            return [self.docs[i] for i in entry["top"][top_key]]
+
+        if entry is not None:
+            self.query_cache.count("vector_hits")
+            qvec = entry["vec"]
+        else:
+            self.query_cache.count("misses")
+            if local:
+                qvec = self._local.query_vector(query)
+            else:
+                try:
+                    qvec = self._embed(query)
+                except Exception as e:
+                    print(f"[VectorStore] query embedding 失败，返回前 {k} 个文档：{e}")
+                    return [self.docs[i] for i in candidates[:k]]
+            entry = {"vec": qvec, "top": {}}
+
+        if local:
+            partition = None if tags is None else "|".join(tags)
+            top = [i for i, _ in self._local.search_vector(qvec, k, partition=partition)]
+        else:
+            top = sorted(
+                candidates,
+                key=lambda i: self._cosine_similarity(qvec, self.embeddings[i]),
+                reverse=True,
+            )[:k]
+        entry["top"][top_key] = top
+        self.query_cache.put(key, entry)
+        return [self.docs[i] for i in top]
@@ -4,49 +4,144 @@
 #   python web_chat.py
 #
 # 然后浏览器打开：http://127.0.0.1:5000
+# LLM 调用指标：http://127.0.0.1:5000/metrics（?recent=N 附带最近 N 条调用记录）
 #
+# 生产方式（多用户并发）：用 waitress 代替 Flask 开发服务器
+#   set WEB_CHAT_SERVER=waitress   (Linux: export WEB_CHAT_SERVER=waitress)
+#   python web_chat.py
+#
+# 下面的配置都可以用同名环境变量覆盖（压测 loadtest_web_chat.py 就是这样把它指向假 Ollama 的）。
+#
+import os
+import threading
+import time
+from collections import OrderedDict
+
 from flask import Flask, request, jsonify, render_template_string
-from ollama_client import OllamaChatModel, Message
+from ollama_client import Message, CHAT_SINGLE_FLIGHT
+from model_router import ModelRouter
+from backend_pool import BackendPool
+from chat_memory import ConversationMemory, attach_memory
 from chat_session import ToolRAGChatSession
-from vectorstore import SimpleVectorStore
+from vectorstore import SimpleVectorStore, EMBED_SINGLE_FLIGHT
 from kb_loader import load_knowledge_from_folder
 
 # === 配置区域 ===
 
 # 知识库目录：改成你自己的
-KNOWLEDGE_FOLDER = r"D:\agent_kb"   # 例如：D:\agent_kb\note1.txt
+KNOWLEDGE_FOLDER = os.environ.get("KNOWLEDGE_FOLDER", r"D:\agent_kb")   # 例如：D:\agent_kb\note1.txt
 
 # Ollama 配置：模型名要改成你实际用的
-OLLAMA_MODEL_NAME = "gpt-oss:20b"
-OLLAMA_BASE_URL = "http://127.0.0.1:11434"
+OLLAMA_MODEL_NAME = os.environ.get("OLLAMA_MODEL_NAME", "gpt-oss:20b")
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
+EMBED_MODEL_NAME = os.environ.get("EMBED_MODEL_NAME", "local-tfidf")   # local-tfidf：本地向量化，不需要 embedding 服务
+# 多个 Ollama 实例：逗号分隔的 base_url 列表，非空时忽略 OLLAMA_BASE_URL，
+# 同一 session 尽量落到同一实例（复用 KV cache）
+OLLAMA_BACKEND_URLS = os.environ.get("OLLAMA_BACKEND_URLS", "")
 
 # 每次检索返回几条文档
-RAG_TOP_K = 3
+RAG_TOP_K = int(os.environ.get("RAG_TOP_K", "3"))
+# 只检索带这些标签的文档（逗号分隔，标签见 kb_loader.derive_tags）；为空表示检索整个知识库
+WEB_CHAT_RETRIEVAL_TAGS = [t for t in os.environ.get("WEB_CHAT_RETRIEVAL_TAGS", "").split(",") if t.strip()] or None
+
+# 服务方式："dev"（Flask 开发服务器）/ "waitress"（生产 WSGI 服务器，多线程）
+WEB_CHAT_SERVER = os.environ.get("WEB_CHAT_SERVER", "dev")
+WEB_CHAT_HOST = os.environ.get("WEB_CHAT_HOST", "127.0.0.1")
+WEB_CHAT_PORT = int(os.environ.get("WEB_CHAT_PORT", "5000"))
+WEB_CHAT_DEBUG = os.environ.get("WEB_CHAT_DEBUG", "1") == "1"      # 仅 dev 模式生效
+WEB_CHAT_THREADS = int(os.environ.get("WEB_CHAT_THREADS", "16"))   # 仅 waitress 模式生效
+
+# 会话记忆：每轮发送的上下文不超过 token 预算，最近 N 轮原样保留，更早的轮次后台折叠成摘要
+WEB_CHAT_TOKEN_BUDGET = int(os.environ.get("WEB_CHAT_TOKEN_BUDGET", "6000"))
+WEB_CHAT_KEEP_TURNS = int(os.environ.get("WEB_CHAT_KEEP_TURNS", "4"))
+
+# 模型路由：对话走主模型（WEB_CHAT_LLM_SLOTS 限制同时在飞的请求数，0 表示不限），
+# 后台的对话摘要可以交给更小的模型
+WEB_CHAT_LLM_SLOTS = int(os.environ.get("WEB_CHAT_LLM_SLOTS", "0"))
+WEB_CHAT_MEMORY_MODEL = os.environ.get("WEB_CHAT_MEMORY_MODEL", OLLAMA_MODEL_NAME)
+
+# 会话回收：空闲超过 TTL 的会话、以及超出上限时最久未用的会话会被丢弃（下次请求重新开一个新会话）。
+# 回收在处理请求时顺带进行，正在处理请求的会话跳过，所以上限是软上限（最多多出并发请求数个）
+WEB_CHAT_MAX_SESSIONS = int(os.environ.get("WEB_CHAT_MAX_SESSIONS", "1000"))
+WEB_CHAT_SESSION_TTL_S = float(os.environ.get("WEB_CHAT_SESSION_TTL_S", "3600"))
 
 # =============================
 
 app = Flask(__name__)
 
+backend_pool = BackendPool(OLLAMA_BACKEND_URLS).start() if OLLAMA_BACKEND_URLS else None
+
 # ---- 构建向量库（只在启动时做一次） ----
 vector_store = SimpleVectorStore(
-    embed_model="nomic-embed-text",
+    embed_model=EMBED_MODEL_NAME,
     base_url=OLLAMA_BASE_URL,
+    backends=backend_pool,
 )
 docs = load_knowledge_from_folder(KNOWLEDGE_FOLDER)
 if not docs:
     print("提示：知识库为空，当前 RAG 不会起作用。")
 else:
     vector_store.add_documents(docs)
-    print(f"知识库已加载：{len(docs)} 个文档 chunks")
+    print(f"知识库已加载：{len(docs)} 个文档 chunks，标签：{vector_store.tag_counts()}")
 
-# ---- 构建模型封装（共享一个） ----
-model = OllamaChatModel(
-    model_name=OLLAMA_MODEL_NAME,
+# ---- 构建模型封装（所有会话共享一个路由器） ----
+router = ModelRouter(
+    {
+        "web_chat": {"model": OLLAMA_MODEL_NAME, "slots": WEB_CHAT_LLM_SLOTS},
+        "memory": {"model": WEB_CHAT_MEMORY_MODEL, "slots": 1, "options": {"num_predict": 600}},
+    },
     base_url=OLLAMA_BASE_URL,
+    backends=backend_pool,
 )
+model = router.for_agent("web_chat")
+memory_model = router.for_agent("memory")
 
 # ---- 会话管理：用 session_id 区分多个会话 ----
-SESSIONS = {}  # session_id -> ToolRAGChatSession
+SESSIONS = OrderedDict()  # session_id -> ToolRAGChatSession，按最近使用排序（最久未用的在前）
+# 多线程服务时：_SESSIONS_LOCK 保护 SESSIONS 的创建 / 回收；同一会话的请求串行执行，避免 history 交错
+_SESSIONS_LOCK = threading.Lock()
+_SESSION_LOCKS = {}  # session_id -> threading.Lock
+_SESSION_LAST_USED = {}  # session_id -> 最近一次请求的时间
+_SESSION_STATS = {"created": 0, "evicted": 0}
+
+
+def _evict_sessions_locked(now: float, keep: str) -> None:
+    """
+    调用方持有 _SESSIONS_LOCK。正在处理请求的会话（会话锁被占用）和本次请求的会话 keep 不回收。
+    """
+    for session_id in list(SESSIONS):
+        if session_id == keep:
+            continue
+        over_cap = len(SESSIONS) > WEB_CHAT_MAX_SESSIONS
+        idle = now - _SESSION_LAST_USED[session_id] > WEB_CHAT_SESSION_TTL_S
+        if not over_cap and not idle:
+            break   # 按最近使用排序，后面的都更新
+        if _SESSION_LOCKS[session_id].locked():
+            continue
+        del SESSIONS[session_id]
+        del _SESSION_LOCKS[session_id]
+        del _SESSION_LAST_USED[session_id]
+        _SESSION_STATS["evicted"] += 1
+
+
+def get_session(session_id: str):
+    """
+    返回 (会话, 会话锁)；不存在时新建，同时顺带回收空闲 / 超额的会话。
+    """
+    now = time.time()
+    with _SESSIONS_LOCK:
+        session = SESSIONS.get(session_id)
+        if session is None:
+            session = create_new_session()
+            SESSIONS[session_id] = session
+            _SESSION_LOCKS[session_id] = threading.Lock()
+            _SESSION_STATS["created"] += 1
+        else:
+            SESSIONS.move_to_end(session_id)
+        _SESSION_LAST_USED[session_id] = now
+        session_lock = _SESSION_LOCKS[session_id]
+        _evict_sessions_locked(now, keep=session_id)
+    return session, session_lock
 
 
 def create_new_session() -> ToolRAGChatSession:
@@ -54,6 +149,8 @@ def create_new_session() -> ToolRAGChatSession:
         model=model,
         retriever=vector_store,
         k=RAG_TOP_K,
+        label="web_chat",
+        retrieval_filter=WEB_CHAT_RETRIEVAL_TAGS,
     )
     # 初始化 system prompt
     session.history.append(
@@ -66,7 +163,15 @@ def create_new_session() -> ToolRAGChatSession:
             ),
         )
     )
-    return session
+    return attach_memory(
+        session,
+        ConversationMemory(
+            memory_model,
+            token_budget=WEB_CHAT_TOKEN_BUDGET,
+            keep_turns=WEB_CHAT_KEEP_TURNS,
+            label="web_chat_memory",
+        ),
+    )
 
 
 # ---- 简单的 HTML 模板（用 render_template_string 渲染） ----
@@ -259,16 +364,42 @@ def api_chat():
         return jsonify({"reply": ""})
 
     # 获取 / 创建会话
-    session = SESSIONS.get(session_id)
-    if session is None:
-        session = create_new_session()
-        SESSIONS[session_id] = session
+    session, session_lock = get_session(session_id)
 
     # 调用你的 ToolRAGChatSession
-    reply = session.ask(user_msg)
+    with session_lock:
+        reply = session.ask(user_msg)
     return jsonify({"reply": reply})
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    with _SESSIONS_LOCK:
+        sessions = list(SESSIONS.values())
+        session_stats = dict(_SESSION_STATS)
+    out = {
+        "llm": model.metrics.snapshot(),
+        "routes": router.snapshot(),
+        "backends": backend_pool.snapshot() if backend_pool is not None else None,
+        "single_flight": {"chat": CHAT_SINGLE_FLIGHT.snapshot(), "embed": EMBED_SINGLE_FLIGHT.snapshot()},
+        "retrieval": vector_store.query_cache.snapshot(),
+        "sessions": len(sessions),
+        "sessions_created": session_stats["created"],
+        "sessions_evicted": session_stats["evicted"],
+        "history_messages": sum(len(s.history) for s in sessions),
+    }
+    recent = request.args.get("recent", type=int)
+    if recent:
+        out["recent_calls"] = model.metrics.recent(recent)
+    return jsonify(out)
+
+
 if __name__ == "__main__":
     # 默认监听 127.0.0.1:5000
-    app.run(host="127.0.0.1", port=5000, debug=True)
+    if WEB_CHAT_SERVER == "waitress":
+        from waitress import serve
+
+        print(f"[web_chat] waitress 监听 http://{WEB_CHAT_HOST}:{WEB_CHAT_PORT}（{WEB_CHAT_THREADS} 线程）")
+        serve(app, host=WEB_CHAT_HOST, port=WEB_CHAT_PORT, threads=WEB_CHAT_THREADS)
+    else:
+        app.run(host=WEB_CHAT_HOST, port=WEB_CHAT_PORT, debug=WEB_CHAT_DEBUG, threaded=True)
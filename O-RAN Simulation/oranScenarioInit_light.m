@@ -15,7 +15,12 @@ function env = oranScenarioInit_light()
 
 %% 0) 支持包检查 & 初始化
 wirelessnetworkSupportPackageCheck;
-rng("shuffle");   % 每次运行产生不同拓扑 / 业务分配
+global RIC_simSeed
+if ~isempty(RIC_simSeed)
+    rng(RIC_simSeed);   % 控制 JSON 指定了 seed：固定拓扑 / 业务分配，便于复现
+else
+    rng("shuffle");     % 每次运行产生不同拓扑 / 业务分配
+end
 
 % ✅ 正确：使用静态 init，一次性返回已经 init 好的 simulator 对象
 networkSimulator = wirelessNetworkSimulator.init;
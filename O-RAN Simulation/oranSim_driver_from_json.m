@@ -35,6 +35,14 @@ function oranSim_driver_from_json(controlPath)
     prevPolicy = ctrl.prev_policy;
     currPolicy = ctrl.curr_policy;
 
+    % 可选字段 seed：由 Python 侧（sweep / 结果缓存）指定，保证同一配置可复现
+    global RIC_simSeed
+    if isfield(ctrl, "seed") && ~isempty(ctrl.seed)
+        RIC_simSeed = ctrl.seed;
+    else
+        RIC_simSeed = [];
+    end
+
     % === 2) 调用你之前写好的 two-phase 仿真封装 ===
     % 这里会在 resultDir 下生成 res_round_<roundIdx>.json
     resPath = oranSim_run_two_phase_10s(roundIdx, prevPolicy, currPolicy, intentDesc, resultDir);
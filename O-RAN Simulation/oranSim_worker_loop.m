@@ -0,0 +1,85 @@
+function oranSim_worker_loop(mailboxDir)
+% oranSim_worker_loop
+% 常驻仿真 worker：Matlab 只启动一次，之后循环从 mailbox 里取控制 JSON 执行仿真，
+% 省掉每一轮 matlab -batch 冷启动 + 工具箱加载 / JIT 预热的开销。
+%
+% 目录约定（由 Python 侧 sim_worker_pool.py 创建和管理）：
+%   <mailboxDir>/inbox/job_<id>.json    待执行的控制文件（格式同 oranSim_driver_from_json）
+%   <mailboxDir>/outbox/job_<id>.done   执行结果：{"ok":true,"result_path":...} 或 {"ok":false,"error":...}
+%   <mailboxDir>/heartbeat              每次空闲轮询、以及每个任务写 .done 之前都会刷新，Python 用它做健康检查
+%   <mailboxDir>/stop                   出现该文件时退出循环
+%
+% 用法（由 Python 调用 matlab.exe -batch）：
+%   matlab -batch "cd('D:/.../O-RAN Simulation'); oranSim_worker_loop('D:/oran_logs/sim_pool/worker_0');"
+
+    if nargin < 1 || isempty(mailboxDir)
+        error("必须提供 mailboxDir 参数（worker 的 mailbox 目录）。");
+    end
+
+    inboxDir  = fullfile(mailboxDir, "inbox");
+    outboxDir = fullfile(mailboxDir, "outbox");
+    if ~exist(inboxDir, "dir"),  mkdir(inboxDir);  end
+    if ~exist(outboxDir, "dir"), mkdir(outboxDir); end
+
+    fprintf("【Matlab worker】启动，mailbox = %s\n", mailboxDir);
+
+    while true
+        if exist(fullfile(mailboxDir, "stop"), "file")
+            fprintf("【Matlab worker】收到 stop 文件，退出。\n");
+            break;
+        end
+
+        writeHeartbeat(mailboxDir);
+
+        jobs = dir(fullfile(inboxDir, "job_*.json"));
+        if isempty(jobs)
+            pause(0.2);
+            continue;
+        end
+
+        % 按写入时间先后处理
+        [~, order] = sort([jobs.datenum]);
+        job = jobs(order(1));
+        jobPath = fullfile(inboxDir, job.name);
+        [~, jobName] = fileparts(job.name);
+        donePath = fullfile(outboxDir, [char(jobName) '.done']);
+
+        status = struct();
+        try
+            ctrl = jsondecode(fileread(jobPath));
+            oranSim_driver_from_json(jobPath);
+            status.ok = true;
+            status.result_path = fullfile(ctrl.result_dir, sprintf("res_round_%d.json", ctrl.round_idx));
+        catch ME
+            status.ok = false;
+            status.error = ME.message;
+        end
+        delete(jobPath);
+
+        % 仿真期间心跳不会刷新；先刷新再写 .done，Python 取完结果立刻派下一个任务时健康检查不会误判
+        writeHeartbeat(mailboxDir);
+        writeTextAtomic(donePath, jsonencode(status));
+    end
+end
+
+
+function writeHeartbeat(mailboxDir)
+    fid = fopen(fullfile(mailboxDir, "heartbeat"), "w");
+    if fid ~= -1
+        fprintf(fid, "%s", datestr(now, "yyyy-mm-dd HH:MM:SS.FFF"));
+        fclose(fid);
+    end
+end
+
+
+function writeTextAtomic(path, txt)
+    % 先写临时文件再 movefile，Python 侧不会读到半个 .done
+    tmpPath = [char(path) '.tmp'];
+    fid = fopen(tmpPath, "w");
+    if fid == -1
+        error("无法写入文件: %s", tmpPath);
+    end
+    fwrite(fid, txt, "char");
+    fclose(fid);
+    movefile(tmpPath, path, "f");
+end